@@ -1,23 +1,57 @@
-from flask import Flask, jsonify
-from werkzeug.exceptions import HTTPException
-import os
+import math
 import traceback
-
-from.extensions import db, migrate, socketio, jwt, cache, cors
-from.models import Cab
 from config import Config
-import flask_monitoringdashboard as dashboard
+
+# Importing the package loads nothing else: create_app() imports Flask and the app's
+# components, so tools that only need a leaf module (app.road_graph, app.geo,
+# app.graph_pipeline, app.osm_reader) run without the web app's dependencies.
+
+def __getattr__(name):
+    # `from app import db, socketio`, as run.py and simulate_cabs.py do
+    if name in ('db', 'socketio'):
+        from . import extensions
+        return getattr(extensions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_app(config_class=Config):
+    from flask import Flask, jsonify
+    from werkzeug.exceptions import HTTPException
+    from .extensions import db, migrate, socketio, jwt, cache, cors
+    from .models import Cab
+    from .fleet import fleet
+    from .location_buffer import location_buffer
+    from .broadcast import broadcaster
+    from .batch_allocation import batch_window
+    from .allocation_queue import allocation_queue
+    from .route_cache import route_cache
+    from .eta import eta_tracker
+    from .dashboard_state import dashboard_state
+    from .profiler import request_profiler
+    from . import database, instrumentation
+    from .instrumentation import on_event
+    from .utils import warm_up_road_network
+
     app = Flask(__name__)
     app.config.from_object(config_class)
 
     # Initialize Flask extensions
+    database.configure_engine(app)
     db.init_app(app)
+    database.init_app(app)
+    instrumentation.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     cache.init_app(app)
     cors.init_app(app)
+    fleet.init_app(app)
+    location_buffer.init_app(app)
+    broadcaster.init_app(app)
+    batch_window.init_app(app)
+    allocation_queue.init_app(app)
+    route_cache.init_app(app)
+    eta_tracker.init_app(app)
+    dashboard_state.init_app(app)
+    request_profiler.init_app(app)
 
     # for "Real-Time Location Data Integration"
     # We pass the app instance to SocketIO after all other initializations.
@@ -33,10 +67,18 @@ def create_app(config_class=Config):
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(employee_bp, url_prefix='/employee')
 
-    # for "System Monitoring"
-    dashboard.config.enable_telemetry = False # to save our time when monitoring
-    # dashboard.config.BLUEPRINT_NAME = ['auth_bp', 'admin_bp', 'employee_bp', 'home_bp']
-    dashboard.bind(app)
+    # for "System Monitoring". Imported here rather than at the top: it takes over half a
+    # second, which workers started with MONITORING_DASHBOARD=0 don't need to pay
+    if app.config.get('MONITORING_DASHBOARD', True):
+        import flask_monitoringdashboard as dashboard
+        dashboard.config.enable_telemetry = False # to save our time when monitoring
+        # dashboard.config.BLUEPRINT_NAME = ['auth_bp', 'admin_bp', 'employee_bp', 'home_bp']
+        dashboard.bind(app)
+
+    # The road graph (and sklearn/scipy with it) is loaded in the background instead of
+    # on import, so the worker serves pages right away; /ready says when routing is up
+    if app.config.get('GRAPH_WARMUP', True):
+        socketio.start_background_task(warm_up_road_network)
 
     # A centralized handler for all HTTP exceptions.
     @app.errorhandler(HTTPException)
@@ -64,21 +106,60 @@ def create_app(config_class=Config):
     #defines the WebSocket event handlers for real-time communication.
     from flask_socketio import join_room
 
-    @socketio.on('connect')
+    @on_event('connect')
     def handle_connect():
         print('Client connected')
 
-    @socketio.on('join_admin_room')
+    @on_event('join_admin_room')
     def handle_join_admin_room():
         # to broadcast messages specifically to admins
         join_room('admins')
         print('An admin connected and joined the admin room.')
 
-    @socketio.on('disconnect')
+    @on_event('join_employee_room')
+    def handle_join_employee_room(data=None):
+        # 'employees' gets the on-trip cab batches, the personal room is for per-employee pushes
+        join_room('employees')
+        if data and data.get('public_id'):
+            join_room(f"employee_{data['public_id']}")
+
+    @on_event('disconnect')
     def handle_disconnect():
         print('Client disconnected')
 
-    @socketio.on('update_location')
+    def apply_location_update(cab_id, lat, lon):
+        # Needs an app context. The live fleet store is the hot path; only cabs it has never
+        # seen hit the DB. A ping only moves the cab: its status is the server's, changed by
+        # the claim, finish and cancel paths (fleet.set_status), never by the client.
+        # Clients may send the id and coordinates as strings: normalised here, as the fleet
+        # store is keyed by the id, so "1" would otherwise be a second cab 1.
+        try:
+            cab_id, lat, lon = int(cab_id), float(lat), float(lon)
+        except (TypeError, ValueError):
+            return
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return
+
+        fleet.ensure_loaded()
+        if cab_id not in fleet:
+            cab = db.session.get(Cab, cab_id)
+            if not cab:
+                return
+            fleet.update(cab.id, cab.current_lat, cab.current_lon, cab.status)
+
+        status = fleet.update(cab_id, lat, lon)
+
+        # Persisted in batches by the write-behind buffer, not one commit per ping
+        location_buffer.add(cab_id, lat, lon)
+
+        # Queued for the next batched 'location_batch' frame
+        broadcaster.publish(cab_id, lat, lon, status)
+
+        # Moves the cab along its trip route, no routing per ping
+        eta_tracker.ensure_loaded()
+        eta_tracker.update(cab_id, lat, lon)
+
+    @on_event('update_location')
     def handle_location_update(data):
         # In a real app, we will authenticate this update (e.g. a JWT sent in the connection headers)
         cab_id = data.get('cab_id')
@@ -89,18 +170,16 @@ def create_app(config_class=Config):
             return
 
         with app.app_context():
-            cab = Cab.query.get(cab_id)
-            if cab:
-                cab.current_lat = lat
-                cab.current_lon = lon
-                db.session.commit()
-                
-                # Broadcast the update to all connected clients
-                socketio.emit('location_update', {
-                    'cab_id': cab.id,
-                    'lat': cab.current_lat,
-                    'lon': cab.current_lon,
-                    'status': cab.status
-                })
+            apply_location_update(cab_id, lat, lon)
+
+    @on_event('update_locations')
+    def handle_location_updates(data):
+        # Batched form of update_location for simulators and gateways that relay many cabs:
+        # {'cabs': [[cab_id, lat, lon], ...]}; anything after lon (older clients sent a
+        # status) is ignored
+        with app.app_context():
+            for cab_id, lat, lon, *_ in data.get('cabs', []):
+                if all([cab_id, lat, lon]):
+                    apply_location_update(cab_id, lat, lon)
 
     return app
\ No newline at end of file
@@ -1,8 +1,12 @@
-from flask import request, jsonify
+from flask import request, jsonify, Response
 from . import admin_bp
 from ..models import Trip, Cab, User
-from ..extensions import db, socketio
-from ..utils import allocate_cab_to_trip
+from ..extensions import db
+from ..fleet import fleet
+from ..dashboard_state import dashboard_state, notify_trip_requested
+from ..allocation_queue import allocate_trip
+from ..batch_allocation import allocate_trips_in_batch
+from ..profiler import request_profiler
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask import render_template
 
@@ -14,35 +18,56 @@ def is_admin(public_id):
 @admin_bp.route('/dashboard')
 @jwt_required()
 def dashboard_view():
-    # Fetch all cabs
-    all_cabs_query = Cab.query.all()
-    all_cabs = []
-    for cab in all_cabs_query:
-        all_cabs.append({
-            'id': cab.id,
-            'driver_name': cab.driver_name,
-            'license_plate': cab.license_plate,
-            'current_lat': cab.current_lat,
-            'current_lon': cab.current_lon,
-            'status': cab.status
-        })
-
-    # Fetch pending trip requests
-    pending_trips_query = Trip.query.filter_by(status='requested').all()
-    pending_trips = []
-    for trip in pending_trips_query:
-        # Fetch the employee to get their public ID for consistency
-        employee = User.query.get(trip.employee_id)
-        if employee:
-            pending_trips.append({
-                'id': trip.id,
-                'employee_id': employee.public_id, 
-                'start_lat': trip.start_lat,
-                'start_lon': trip.start_lon
-            })
-
-    return render_template('index.html', all_cabs=all_cabs, pending_trips=pending_trips)
+    # Only the page shell: the map fetches cabs and trips from /admin/state, so the page
+    # loads in the same time for any fleet size
+    return render_template('index.html')
 
+@admin_bp.route('/state')
+@jwt_required()
+def dashboard_state_view():
+    """
+    Dashboard state as JSON. Without `since`, a snapshot of every cab and of the requested
+    and in-progress trips. With `since=<version>` (the version of an earlier response),
+    only the cabs and trips that changed after it. When the delta can't be served (the
+    version is too old, or from before a server restart) a snapshot is sent instead;
+    `snapshot: true` tells the client to replace what it has.
+    Cabs are [cab_id, lat, lon, status] rows, like in 'location_batch' frames.
+    """
+    current_user_id = get_jwt_identity()
+    if not is_admin(current_user_id):
+        return jsonify({"message": "Admin access required"}), 403
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changes = dashboard_state.changes_since(since)
+        if changes is not None:
+            version, cabs, trips = changes
+            return jsonify({
+                "version": version,
+                "snapshot": False,
+                "cabs": [row for row, _ in cabs],
+                "trips": trips
+            }), 200
+
+    # The version is taken before reading, so changes made while reading are sent again
+    # with the next delta rather than lost
+    version = dashboard_state.version
+
+    # Live positions from the fleet store, not a scan of the cab table
+    fleet.ensure_loaded()
+    cabs = fleet.rows()
+
+    # Requested and in-progress trips joined with the employee for their public ID
+    trips = [
+        {'id': trip_id, 'status': status, 'employee_id': public_id, 'start_lat': start_lat, 'start_lon': start_lon, 'cab_id': cab_id}
+        for trip_id, status, public_id, start_lat, start_lon, cab_id in db.session.execute(
+            db.select(Trip.id, Trip.status, User.public_id, Trip.start_lat, Trip.start_lon, Trip.cab_id)
+            .join(User, User.id == Trip.employee_id)
+            .where(Trip.status.in_(('requested', 'in_progress')))
+        )
+    ]
+
+    return jsonify({"version": version, "snapshot": True, "cabs": cabs, "trips": trips}), 200
 
 @admin_bp.route('/trips', methods=['GET','POST'])
 @jwt_required() 
@@ -63,6 +88,7 @@ def create_trip():
     )
     db.session.add(new_trip)
     db.session.commit()
+    notify_trip_requested(new_trip.id, user.public_id, new_trip.start_lat, new_trip.start_lon)
     return jsonify({"message": "Trip created", "trip_id": new_trip.id}), 201
 
 @admin_bp.route('/trips/<int:trip_id>/allocate', methods=['POST'])
@@ -76,39 +102,75 @@ def allocate_cab(trip_id):
     if trip.status != 'requested':
         return jsonify({"message": "Trip is not in 'requested' state"}), 400
 
-    best_cab, message = allocate_cab_to_trip(trip)
-
-    if not best_cab:
+    # Same path as employee requests; without a cab the trip stays 'requested' for a retry
+    allocation_data, message = allocate_trip(trip, cancel_unassigned=False)
+    if not allocation_data:
         return jsonify({"message": message}), 404
 
-    # Assign the cab and update statuses
-    trip.cab_id = best_cab.id
-    trip.status = 'in_progress'
-    best_cab.status = 'on_trip'
-    best_cab.destination_latitude = trip.start_lat
-    best_cab.destination_longitude = trip.start_lon
+    return jsonify({
+        "message": f"Cab {allocation_data['cab_id']} allocated to trip {allocation_data['trip_id']}",
+        "cab_id": allocation_data['cab_id'],
+        "trip_id": allocation_data['trip_id']
+    }), 200
 
-    employee_user = User.query.get(trip.employee_id)
-    employee_user.current_trip_status = 'in_trip'
-    employee_user.current_trip_id = trip.id
+@admin_bp.route('/trips/allocate-batch', methods=['POST'])
+@jwt_required()
+def allocate_pending_trips():
+    current_user_id = get_jwt_identity()
+    if not is_admin(current_user_id):
+        return jsonify({"message": "Admin access required"}), 403
 
-    db.session.commit()
+    # Solve every pending request together instead of first-come-first-served
+    pending_trips = Trip.query.filter_by(status='requested').all()
+    if not pending_trips:
+        return jsonify({"message": "No pending trips", "allocated": [], "unallocated": []}), 200
 
-    # Notify dashboards in real-time
-    employee_user = User.query.get(trip.employee_id)
-    allocation_data = {
-        'trip_id': trip.id,
-        'employee_id': employee_user.public_id,
-        'employee_lat': trip.start_lat,
-        'employee_lon': trip.start_lon,
-        'cab_id': best_cab.id,
-        'cab_lat': best_cab.current_lat,
-        'cab_lon': best_cab.current_lon
-    }
-    socketio.emit('trip_allocated', allocation_data)
+    allocated, unallocated = allocate_trips_in_batch(pending_trips)
 
     return jsonify({
-        "message": f"Cab {best_cab.id} allocated to trip {trip.id}",
-        "cab_id": best_cab.id,
-        "trip_id": trip.id
-    }), 200
\ No newline at end of file
+        "message": f"{len(allocated)} of {len(pending_trips)} pending trips allocated",
+        "allocated": allocated,
+        "unallocated": unallocated
+    }), 200
+
+@admin_bp.route('/profiler', methods=['GET', 'POST'])
+@jwt_required()
+def profiler_view():
+    """
+    Status of the allocation request profiler (see app/profiler.py). POST
+    {"percent": 10, "interval_ms": 5} switches it on for 10% of the trip request and
+    allocate requests, {"percent": 0} switches it off and writes the profile to a file.
+    """
+    current_user_id = get_jwt_identity()
+    if not is_admin(current_user_id):
+        return jsonify({"message": "Admin access required"}), 403
+
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        percent = data.get('percent')
+        interval_ms = data.get('interval_ms')
+        if not isinstance(percent, (int, float)) or not 0 <= percent <= 100:
+            return jsonify({"message": "percent must be a number from 0 to 100"}), 400
+        if interval_ms is not None and (not isinstance(interval_ms, (int, float)) or interval_ms <= 0):
+            return jsonify({"message": "interval_ms must be a positive number"}), 400
+
+        if percent:
+            request_profiler.enable(percent, interval_ms / 1000 if interval_ms else None)
+        else:
+            request_profiler.disable()
+
+    return jsonify(request_profiler.status()), 200
+
+@admin_bp.route('/profiler/profile')
+@jwt_required()
+def profiler_profile():
+    """The profile collected so far as collapsed stacks (`?target=` for one endpoint), for flamegraph.pl or speedscope."""
+    current_user_id = get_jwt_identity()
+    if not is_admin(current_user_id):
+        return jsonify({"message": "Admin access required"}), 403
+
+    return Response(
+        request_profiler.collapsed(request.args.get('target')),
+        mimetype='text/plain',
+        headers={'Content-Disposition': 'attachment; filename=allocation-profile.folded'}
+    )
@@ -0,0 +1,127 @@
+import time
+from .extensions import db, socketio
+from .instrumentation import emit, phase
+from .fleet import fleet
+from .eta import eta_tracker
+from .dashboard_state import dashboard_state, notify_trip_cancelled
+from .models import Trip, User
+from .utils import assign_cab_to_trip, cancel_trips
+from . import metrics
+
+# Trip allocation as a queued job. Employee trip requests are answered with 202 and the
+# trip id right away; a small pool of background workers takes the trip ids off an
+# in-process queue, runs the allocation and pushes the outcome to the dashboards over
+# 'trip_allocated' (or 'trip_cancelled' to the admins and the employee's room). No broker
+# needed: the queue comes from the Socket.IO server, so it is an eventlet queue under
+# eventlet and a plain queue.Queue with threads. Trips waiting in it are already in the
+# DB as 'requested'.
+
+queue_depth = metrics.gauge('allocation_queue_depth', 'Trips waiting in the allocation queue')
+wait_seconds = metrics.histogram('allocation_queue_wait_seconds', 'Time a trip waits in the queue before a worker takes it')
+job_seconds = metrics.histogram('allocation_job_seconds', 'Time a worker spends allocating one trip')
+jobs_total = metrics.counter('allocation_jobs_total', 'Allocation jobs processed')
+jobs_failed_total = metrics.counter('allocation_jobs_failed_total', 'Allocation jobs that raised an error')
+
+def allocate_trip(trip, cancel_unassigned=True):
+    """
+    Allocate the nearest available cab to a 'requested' trip, commit and notify the
+    dashboards. The one assignment path for single trips: employee requests, queued jobs
+    and the admin "allocate" button. Without a cab the trip is cancelled, or stays
+    'requested' with cancel_unassigned=False.
+    Returns (the 'trip_allocated' payload, or None, and a message).
+    """
+    trip_id = trip.id
+    best_cab, message = assign_cab_to_trip(trip)
+    if not best_cab and not cancel_unassigned:
+        db.session.rollback()
+        return None, message
+    employee_user = db.session.get(User, trip.employee_id)
+
+    if not best_cab:
+        # Only if the trip is still waiting: it may have been allocated elsewhere meanwhile
+        cancelled = cancel_trips([trip_id])
+        db.session.commit()
+        if cancelled:
+            notify_trip_cancelled(trip_id, employee_user.public_id if employee_user else None, message)
+        return None, message
+
+    # The cab and the trip are already claimed (see utils.claim_cabs), only the employee is left
+    employee_user.current_trip_status = 'in_trip'
+    employee_user.current_trip_id = trip_id
+
+    # Read before the commit expires the objects, so the notification needs no reloads
+    allocation_data = {
+        'trip_id': trip_id,
+        'employee_id': employee_user.public_id,
+        'employee_lat': trip.start_lat,
+        'employee_lon': trip.start_lon,
+        'cab_id': best_cab.id,
+        'cab_lat': best_cab.current_lat,
+        'cab_lon': best_cab.current_lon
+    }
+
+    with phase('commit'):
+        db.session.commit()
+    fleet.set_status(allocation_data['cab_id'], 'on_trip')
+
+    # Notify dashboards in real-time
+    emit('trip_allocated', allocation_data)
+    dashboard_state.trip_allocated(allocation_data)
+    eta_tracker.start(allocation_data)
+    return allocation_data, message
+
+class AllocationQueue:
+    def __init__(self):
+        self.app = None
+        self.workers = 2
+        self._queue = None
+        self._tasks = []
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('ALLOCATION_WORKERS', self.workers)
+        # created on first use, once the Socket.IO server (and its async mode) exists
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def enabled(self):
+        return bool(self.workers)
+
+    def __len__(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, trip_id):
+        if self._queue is None:
+            self._queue = socketio.server.eio.create_queue()
+            self._tasks = [socketio.start_background_task(self._work) for _ in range(self.workers)]
+        self._queue.put((trip_id, time.monotonic()))
+        queue_depth.inc()
+
+    def _work(self):
+        while True:
+            trip_id, enqueued_at = self._queue.get()
+            queue_depth.dec()
+            wait_seconds.observe(time.monotonic() - enqueued_at)
+
+            started = time.perf_counter()
+            try:
+                self.run_job(trip_id)
+            except Exception:
+                jobs_failed_total.inc()
+                self.app.logger.exception(f"Allocation of trip {trip_id} failed")
+            job_seconds.observe(time.perf_counter() - started)
+            jobs_total.inc()
+
+            # Allocation is CPU-bound; give requests and the other workers a turn in between
+            socketio.sleep(0)
+
+    def run_job(self, trip_id):
+        with self.app.app_context():
+            trip = db.session.get(Trip, trip_id)
+            # An admin may have allocated the trip while it was queued
+            if trip is None or trip.status != 'requested':
+                return
+            allocate_trip(trip)
+
+allocation_queue = AllocationQueue()
@@ -0,0 +1,150 @@
+import threading
+from .extensions import db, socketio
+from .instrumentation import emit, phase
+from .fleet import fleet
+from .eta import eta_tracker
+from .dashboard_state import dashboard_state, notify_trip_cancelled
+from .models import Trip, User
+from .utils import (
+    MAX_ALLOCATION_ATTEMPTS, allocate_cabs_to_trips, claim_cabs, claim_trips, release_cabs, cancel_trips, forget_taken_cabs
+)
+
+# Batch allocation: solve many 'requested' trips at once (see utils.allocate_cabs_to_trips)
+# and commit all the assignments in one transaction. Used by the admin "allocate all"
+# endpoint and, when BATCH_ALLOCATION_WINDOW is set, by the micro-batching window that
+# collects employee trip requests for a couple of seconds before allocating them together.
+
+def allocate_trips_in_batch(trips, cancel_unassigned=False):
+    """
+    Allocate cabs to `trips` (all in 'requested' state), commit once and notify dashboards.
+    Trips that get no cab stay 'requested', or are cancelled when cancel_unassigned=True.
+    Returns (allocated, unallocated) as lists of dicts ready for a JSON response.
+    """
+    employee_ids = {trip.employee_id for trip in trips}
+    employees = {user.id: user for user in User.query.filter(User.id.in_(employee_ids)).all()}
+
+    # Claim the matched cabs (see utils.claim_cabs). Trips whose cab was taken concurrently
+    # are matched again, against the cabs that are still free, for a few rounds.
+    claimed = []
+    failures = {}
+    taken_trips = set() # allocated elsewhere meanwhile, neither ours nor to be cancelled
+    remaining = trips
+    for _ in range(MAX_ALLOCATION_ATTEMPTS):
+        # cabs claimed by earlier rounds stay available in the fleet store until the commit
+        assignments, round_failures = allocate_cabs_to_trips(remaining, exclude={cab.id for _, cab in claimed})
+        failures.update(round_failures)
+        matched = [trip for trip in remaining if trip.id in assignments]
+
+        with phase('claim'):
+            cabs_taken = claim_cabs({assignments[trip.id].id: (trip.start_lat, trip.start_lon) for trip in matched})
+        conflicted = [trip for trip in matched if assignments[trip.id].id not in cabs_taken]
+        if conflicted:
+            forget_taken_cabs([assignments[trip.id].id for trip in conflicted])
+
+        with phase('claim'):
+            trips_taken = claim_trips({trip.id: assignments[trip.id].id for trip in matched if assignments[trip.id].id in cabs_taken})
+        lost = [trip for trip in matched if assignments[trip.id].id in cabs_taken and trip.id not in trips_taken]
+        release_cabs([assignments[trip.id].id for trip in lost])
+        taken_trips.update(trip.id for trip in lost)
+        claimed.extend((trip, assignments[trip.id]) for trip in matched if trip.id in trips_taken)
+
+        remaining = conflicted
+        if not remaining:
+            break
+    for trip in remaining:
+        failures[trip.id] = "Nearby cabs kept being taken by other allocations, please try again"
+
+    allocated = []
+    for trip, cab in claimed:
+        employee_user = employees[trip.employee_id]
+        employee_user.current_trip_status = 'in_trip'
+        employee_user.current_trip_id = trip.id
+        # Read before the commit expires the objects, so the notifications need no reloads
+        allocated.append({
+            'trip_id': trip.id,
+            'employee_id': employee_user.public_id,
+            'employee_lat': trip.start_lat,
+            'employee_lon': trip.start_lon,
+            'cab_id': cab.id,
+            'cab_lat': cab.current_lat,
+            'cab_lon': cab.current_lon
+        })
+
+    done = {data['trip_id'] for data in allocated} | taken_trips
+    unallocated = [trip for trip in trips if trip.id not in done]
+    if cancel_unassigned:
+        # only those still 'requested': one may have been allocated elsewhere meanwhile
+        cancelled_ids = cancel_trips([trip.id for trip in unallocated])
+        unallocated = [trip for trip in unallocated if trip.id in cancelled_ids]
+    unallocated = [(trip, failures[trip.id]) for trip in unallocated]
+
+    cancelled = []
+    for trip, message in unallocated:
+        employee_user = employees.get(trip.employee_id)
+        cancelled.append((trip.id, message, employee_user.public_id if employee_user else None))
+
+    # every assignment of the batch lands in a single transaction
+    with phase('commit'):
+        db.session.commit()
+
+    # Notify dashboards in real-time
+    for allocation_data in allocated:
+        fleet.set_status(allocation_data['cab_id'], 'on_trip')
+        emit('trip_allocated', allocation_data)
+        dashboard_state.trip_allocated(allocation_data)
+        eta_tracker.start(allocation_data)
+
+    if cancel_unassigned:
+        for trip_id, message, public_id in cancelled:
+            notify_trip_cancelled(trip_id, public_id, message)
+
+    return (
+        [{'trip_id': data['trip_id'], 'cab_id': data['cab_id']} for data in allocated],
+        [{'trip_id': trip_id, 'message': message} for trip_id, message, _ in cancelled]
+    )
+
+class BatchAllocationWindow:
+    def __init__(self):
+        self.app = None
+        self.window = 0
+        self._trip_ids = set()
+        self._lock = threading.Lock()
+        self._task = None
+
+    def init_app(self, app):
+        self.app = app
+        self.window = app.config.get('BATCH_ALLOCATION_WINDOW', self.window)
+        with self._lock:
+            self._trip_ids = set()
+
+    @property
+    def enabled(self):
+        return bool(self.window)
+
+    def submit(self, trip_id):
+        with self._lock:
+            self._trip_ids.add(trip_id)
+        if self._task is None:
+            self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.window)
+            try:
+                self.run_once()
+            except Exception:
+                self.app.logger.exception("Batch allocation failed")
+
+    def run_once(self):
+        with self._lock:
+            trip_ids, self._trip_ids = self._trip_ids, set()
+        if not trip_ids:
+            return
+
+        with self.app.app_context():
+            # Re-check the state: a trip may have been allocated by an admin meanwhile
+            trips = Trip.query.filter(Trip.id.in_(trip_ids), Trip.status == 'requested').all()
+            if trips:
+                allocate_trips_in_batch(trips, cancel_unassigned=True)
+
+batch_window = BatchAllocationWindow()
@@ -0,0 +1,73 @@
+import threading
+from .extensions import socketio
+from .instrumentation import emit
+from .dashboard_state import dashboard_state
+from . import metrics
+
+# Batches cab location changes and pushes them to dashboards once per tick instead of one
+# 'location_update' frame per ping per client. Each tick sends at most one
+# 'location_batch' frame per room:
+#   'admins'    -> every cab that changed (admins see the whole fleet)
+#   'employees' -> only cabs that are on a trip, or just stopped being on one (so the
+#                  employee map can drop the marker). An employee's allocated cab is on_trip.
+# Frame format: {'cabs': [[cab_id, lat, lon, status], ...]}, the latest state per cab.
+
+frames_total = metrics.counter('broadcast_frames_total', 'location_batch frames emitted')
+cabs_per_frame = metrics.histogram(
+    'broadcast_cabs_per_frame', 'Cab updates carried by one location_batch frame',
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+)
+
+class LocationBroadcaster:
+    def __init__(self):
+        self.tick = 0.2
+        self._pending = {} # cab_id -> [cab_id, lat, lon, status]
+        self._last_status = {} # status each cab had in the last frame it was sent in
+        self._lock = threading.Lock()
+        self._task = None
+
+    def init_app(self, app):
+        self.tick = app.config.get('BROADCAST_TICK', self.tick)
+        with self._lock:
+            self._pending = {}
+            self._last_status = {}
+
+    def publish(self, cab_id, lat, lon, status):
+        # also versioned for dashboards catching up after a reconnect (/admin/state?since=)
+        dashboard_state.cab_changed(cab_id, lat, lon, status)
+        with self._lock:
+            self._pending[cab_id] = [cab_id, lat, lon, status]
+
+        if not self.tick:
+            self.flush()
+        elif self._task is None:
+            self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.tick)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            employee_rows = []
+            for cab_id, row in pending.items():
+                status = row[3]
+                if status == 'on_trip' or self._last_status.get(cab_id) == 'on_trip':
+                    employee_rows.append(row)
+                self._last_status[cab_id] = status
+
+        admin_rows = list(pending.values())
+        self._emit(admin_rows, 'admins')
+        if employee_rows:
+            self._emit(employee_rows, 'employees')
+
+    def _emit(self, rows, room):
+        emit('location_batch', {'cabs': rows}, to=room)
+        frames_total.inc()
+        cabs_per_frame.observe(len(rows))
+
+broadcaster = LocationBroadcaster()
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from .instrumentation import emit
+
+# Versioned view of what the dashboards show. The pages are served as an empty shell and
+# fetch their state as JSON: a snapshot tagged with the current version, and after a
+# socket reconnect only what changed since the version they already have (the
+# /admin/state and /employee/state endpoints).
+#
+# Every change to a cab or a trip bumps the version. Only the latest state per cab / trip
+# is kept, in an OrderedDict ordered by the version it last changed at, so "what changed
+# since v" walks back from the newest entry and stops at v; unchanged cabs cost nothing.
+# Versions start at the process start time in microseconds, so a version handed out
+# before a server restart is older than anything this process knows, and the client is
+# told to reset (i.e. gets a full snapshot) instead of a delta that would miss changes.
+# Finished trips are forgotten after a while, moving that reset floor forward.
+
+FINISHED_STATUSES = ('completed', 'cancelled')
+
+class DashboardState:
+    def __init__(self):
+        self.max_finished_trips = 10000
+        self._lock = threading.Lock()
+        self._reset()
+
+    def init_app(self, app):
+        self.max_finished_trips = app.config.get('DASHBOARD_MAX_FINISHED_TRIPS', self.max_finished_trips)
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._version = time.time_ns() // 1000
+        self._floor = self._version # deltas since an older version can't be served
+        # ('cab' | 'trip', id) -> (version, row, status, version the status last changed at)
+        self._entries = OrderedDict()
+        self._finished = deque() # trip keys in the order they finished
+
+    @property
+    def version(self):
+        return self._version
+
+    def _record(self, key, row, status):
+        # Called with the lock held
+        self._version += 1
+        previous = self._entries.get(key)
+        status_version = previous[3] if previous and previous[2] == status else self._version
+        self._entries[key] = (self._version, row, status, status_version)
+        self._entries.move_to_end(key)
+
+    def cab_changed(self, cab_id, lat, lon, status):
+        with self._lock:
+            self._record(('cab', cab_id), [cab_id, lat, lon, status], status)
+
+    def trip_changed(self, trip_id, status, employee_id=None, start_lat=None, start_lon=None, cab_id=None):
+        row = {
+            'id': trip_id,
+            'status': status,
+            'employee_id': employee_id,
+            'start_lat': start_lat,
+            'start_lon': start_lon,
+            'cab_id': cab_id
+        }
+        with self._lock:
+            previous = self._entries.get(('trip', trip_id))
+            if previous:
+                # fields a status change doesn't pass along stay as they were
+                row.update({name: value for name, value in previous[1].items() if row[name] is None})
+            self._record(('trip', trip_id), row, status)
+            if status in FINISHED_STATUSES:
+                self._finished.append(trip_id)
+                while len(self._finished) > self.max_finished_trips:
+                    self._forget_trip(self._finished.popleft())
+        return row
+
+    def _forget_trip(self, trip_id):
+        entry = self._entries.get(('trip', trip_id))
+        if entry and entry[2] in FINISHED_STATUSES:
+            del self._entries[('trip', trip_id)]
+            self._floor = max(self._floor, entry[0])
+
+    def trip_allocated(self, allocation):
+        """Record a 'trip_allocated' payload: the trip is in progress and its cab on a trip."""
+        with self._lock:
+            self._record(('cab', allocation['cab_id']), [allocation['cab_id'], allocation['cab_lat'], allocation['cab_lon'], 'on_trip'], 'on_trip')
+            self._record(('trip', allocation['trip_id']), {
+                'id': allocation['trip_id'],
+                'status': 'in_progress',
+                'employee_id': allocation['employee_id'],
+                'start_lat': allocation['employee_lat'],
+                'start_lon': allocation['employee_lon'],
+                'cab_id': allocation['cab_id']
+            }, 'in_progress')
+
+    def changes_since(self, since):
+        """
+        (version, cabs, trips) changed after `since`: cabs as ([cab_id, lat, lon, status],
+        status_version) and trips as dicts. None if `since` is too old or from another
+        process, in which case the client needs a full snapshot.
+        """
+        with self._lock:
+            if since < self._floor or since > self._version:
+                return None
+            cabs, trips = [], []
+            for (kind, _), (version, row, _, status_version) in reversed(self._entries.items()):
+                if version <= since:
+                    break
+                if kind == 'cab':
+                    cabs.append((row, status_version))
+                else:
+                    trips.append(row)
+            return self._version, cabs, trips
+
+dashboard_state = DashboardState()
+
+def notify_trip_requested(trip_id, employee_id, start_lat, start_lon):
+    """Record a new 'requested' trip and push it to the admins' pending list."""
+    row = dashboard_state.trip_changed(trip_id, 'requested', employee_id, start_lat, start_lon)
+    emit('new_trip_request', row, to='admins')
+
+def notify_trip_cancelled(trip_id, employee_id, message):
+    """Record a trip cancelled for want of a cab and tell the admins and the employee."""
+    dashboard_state.trip_changed(trip_id, 'cancelled', employee_id)
+    data = {'trip_id': trip_id, 'message': message}
+    emit('trip_cancelled', data, to='admins') # drops it from the pending list
+    if employee_id:
+        emit('trip_cancelled', data, to=f"employee_{employee_id}")
@@ -0,0 +1,79 @@
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from .extensions import db
+
+# Engine setup for the two supported backends, picked by SQLALCHEMY_DATABASE_URI.
+#
+# SQLite (the default): the database runs in WAL mode, so the location flusher, the
+# allocation workers and the dashboards reading cabs no longer block each other; only
+# writers still take turns. synchronous=NORMAL is safe with WAL (a power cut can lose the
+# last commits, never corrupt the file) and saves an fsync per commit. A writer that
+# finds the database locked waits up to SQLITE_BUSY_TIMEOUT seconds instead of failing
+# with "database is locked".
+#
+# PostgreSQL (DATABASE_URL=postgresql://...): a sized connection pool with pre-ping, so
+# connections dropped by the server or a proxy are replaced instead of failing a request.
+# Needs a driver, e.g. `pip install psycopg2-binary`.
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database, explicit settings win."""
+    url = make_url(normalize_database_uri(config['SQLALCHEMY_DATABASE_URI']))
+    options = {}
+
+    if url.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'timeout': config.get('SQLITE_BUSY_TIMEOUT', 30.0)}
+        if url.database and url.database != ':memory:':
+            # A file database gets a QueuePool; an in-memory one keeps SQLAlchemy's
+            # single-connection pool, since every new connection would be a new database
+            options['pool_size'] = config.get('DB_POOL_SIZE', 10)
+            options['max_overflow'] = config.get('DB_MAX_OVERFLOW', 20)
+            options['pool_timeout'] = config.get('DB_POOL_TIMEOUT', 30)
+    elif url.get_backend_name() == 'postgresql':
+        options['pool_size'] = config.get('DB_POOL_SIZE', 10)
+        options['max_overflow'] = config.get('DB_MAX_OVERFLOW', 20)
+        options['pool_timeout'] = config.get('DB_POOL_TIMEOUT', 30)
+        options['pool_recycle'] = config.get('DB_POOL_RECYCLE', 1800)
+        options['pool_pre_ping'] = True
+
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+def normalize_database_uri(uri):
+    # Hosting providers hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def configure_engine(app):
+    """Fill in the engine options. Call before db.init_app(app)."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+def init_app(app):
+    """Register the per-connection SQLite pragmas. Call after db.init_app(app)."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        register_sqlite_pragmas(engine, app.config.get('SQLITE_WAL', True), app.config.get('SQLITE_BUSY_TIMEOUT', 30.0))
+
+def register_sqlite_pragmas(engine, wal, busy_timeout):
+    busy_timeout_ms = int(busy_timeout * 1000)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal:
+            # persistent, but an in-memory database stays in 'memory' mode and that's fine
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={busy_timeout_ms}')
+        cursor.close()
+
+def create_engine(config):
+    """A standalone engine set up like the app's, for scripts and benchmarks without an app."""
+    uri = normalize_database_uri(config['SQLALCHEMY_DATABASE_URI'])
+    engine = sqlalchemy.create_engine(uri, **engine_options(config))
+    if engine.dialect.name == 'sqlite':
+        register_sqlite_pragmas(engine, config.get('SQLITE_WAL', True), config.get('SQLITE_BUSY_TIMEOUT', 30.0))
+    return engine
@@ -1,8 +1,14 @@
 from flask import request, jsonify, render_template
 from . import employee_bp
 from ..models import Cab, User, Trip
-from ..extensions import db, socketio
-from ..utils import allocate_cab_to_trip
+from ..extensions import db
+from ..instrumentation import emit
+from ..fleet import fleet
+from ..broadcast import broadcaster
+from ..eta import eta_tracker
+from ..dashboard_state import dashboard_state, notify_trip_requested
+from ..batch_allocation import batch_window
+from ..allocation_queue import allocation_queue, allocate_trip
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 
@@ -15,46 +21,57 @@ def employee_dashboard():
     if not user:
         return jsonify({"message": "User not found"}), 404
 
-    # Fetch all 'on_trip' cabs
-    on_trip_cabs_query = Cab.query.filter_by(status='on_trip').all()
-    on_trip_cabs = []
-    for cab in on_trip_cabs_query:
-        on_trip_cabs.append({
-            'id': cab.id,
-            'driver_name': cab.driver_name,
-            'license_plate': cab.license_plate,
-            'current_lat': cab.current_lat,
-            'current_lon': cab.current_lon,
-            'status': cab.status
-        })
-
-    # Fetch the cab allocated to this specific employee, if any
-    allocated_cab = None
-    current_trip_id = None
-    if user.current_trip_id:
-        current_trip = Trip.query.get(user.current_trip_id)
-        if current_trip and current_trip.status == 'in_progress' and current_trip.cab_id:
-            current_trip_id = current_trip.id
-            cab = Cab.query.get(current_trip.cab_id)
-            if cab:
-                allocated_cab = {
-                    'id': cab.id,
-                    'driver_name': cab.driver_name,
-                    'license_plate': cab.license_plate,
-                    'current_lat': cab.current_lat,
-                    'current_lon': cab.current_lon,
-                    'status': cab.status
-                }
-
+    # Only the page shell: the map fetches the cabs and the trip from /employee/state
     return render_template(
         'employee_dashboard.html',
         user_public_id=user.public_id,
-        user_location={'lat': user.latitude, 'lon': user.longitude},
-        on_trip_cabs=on_trip_cabs,
-        allocated_cab=allocated_cab,
-        current_trip_id=current_trip_id
+        user_location={'lat': user.latitude, 'lon': user.longitude}
     )
 
+@employee_bp.route('/state')
+@jwt_required()
+def employee_state():
+    """
+    The employee's view as JSON: the cabs on a trip and the employee's own current trip.
+    Like /admin/state, `since=<version>` returns only what changed after that version (cabs
+    that are on a trip or changed status, and the employee's own trips), and a snapshot
+    with `snapshot: true` when the delta can't be served.
+    """
+    current_user_public_id = get_jwt_identity()
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changes = dashboard_state.changes_since(since)
+        if changes is not None:
+            version, cabs, trips = changes
+            return jsonify({
+                "version": version,
+                "snapshot": False,
+                # cabs that left 'on_trip' are sent too, so the map can drop them
+                "cabs": [row for row, status_version in cabs if row[3] == 'on_trip' or status_version > since],
+                "trips": [trip for trip in trips if trip['employee_id'] == current_user_public_id]
+            }), 200
+
+    version = dashboard_state.version
+    user = User.query.filter_by(public_id=current_user_public_id).first()
+    if not user:
+        return jsonify({"message": "User not found"}), 404
+
+    fleet.ensure_loaded()
+    cabs = fleet.rows('on_trip')
+
+    trips = []
+    if user.current_trip_id:
+        row = db.session.execute(
+            db.select(Trip.id, Trip.status, Trip.start_lat, Trip.start_lon, Trip.cab_id)
+            .where(Trip.id == user.current_trip_id, Trip.status.in_(('requested', 'in_progress')))
+        ).first()
+        if row:
+            trip_id, status, start_lat, start_lon, cab_id = row
+            trips.append({'id': trip_id, 'status': status, 'employee_id': user.public_id, 'start_lat': start_lat, 'start_lon': start_lon, 'cab_id': cab_id})
+
+    return jsonify({"version": version, "snapshot": True, "cabs": cabs, "trips": trips}), 200
+
 @employee_bp.route('/request-trip', methods=['POST'])
 @jwt_required()
 def request_trip():
@@ -79,46 +96,30 @@ def request_trip():
         status='requested'
     )
     db.session.add(new_trip)
+    db.session.flush()
+    trip_id = new_trip.id # read before the commit expires it
     db.session.commit()
-
-    best_cab, message = allocate_cab_to_trip(new_trip)
-
-    if not best_cab:
-        new_trip.status = 'cancelled'
-        db.session.commit()
-        return jsonify({"message": message, "trip_id": new_trip.id, "status": "cancelled"}), 404
-
-    # Assign the cab and update statuses
-    new_trip.cab_id = best_cab.id
-    new_trip.status = 'in_progress'
-    best_cab.status = 'on_trip'
-    best_cab.destination_latitude = new_trip.start_lat
-    best_cab.destination_longitude = new_trip.start_lon
-
-    employee_user = User.query.get(new_trip.employee_id)
-    employee_user.current_trip_status = 'in_trip'
-    employee_user.current_trip_id = new_trip.id
-
-    db.session.commit()
-
-    # Notify dashboards in real-time
-    allocation_data = {
-        'trip_id': new_trip.id,
-        'employee_id': employee_user.public_id,
-        'employee_lat': new_trip.start_lat,
-        'employee_lon': new_trip.start_lon,
-        'cab_id': best_cab.id,
-        'cab_lat': best_cab.current_lat,
-        'cab_lon': best_cab.current_lon
-    }
-    socketio.emit('trip_allocated', allocation_data)
-
-    return jsonify({
-        "message": f"Cab {best_cab.id} allocated to trip {new_trip.id}",
-        "cab_id": best_cab.id,
-        "trip_id": new_trip.id,
-        "status": "in_progress"
-    }), 200
+    notify_trip_requested(trip_id, user.public_id, lat, lon)
+
+    if not batch_window.enabled and not allocation_queue.enabled:
+        # Allocate inside the request (ALLOCATION_WORKERS = 0)
+        allocation, message = allocate_trip(new_trip)
+        if not allocation:
+            return jsonify({"message": message, "trip_id": trip_id, "status": "cancelled"}), 404
+        return jsonify({
+            "message": f"Cab {allocation['cab_id']} allocated to trip {trip_id}",
+            "cab_id": allocation['cab_id'],
+            "trip_id": trip_id,
+            "status": "in_progress"
+        }), 200
+
+    # Allocated in the background (with the next micro-batch, or by the allocation
+    # workers); the result arrives as a 'trip_allocated' / 'trip_cancelled' socket event
+    if batch_window.enabled:
+        batch_window.submit(trip_id)
+    else:
+        allocation_queue.submit(trip_id)
+    return jsonify({"message": "Trip requested, waiting for allocation", "trip_id": trip_id, "status": "requested"}), 202
 
 @employee_bp.route('/re-request-trip/<int:trip_id>', methods=['POST'])
 @jwt_required()
@@ -138,46 +139,26 @@ def re_request_trip(trip_id):
         return jsonify({"message": "Trip is not cancelled"}), 400
 
     trip.status = 'requested'
+    start_lat, start_lon = trip.start_lat, trip.start_lon
     db.session.commit()
-
-    best_cab, message = allocate_cab_to_trip(trip)
-
-    if not best_cab:
-        trip.status = 'cancelled'
-        db.session.commit()
-        return jsonify({"message": message, "trip_id": trip.id, "status": "cancelled"}), 404
-
-    # Assign the cab and update statuses
-    trip.cab_id = best_cab.id
-    trip.status = 'in_progress'
-    best_cab.status = 'on_trip'
-    best_cab.destination_latitude = trip.start_lat
-    best_cab.destination_longitude = trip.start_lon
-
-    employee_user = User.query.get(trip.employee_id)
-    employee_user.current_trip_status = 'in_trip'
-    employee_user.current_trip_id = trip.id
-
-    db.session.commit()
-
-    # Notify dashboards in real-time
-    allocation_data = {
-        'trip_id': trip.id,
-        'employee_id': employee_user.public_id,
-        'employee_lat': trip.start_lat,
-        'employee_lon': trip.start_lon,
-        'cab_id': best_cab.id,
-        'cab_lat': best_cab.current_lat,
-        'cab_lon': best_cab.current_lon
-    }
-    socketio.emit('trip_allocated', allocation_data)
-
-    return jsonify({
-        "message": f"Cab {best_cab.id} allocated to trip {trip.id}",
-        "cab_id": best_cab.id,
-        "trip_id": trip.id,
-        "status": "in_progress"
-    }), 200
+    notify_trip_requested(trip_id, user.public_id, start_lat, start_lon)
+
+    if not batch_window.enabled and not allocation_queue.enabled:
+        allocation, message = allocate_trip(trip)
+        if not allocation:
+            return jsonify({"message": message, "trip_id": trip_id, "status": "cancelled"}), 404
+        return jsonify({
+            "message": f"Cab {allocation['cab_id']} allocated to trip {trip_id}",
+            "cab_id": allocation['cab_id'],
+            "trip_id": trip_id,
+            "status": "in_progress"
+        }), 200
+
+    if batch_window.enabled:
+        batch_window.submit(trip.id)
+    else:
+        allocation_queue.submit(trip.id)
+    return jsonify({"message": "Trip requested, waiting for allocation", "trip_id": trip.id, "status": "requested"}), 202
 
 
 # @employee_bp.route('/cabs/nearby', methods=['GET','POST'])
@@ -272,20 +253,25 @@ def finish_employee_trip():
         allocated_cab.destination_latitude = None
         allocated_cab.destination_longitude = None
 
-        # Emit a real-time update that the cab is now available
-        socketio.emit('location_update', {
-            'cab_id': allocated_cab.id,
-            'lat': allocated_cab.current_lat,
-            'lon': allocated_cab.current_lon,
-            'status': 'available'
-        })
-
     # Update user's trip status
     user.current_trip_status = 'not_in_trip'
     user.current_trip_id = None
 
-    db.session.commit()
+    # Read before the commit expires the objects, so the notifications need no reloads
+    trip_id = trip.id
+    freed = (allocated_cab.id, allocated_cab.current_lat, allocated_cab.current_lon) if allocated_cab else None
 
-    socketio.emit('trip_finished', {'trip_id': trip.id})
+    db.session.commit()
+    if freed:
+        cab_id, cab_lat, cab_lon = freed
+        fleet.set_status(cab_id, 'available')
+        eta_tracker.stop(cab_id)
+        # Push a real-time update that the cab is now available (with the next batch), at
+        # its live position: the DB row lags behind by up to a write-behind interval
+        cab_lat, cab_lon = fleet.position(cab_id) or (cab_lat, cab_lon)
+        broadcaster.publish(cab_id, cab_lat, cab_lon, 'available')
+
+    dashboard_state.trip_changed(trip_id, 'completed', current_user_public_id)
+    emit('trip_finished', {'trip_id': trip_id})
 
     return jsonify({"message": "Trip finished successfully."}), 200
\ No newline at end of file
@@ -0,0 +1,185 @@
+import threading
+from math import cos, radians
+import numpy as np
+from .extensions import db
+from .instrumentation import emit
+from .models import Cab, Trip, User
+from .geo import haversine_distance
+from .utils import load_road_network, shortest_path
+from . import metrics
+
+# ETA tracking for allocated trips. When a cab gets a trip, its road route to the pickup
+# is computed once and kept as the route's node coordinates plus the remaining road
+# distance from each node to the end. Each location ping of the cab then only moves a
+# pointer forward along that route: the ping is projected onto the next few route
+# segments, which gives the remaining distance without any shortest-path search. Only a
+# cab that leaves its route gets a new one.
+# An 'eta_update' {trip_id, cab_id, remaining_m, eta_seconds} goes to the employee's
+# room when the ETA moved by at least ETA_EMIT_THRESHOLD seconds, and once on arrival.
+# On a graph with travel times the remaining distance is timed at the route's own
+# average speed, otherwise at ETA_SPEED_KMH.
+
+METERS_PER_DEGREE_LAT = 111320.0
+LOOKAHEAD_SEGMENTS = 32 # route segments ahead of the pointer a ping is matched against
+OFF_ROUTE_METERS = 150.0 # farther than this from the route means the cab took another way
+ARRIVED_METERS = 30.0
+
+updates_emitted_total = metrics.counter('eta_updates_emitted_total', 'eta_update events sent to employees')
+reroutes_total = metrics.counter('eta_reroutes_total', 'Routes recomputed because a cab left its route')
+tracked_trips = metrics.gauge('eta_tracked_trips', 'Trips whose ETA is being tracked')
+
+class TrackedRoute:
+    def __init__(self, trip_id, cab_id, room, dest_lat, dest_lon):
+        self.trip_id = trip_id
+        self.cab_id = cab_id
+        self.room = room
+        self.dest_lat = dest_lat
+        self.dest_lon = dest_lon
+        self.lats = None # route node coordinates, None until the route is planned
+        self.lons = None
+        self.remaining = None # road meters from each route node to the end
+        self.pace = None # seconds per meter along the route, from the graph's travel times
+        self.pointer = 0 # index of the route segment the cab was last matched to
+        self.last_eta = None # ETA of the last emitted update
+
+    def set_path(self, graph, path):
+        edges = [graph.edge_between(u, v) for u, v in zip(path, path[1:])]
+        lengths = np.asarray(graph.length[edges], dtype=np.float64)
+        self.lats = np.asarray(graph.lat)[path]
+        self.lons = np.asarray(graph.lon)[path]
+        self.remaining = np.concatenate([np.cumsum(lengths[::-1])[::-1], [0.0]])
+        self.pointer = 0
+        self.pace = None
+        if graph.travel_time is not None and lengths.sum() > 0:
+            self.pace = float(np.asarray(graph.travel_time[edges], dtype=np.float64).sum() / lengths.sum())
+
+    def advance(self, lat, lon):
+        """Match a ping to the route. Returns (remaining road meters, meters off the route)."""
+        if len(self.lats) == 1:
+            return haversine_distance(lat, lon, self.lats[0], self.lons[0]) * 1000, 0.0
+
+        lo = self.pointer
+        hi = min(lo + LOOKAHEAD_SEGMENTS, len(self.lats) - 1)
+
+        # Segment ends in local meters around the ping, which sits at the origin
+        meters_per_degree_lon = METERS_PER_DEGREE_LAT * cos(radians(lat))
+        x1 = (self.lons[lo:hi] - lon) * meters_per_degree_lon
+        y1 = (self.lats[lo:hi] - lat) * METERS_PER_DEGREE_LAT
+        dx = (self.lons[lo + 1:hi + 1] - lon) * meters_per_degree_lon - x1
+        dy = (self.lats[lo + 1:hi + 1] - lat) * METERS_PER_DEGREE_LAT - y1
+
+        # Closest point of each segment to the ping, as a fraction along the segment
+        squared_lengths = dx * dx + dy * dy
+        along = np.clip(-(x1 * dx + y1 * dy) / np.where(squared_lengths > 0, squared_lengths, 1.0), 0.0, 1.0)
+        off = np.hypot(x1 + along * dx, y1 + along * dy)
+
+        best = int(np.argmin(off))
+        segment = lo + best
+        self.pointer = segment
+        segment_length = self.remaining[segment] - self.remaining[segment + 1]
+        return float(self.remaining[segment + 1] + (1.0 - along[best]) * segment_length), float(off[best])
+
+class EtaTracker:
+    def __init__(self):
+        self.speed_kmh = 25.0
+        self.threshold = 30.0
+        self._routes = {} # cab_id -> TrackedRoute
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def init_app(self, app):
+        self.speed_kmh = app.config.get('ETA_SPEED_KMH', self.speed_kmh)
+        self.threshold = app.config.get('ETA_EMIT_THRESHOLD', self.threshold)
+        with self._lock:
+            self._routes = {}
+            self.loaded = False
+        tracked_trips.set(0)
+
+    def __contains__(self, cab_id):
+        return cab_id in self._routes
+
+    def ensure_loaded(self):
+        """
+        Pick up the trips that were already in progress when this process started (needs an
+        app context). Their routes are planned on the cab's next ping.
+        """
+        if self.loaded:
+            return
+        rows = db.session.execute(
+            db.select(Trip.id, Trip.cab_id, Trip.start_lat, Trip.start_lon, User.public_id)
+            .join(User, User.id == Trip.employee_id)
+            .join(Cab, Cab.id == Trip.cab_id)
+            .where(Trip.status == 'in_progress', Cab.destination_latitude.isnot(None))
+        ).all()
+        with self._lock:
+            if self.loaded:
+                return
+            for trip_id, cab_id, dest_lat, dest_lon, public_id in rows:
+                self._routes.setdefault(cab_id, TrackedRoute(trip_id, cab_id, f"employee_{public_id}", dest_lat, dest_lon))
+            self.loaded = True
+            tracked_trips.set(len(self._routes))
+
+    def start(self, allocation):
+        """
+        Track the ETA of an allocated cab to the pickup point and send the first estimate.
+        `allocation` is the 'trip_allocated' payload, so no ORM objects (and no queries) needed.
+        """
+        route = TrackedRoute(
+            allocation['trip_id'], allocation['cab_id'], f"employee_{allocation['employee_id']}",
+            allocation['employee_lat'], allocation['employee_lon']
+        )
+        with self._lock:
+            self._routes[route.cab_id] = route
+            tracked_trips.set(len(self._routes))
+        self._track(route, allocation['cab_lat'], allocation['cab_lon'])
+
+    def stop(self, cab_id):
+        with self._lock:
+            if self._routes.pop(cab_id, None) is not None:
+                tracked_trips.set(len(self._routes))
+
+    def update(self, cab_id, lat, lon):
+        """Feed a location ping. A dict lookup for cabs without a tracked trip."""
+        route = self._routes.get(cab_id)
+        if route is not None:
+            self._track(route, lat, lon)
+
+    def _plan(self, route, lat, lon):
+        graph = load_road_network()
+        path = None
+        if graph:
+            start, end = graph.snap([lat, route.dest_lat], [lon, route.dest_lon]).tolist()
+            path = shortest_path(graph, start, end)
+        if not path:
+            return False
+        route.set_path(graph, path)
+        return True
+
+    def _track(self, route, lat, lon):
+        if route.lats is None and not self._plan(route, lat, lon):
+            self.stop(route.cab_id) # no road route, nothing to estimate
+            return
+
+        remaining, off_route = route.advance(lat, lon)
+        if off_route > OFF_ROUTE_METERS:
+            reroutes_total.inc()
+            if not self._plan(route, lat, lon):
+                self.stop(route.cab_id)
+                return
+            remaining, _ = route.advance(lat, lon)
+
+        arrived = remaining <= ARRIVED_METERS
+        eta = 0.0 if arrived else remaining * route.pace if route.pace else remaining / (self.speed_kmh / 3.6)
+        if arrived or route.last_eta is None or abs(eta - route.last_eta) >= self.threshold:
+            route.last_eta = eta
+            emit('eta_update', {
+                'trip_id': route.trip_id,
+                'cab_id': route.cab_id,
+                'remaining_m': round(remaining),
+                'eta_seconds': round(eta)
+            }, to=route.room)
+            updates_emitted_total.inc()
+        if arrived:
+            self.stop(route.cab_id)
+
+eta_tracker = EtaTracker()
@@ -4,7 +4,6 @@ from flask_socketio import SocketIO
 from flask_jwt_extended import JWTManager
 from flask_caching import Cache
 from flask_cors import CORS
-import flask_monitoringdashboard as dashboard
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -0,0 +1,185 @@
+import threading
+from math import cos, radians, floor
+import numpy as np
+from .extensions import db
+from .models import Cab
+
+# In-process live fleet state: cab positions and statuses kept in NumPy arrays, with a
+# uniform lat/lon grid on top so "cabs near a point" only looks at a few grid cells
+# instead of the whole fleet or the database. Location pings update it in place, and
+# the allocator reads it instead of running Cab.query...all() per request.
+# The database stays the source of truth for everything else and is loaded into the
+# store once, lazily, on first use.
+
+STATUS_CODES = {'available': 0, 'on_trip': 1, 'unavailable': 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+KM_PER_DEGREE_LAT = 111.32
+
+class FleetStore:
+    def __init__(self, cell_size_km=1.0, reference_lat=26.2389):
+        self.cell_size_km = cell_size_km
+        self.reference_lat = reference_lat # Jodhpur; only affects how square the cells are
+        self._lock = threading.Lock()
+        self.clear()
+
+    def init_app(self, app):
+        self.cell_size_km = app.config.get('FLEET_GRID_CELL_KM', self.cell_size_km)
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self._slots = {} # cab_id -> row in the arrays below
+        self._cells = {} # (row, col) grid cell -> set of slots
+        self._cell_of = [] # slot -> grid cell
+        self._size = 0
+        self.cab_ids = np.empty(0, dtype=np.int64)
+        self.lats = np.empty(0, dtype=np.float64)
+        self.lons = np.empty(0, dtype=np.float64)
+        self.statuses = np.empty(0, dtype=np.int8)
+        self._cell_lat = self.cell_size_km / KM_PER_DEGREE_LAT
+        self._cell_lon = self._cell_lat / cos(radians(self.reference_lat))
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, cab_id):
+        return cab_id in self._slots
+
+    def ensure_loaded(self):
+        """Load every cab from the database the first time the store is used (needs an app context)."""
+        if self.loaded:
+            return
+        rows = db.session.execute(
+            db.select(Cab.id, Cab.current_lat, Cab.current_lon, Cab.status)
+        ).all()
+        with self._lock:
+            if self.loaded:
+                return
+            for cab_id, lat, lon, status in rows:
+                self._upsert(cab_id, lat, lon, status)
+            self.loaded = True
+
+    def _cell(self, lat, lon):
+        return (floor(lat / self._cell_lat), floor(lon / self._cell_lon))
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self.cab_ids))
+        for name in ('cab_ids', 'lats', 'lons', 'statuses'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _upsert(self, cab_id, lat, lon, status=None):
+        slot = self._slots.get(cab_id)
+        if slot is None:
+            if self._size == len(self.cab_ids):
+                self._grow()
+            slot = self._size
+            self._size += 1
+            self._slots[cab_id] = slot
+            self._cell_of.append(None)
+            self.cab_ids[slot] = cab_id
+            self.statuses[slot] = STATUS_CODES['available']
+
+        self.lats[slot] = lat
+        self.lons[slot] = lon
+        if status in STATUS_CODES:
+            self.statuses[slot] = STATUS_CODES[status]
+
+        # Only touch the index when the cab actually crossed into another cell
+        cell = self._cell(lat, lon)
+        old_cell = self._cell_of[slot]
+        if cell != old_cell:
+            if old_cell is not None:
+                self._cells[old_cell].discard(slot)
+            self._cells.setdefault(cell, set()).add(slot)
+            self._cell_of[slot] = cell
+
+    def update(self, cab_id, lat, lon, status=None):
+        """Record a cab's position (and status, if given); returns the cab's current status."""
+        with self._lock:
+            self._upsert(cab_id, float(lat), float(lon), status)
+            return STATUS_NAMES[int(self.statuses[self._slots[cab_id]])]
+
+    def set_status(self, cab_id, status):
+        with self._lock:
+            slot = self._slots.get(cab_id)
+            if slot is not None:
+                self.statuses[slot] = STATUS_CODES[status]
+
+    def position(self, cab_id):
+        """The cab's latest (lat, lon), or None for a cab the store doesn't have."""
+        with self._lock:
+            slot = self._slots.get(cab_id)
+            if slot is None:
+                return None
+            return float(self.lats[slot]), float(self.lons[slot])
+
+    def discard(self, cab_id):
+        # Swap the last slot into the hole so the arrays stay dense
+        with self._lock:
+            slot = self._slots.pop(cab_id, None)
+            if slot is None:
+                return
+            self._cells[self._cell_of[slot]].discard(slot)
+            last = self._size - 1
+            if slot != last:
+                moved_id = int(self.cab_ids[last])
+                for name in ('cab_ids', 'lats', 'lons', 'statuses'):
+                    array = getattr(self, name)
+                    array[slot] = array[last]
+                moved_cell = self._cell_of[last]
+                self._cells[moved_cell].discard(last)
+                self._cells[moved_cell].add(slot)
+                self._cell_of[slot] = moved_cell
+                self._slots[moved_id] = slot
+            self._cell_of.pop()
+            self._size = last
+
+    def count(self, status):
+        return int(np.count_nonzero(self.statuses[:self._size] == STATUS_CODES[status]))
+
+    def with_status(self, status):
+        """(cab_ids, lats, lons) arrays of every cab with `status`."""
+        with self._lock:
+            mask = self.statuses[:self._size] == STATUS_CODES[status]
+            return self.cab_ids[:self._size][mask], self.lats[:self._size][mask], self.lons[:self._size][mask]
+
+    def rows(self, status=None):
+        """[[cab_id, lat, lon, status], ...] of every cab (with `status`), the 'location_batch' row format."""
+        with self._lock:
+            ids = self.cab_ids[:self._size]
+            lats = self.lats[:self._size]
+            lons = self.lons[:self._size]
+            codes = self.statuses[:self._size]
+            if status is not None:
+                mask = codes == STATUS_CODES[status]
+                ids, lats, lons, codes = ids[mask], lats[mask], lons[mask], codes[mask]
+            return [
+                [cab_id, lat, lon, STATUS_NAMES[code]]
+                for cab_id, lat, lon, code in zip(ids.tolist(), lats.tolist(), lons.tolist(), codes.tolist())
+            ]
+
+    def candidates_near(self, lat, lon, radius_km, status='available'):
+        """
+        Coarse grid lookup: (cab_ids, lats, lons) arrays of the cabs with `status` in the grid
+        cells overlapping the radius_km box around (lat, lon). Callers apply the exact
+        distance filter (see utils.filter_within_radius).
+        """
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        lon_span = lat_span / max(cos(radians(lat)), 1e-6)
+        row_lo, col_lo = self._cell(lat - lat_span, lon - lon_span)
+        row_hi, col_hi = self._cell(lat + lat_span, lon + lon_span)
+
+        with self._lock:
+            slots = []
+            for row in range(row_lo, row_hi + 1):
+                for col in range(col_lo, col_hi + 1):
+                    slots.extend(self._cells.get((row, col), ()))
+            slots = np.array(slots, dtype=np.int64)
+            slots = slots[self.statuses[slots] == STATUS_CODES[status]]
+            return self.cab_ids[slots], self.lats[slots], self.lons[slots]
+
+fleet = FleetStore()
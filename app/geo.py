@@ -0,0 +1,39 @@
+from math import radians, cos, sin, asin, sqrt
+import numpy as np
+
+# Great-circle distances. Only NumPy: usable by the offline graph build (osm_reader.py)
+# without importing the app.
+
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance in kilometers between two points 
+    on the earth (specified in decimal degrees).
+    """
+    # Earth's radius in kilometers
+    R = 6371.0
+
+    # Convert decimal degrees to radians
+    rlat1, rlon1, rlat2, rlon2 = map(radians, [lat1, lon1, lat2, lon2])
+
+    # Haversine formula
+    dlon = rlon2 - rlon1
+    dlat = rlat2 - rlat1
+    a = sin(dlat / 2)**2 + cos(rlat1) * cos(rlat2) * sin(dlon / 2)**2
+    c = 2 * asin(sqrt(a))
+    
+    distance = R * c
+    return distance
+
+def haversine_distances(lat, lon, lats, lons):
+    """
+    Vectorized haversine_distance: kilometers from (lat, lon) to every point of the
+    NumPy arrays lats/lons. The inputs broadcast, so lat/lon may also be (M, 1) columns
+    to get an (M, N) matrix of distances in one call.
+    """
+    rlat1, rlon1 = np.radians(lat), np.radians(lon)
+    rlat2, rlon2 = np.radians(lats), np.radians(lons)
+
+    a = np.sin((rlat2 - rlat1) / 2)**2 + np.cos(rlat1) * np.cos(rlat2) * np.sin((rlon2 - rlon1) / 2)**2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
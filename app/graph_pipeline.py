@@ -0,0 +1,69 @@
+from .road_graph import RoadGraph
+
+# Offline preprocessing between the downloaded OSM network and the compiled graph the app
+# loads (generate_graph.py runs it):
+#   1. keep the largest strongly connected component, so every node reaches every other
+#   2. speed limits and travel times per edge: OSM maxspeed where tagged, else the typical
+#      speed of the road type below
+#   3. drop every attribute routing never reads (names, geometry, OSM tags, ...)
+#   4. compile to arrays, optionally contract degree-2 chains (see RoadGraph.contract_chains)
+#      and build the landmark index for the chosen routing weight
+# osmnx and networkx are only needed here, never by the running app.
+
+# km/h on urban Indian roads, for edges without a maxspeed tag
+HIGHWAY_SPEEDS_KPH = {
+    'motorway': 80, 'motorway_link': 40,
+    'trunk': 60, 'trunk_link': 35,
+    'primary': 50, 'primary_link': 30,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 25,
+    'living_street': 15, 'service': 15, 'road': 25
+}
+FALLBACK_SPEED_KPH = 25 # road types neither tagged nor in the table, same as ETA_SPEED_KMH
+
+NODE_ATTRIBUTES = ('x', 'y')
+EDGE_ATTRIBUTES = ('length', 'speed_kph', 'travel_time')
+
+def largest_strongly_connected(graph):
+    import networkx as nx
+    if nx.is_strongly_connected(graph):
+        return graph
+    largest_scc = max(nx.strongly_connected_components(graph), key=len)
+    return graph.subgraph(largest_scc).copy()
+
+def add_travel_times(graph):
+    """'speed_kph' and 'travel_time' (seconds) on every edge; a graph that has them is left as is."""
+    if all('travel_time' in attrs for _, _, attrs in graph.edges(data=True)):
+        return graph
+    import osmnx as ox
+    graph = ox.add_edge_speeds(graph, hwy_speeds=HIGHWAY_SPEEDS_KPH, fallback=FALLBACK_SPEED_KPH)
+    return ox.add_edge_travel_times(graph)
+
+def strip_attributes(graph):
+    """Keep only what compiling reads: node coordinates, edge length, speed and travel time."""
+    for _, attrs in graph.nodes(data=True):
+        for name in [name for name in attrs if name not in NODE_ATTRIBUTES]:
+            del attrs[name]
+    for _, _, attrs in graph.edges(data=True):
+        for name in [name for name in attrs if name not in EDGE_ATTRIBUTES]:
+            del attrs[name]
+    graph.graph = {name: value for name, value in graph.graph.items() if name == 'crs'}
+    return graph
+
+def preprocess(graph):
+    """Steps 1-3 on an osmnx MultiDiGraph, in place where possible."""
+    return strip_attributes(add_travel_times(largest_strongly_connected(graph)))
+
+def compile_graph(graph, weight='length', contract=False, num_landmarks=16, **metadata):
+    """
+    Step 4: the RoadGraph to save, routing by `weight` ('length' or 'travel_time').
+    `metadata` (e.g. the source of the network) ends up in the graph's manifest.
+    """
+    road_graph = RoadGraph.from_networkx(graph, weight=weight)
+    road_graph.metadata = dict(metadata, contracted=False, source_nodes=road_graph.num_nodes, source_edges=road_graph.num_edges)
+    if contract:
+        road_graph = road_graph.contract_chains()
+    if num_landmarks:
+        road_graph.build_landmarks(num_landmarks)
+    return road_graph
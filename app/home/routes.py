@@ -1,5 +1,18 @@
-from flask import request, jsonify, render_template, redirect, url_for
+from flask import request, jsonify, render_template, redirect, url_for, Response
 from. import home_bp
+from.. import metrics
+from..utils import routing_status
+
+@home_bp.route('/metrics', methods=['GET'])
+def metrics_view():
+    # Prometheus text exposition format
+    return Response(metrics.render_text(), mimetype='text/plain; version=0.0.4')
+
+@home_bp.route('/ready', methods=['GET'])
+def ready_view():
+    # Readiness probe: 503 until the road graph is loaded, i.e. until trips can be allocated
+    status = routing_status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 @home_bp.route('/', methods=['POST','GET'])
 def login_post():
@@ -0,0 +1,61 @@
+from time import perf_counter
+from sqlalchemy import event
+from .extensions import db, socketio
+from . import metrics
+
+# Hot-path timings, served on /metrics next to the component metrics. They are cheap
+# enough to stay on in production (a perf_counter pair and a histogram add each), and
+# split the latency of the request types that matter so that a p99 spike can be pinned
+# on one phase:
+#   allocation_phase_seconds{phase}  candidates, filter, snap, routing, matching, load,
+#                                    claim and commit of trip allocation (single and batch)
+#   socket_event_seconds{event}      Socket.IO handler run time per event
+#   db_commit_seconds                every session commit, flush included
+#   socket_emit_recipients{event}    clients each emitted event was delivered to
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+allocation_phase_seconds = metrics.histogram(
+    'allocation_phase_seconds', 'Time spent in each phase of a trip allocation', labelnames=('phase',)
+)
+socket_event_seconds = metrics.histogram(
+    'socket_event_seconds', 'Time spent handling one Socket.IO event', labelnames=('event',)
+)
+db_commit_seconds = metrics.histogram('db_commit_seconds', 'Time a session commit takes, flush included')
+emit_recipients = metrics.histogram(
+    'socket_emit_recipients', 'Clients an emitted Socket.IO event was delivered to',
+    buckets=COUNT_BUCKETS, labelnames=('event',)
+)
+
+def phase(name):
+    """`with phase('routing'):` times one allocation phase."""
+    return allocation_phase_seconds.labels(phase=name).time()
+
+def on_event(name):
+    """socketio.on(name), recording the handler's run time per event."""
+    timer = socket_event_seconds.labels(event=name)
+    def decorator(handler):
+        return socketio.on(name)(metrics.timed(timer)(handler))
+    return decorator
+
+def emit(event_name, data, to=None):
+    """socketio.emit, counting how many clients the event goes to (`to=None` is everyone)."""
+    server = socketio.server
+    if server is not None:
+        # rooms[namespace][room] holds the room's clients; the None room has all of them
+        emit_recipients.labels(event=event_name).observe(len(server.manager.rooms.get('/', {}).get(to, ())))
+    socketio.emit(event_name, data, to=to)
+
+def _commit_started(session):
+    session.info['commit_started'] = perf_counter()
+
+def _commit_finished(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        db_commit_seconds.observe(perf_counter() - started)
+
+def init_app(app):
+    # db.session is process-wide, so the listeners are registered once for every app
+    if not event.contains(db.session, 'before_commit', _commit_started):
+        event.listen(db.session, 'before_commit', _commit_started)
+        event.listen(db.session, 'after_commit', _commit_finished)
@@ -0,0 +1,99 @@
+import atexit
+import threading
+import time
+from .extensions import db, socketio
+from .models import Cab
+from . import metrics
+
+# Write-behind buffer for cab GPS pings. Pings only overwrite the cab's pending entry
+# (so a cab that pinged 5 times since the last flush is written once), and a background
+# task writes everything with one executemany UPDATE every LOCATION_FLUSH_INTERVAL
+# seconds. The live positions are served from the fleet store meanwhile, so the DB
+# copy being up to one interval behind is fine.
+
+flush_size = metrics.histogram(
+    'location_flush_size', 'Cab rows written per location flush',
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+)
+flush_seconds = metrics.histogram('location_flush_seconds', 'Time spent writing one location flush')
+updates_total = metrics.counter('location_updates_total', 'Location pings received')
+coalesced_total = metrics.counter('location_updates_coalesced_total', 'Location pings overwritten before being flushed')
+
+_cab_table = Cab.__table__
+_update_position = (
+    db.update(_cab_table)
+    .where(_cab_table.c.id == db.bindparam('cab_id'))
+    .values(current_lat=db.bindparam('lat'), current_lon=db.bindparam('lon'))
+)
+
+class LocationWriteBuffer:
+    def __init__(self):
+        self.app = None
+        self.interval = 1.0
+        self._pending = {} # cab_id -> (lat, lon), latest ping wins
+        self._lock = threading.Lock()
+        self._task = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LOCATION_FLUSH_INTERVAL', self.interval)
+        with self._lock:
+            self._pending = {}
+        # don't lose the last interval's positions on shutdown; registered once however
+        # many apps are created (flush writes with the latest one)
+        atexit.unregister(self.flush)
+        atexit.register(self.flush)
+
+    def add(self, cab_id, lat, lon):
+        updates_total.inc()
+        with self._lock:
+            if cab_id in self._pending:
+                coalesced_total.inc()
+            self._pending[cab_id] = (lat, lon)
+
+        if not self.interval:
+            # write-through, e.g. for tests or a single-cab dev setup
+            self.flush()
+        elif self._task is None:
+            # started lazily so scripts that only create the app never spawn the flusher
+            self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Location flush failed")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+
+        rows = [
+            {'cab_id': cab_id, 'lat': lat, 'lon': lon}
+            for cab_id, (lat, lon) in pending.items()
+        ]
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                # One UPDATE statement executed with many parameter sets (executemany).
+                # Core rather than ORM bulk update: a cab deleted in the meantime is
+                # simply skipped instead of failing the whole batch.
+                db.session.execute(_update_position, rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put the positions back unless a newer ping already replaced them
+                with self._lock:
+                    for cab_id, position in pending.items():
+                        self._pending.setdefault(cab_id, position)
+                raise
+
+        flush_seconds.observe(time.perf_counter() - started)
+        flush_size.observe(len(rows))
+        return len(rows)
+
+location_buffer = LocationWriteBuffer()
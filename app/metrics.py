@@ -0,0 +1,156 @@
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# Tiny in-process metrics registry: counters, gauges and histograms that render in the
+# Prometheus text exposition format (served on /metrics). Recording a value is a dict
+# lookup plus a lock-protected add, cheap enough for the hot paths.
+# Metrics created with `labelnames` are families: `.labels(phase='routing')` returns the
+# child metric for that label value (created on first use, then a dict lookup).
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{self.name}_bucket{{le="{le}"}}', cumulative
+        yield f'{self.name}_sum', self.sum
+        yield f'{self.name}_count', self.count
+
+    def time(self):
+        """`with histogram.time():` observes how long the block took, in seconds."""
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started)
+
+def timed(histogram):
+    """Decorator observing the run time of every call into `histogram`."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started)
+        return wrapper
+    return decorator
+
+class Family:
+    def __init__(self, cls, name, description, labelnames, **kwargs):
+        self.type_name = cls.type_name
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._make = lambda: cls(name, description, **kwargs)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **values):
+        key = tuple(str(values[label]) for label in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._make())
+        return child
+
+    def samples(self):
+        for key, child in sorted(self._children.items()):
+            labels = ','.join(f'{label}="{value}"' for label, value in zip(self.labelnames, key))
+            for sample_name, value in child.samples():
+                if sample_name.endswith('}'):
+                    # histogram bucket: name_bucket{le="..."}
+                    sample_name = sample_name.replace('{', '{' + labels + ',', 1)
+                else:
+                    sample_name = f'{sample_name}{{{labels}}}'
+                yield sample_name, value
+
+def _get_or_create(cls, name, description, labelnames=None, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            if labelnames:
+                metric = Family(cls, name, description, labelnames, **kwargs)
+            else:
+                metric = cls(name, description, **kwargs)
+            _registry[name] = metric
+        return metric
+
+def counter(name, description, labelnames=None):
+    return _get_or_create(Counter, name, description, labelnames)
+
+def gauge(name, description, labelnames=None):
+    return _get_or_create(Gauge, name, description, labelnames)
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS, labelnames=None):
+    return _get_or_create(Histogram, name, description, labelnames, buckets=buckets)
+
+def render_text():
+    lines = []
+    for metric in sorted(_registry.values(), key=lambda m: m.name):
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.type_name}')
+        for sample_name, value in metric.samples():
+            lines.append(f'{sample_name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -28,7 +28,7 @@ class Cab(db.Model):
     current_lon = db.Column(db.Float, nullable=False)
     destination_latitude = db.Column(db.Float, nullable=True)
     destination_longitude = db.Column(db.Float, nullable=True)
-    status = db.Column(db.String(20), nullable=False, default='available') # 'available', 'on_trip', 'unavailable'
+    status = db.Column(db.String(20), nullable=False, default='available', index=True) # 'available', 'on_trip', 'unavailable'
 
 class Trip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -38,4 +38,10 @@ class Trip(db.Model):
     start_lon = db.Column(db.Float, nullable=False)
     end_lat = db.Column(db.Float, nullable=True)
     end_lon = db.Column(db.Float, nullable=True)
-    status = db.Column(db.String(20), nullable=False, default='requested') # 'requested', 'in_progress', 'completed', 'cancelled'
\ No newline at end of file
+    status = db.Column(db.String(20), nullable=False, default='requested') # 'requested', 'in_progress', 'completed', 'cancelled'
+
+    __table_args__ = (
+        db.Index('ix_trip_status_cab_id', 'status', 'cab_id'),
+        db.Index('ix_trip_employee_id_status', 'employee_id', 'status'),
+        db.Index('ix_trip_cab_id_status', 'cab_id', 'status'),
+    )
\ No newline at end of file
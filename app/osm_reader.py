@@ -0,0 +1,230 @@
+import bz2
+import gzip
+import hashlib
+import json
+import re
+from xml.etree.ElementTree import iterparse
+import numpy as np
+from .geo import haversine_distances
+
+# Builds the drivable road network from local OSM data instead of the Overpass API, for
+# CI and air-gapped deploys (generate_graph.py --offline):
+#   - Overpass JSON responses, e.g. the ones osmnx cached in cache/*.json
+#   - an .osm (optionally .gz / .bz2) or .osm.pbf extract; .pbf needs `pip install osmium`
+# Elements are streamed, never loaded as a whole document: the ways are read first and
+# only the nodes they use are kept on a second pass, so memory goes with the size of the
+# road network rather than of the file. The result is the same MultiDiGraph osmnx builds
+# (same drive filter, oneway rules and edge attributes), and deterministic: nodes and ways
+# are added in id order, so the same data gives the same graph whatever the file order.
+
+CHUNK_SIZE = 1 << 16 # characters read at a time from a JSON response
+
+# osmnx's Overpass filter for network_type='drive', as (tag, regex the value must not match)
+DRIVE_EXCLUDE = (
+    ('area', re.compile('yes')),
+    ('access', re.compile('private')),
+    ('highway', re.compile(
+        'abandoned|bridleway|bus_guideway|construction|corridor|cycleway|elevator|escalator|footway|no|path|'
+        'pedestrian|planned|platform|proposed|raceway|razed|rest_area|service|services|steps|track'
+    )),
+    ('motor_vehicle', re.compile('no')),
+    ('motorcar', re.compile('no')),
+    ('service', re.compile('alley|driveway|emergency_access|parking|parking_aisle|private'))
+)
+WAY_TAGS = ('highway', 'maxspeed', 'oneway', 'junction', 'lanes', 'ref') # kept on the edges
+ONEWAY_VALUES = {'yes', 'true', '1', '-1', 'reverse', 'T', 'F'}
+REVERSED_VALUES = {'-1', 'reverse', 'T'}
+
+def is_drivable(tags):
+    return 'highway' in tags and not any(name in tags and pattern.search(tags[name]) for name, pattern in DRIVE_EXCLUDE)
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+def _is_pbf(path):
+    return path.endswith('.pbf')
+
+def _is_xml(path):
+    return path.removesuffix('.gz').removesuffix('.bz2').endswith('.osm')
+
+def is_overpass_response(path):
+    """True for an Overpass JSON response (an object), False for e.g. a Nominatim one (a list)."""
+    with _open_text(path) as f:
+        while (char := f.read(1)).isspace():
+            pass
+    return char == '{'
+
+def osm_files(paths):
+    """The files of `paths` with OSM data in them, skipping e.g. cached Nominatim responses."""
+    return [path for path in paths if _is_pbf(path) or _is_xml(path) or is_overpass_response(path)]
+
+def iter_overpass_elements(path):
+    """The 'elements' of an Overpass JSON response, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    with _open_text(path) as f:
+        # The array comes after a few short header fields (version, generator, osm3s)
+        buffer = ''
+        while (start := buffer.find('"elements"')) < 0 or buffer.find('[', start) < 0:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError(f"{path} is not an Overpass response, it has no 'elements'")
+            buffer += chunk
+        buffer = buffer[buffer.find('[', start) + 1:]
+        position = 0
+
+        while True:
+            # skip to the next element, reading more when the buffer runs out
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    raise ValueError(f"{path} ends in the middle of the elements")
+                buffer, position = chunk, 0
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the element continues in the next chunk
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield element
+            position = end
+
+def iter_xml_elements(path):
+    """Nodes and ways of an .osm file, in the Overpass JSON element format."""
+    with _open_text(path) as f:
+        events = iterparse(f, events=('start', 'end'))
+        _, root = next(events)
+        for event, element in events:
+            if event != 'end' or element.tag not in ('node', 'way'):
+                continue
+            if element.tag == 'node':
+                yield {'type': 'node', 'id': int(element.get('id')), 'lat': float(element.get('lat')), 'lon': float(element.get('lon'))}
+            else:
+                yield {
+                    'type': 'way',
+                    'id': int(element.get('id')),
+                    'nodes': [int(nd.get('ref')) for nd in element.iter('nd')],
+                    'tags': {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                }
+            root.clear() # drop what was parsed so far
+
+def iter_pbf_elements(path, types=('node', 'way')):
+    """Nodes and/or ways of an .osm.pbf file, in the Overpass JSON element format."""
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("Reading .pbf files needs pyosmium: pip install osmium") from None
+
+    entities = osmium.osm.NOTHING
+    if 'node' in types:
+        entities |= osmium.osm.NODE
+    if 'way' in types:
+        entities |= osmium.osm.WAY
+    for obj in osmium.FileProcessor(path, entities):
+        if obj.is_node():
+            if obj.location.valid():
+                yield {'type': 'node', 'id': obj.id, 'lat': obj.location.lat, 'lon': obj.location.lon}
+        elif obj.is_way():
+            yield {'type': 'way', 'id': obj.id, 'nodes': [node.ref for node in obj.nodes], 'tags': {tag.k: tag.v for tag in obj.tags}}
+
+def iter_elements(path, types=('node', 'way')):
+    """Stream the OSM elements of any supported file, keeping only the given types."""
+    if _is_pbf(path):
+        yield from iter_pbf_elements(path, types)
+        return
+    elements = iter_xml_elements(path) if _is_xml(path) else iter_overpass_elements(path)
+    for element in elements:
+        if element['type'] in types:
+            yield element
+
+def load_boundary(path):
+    """The place polygon of a cached Nominatim response: its first result with one, like osmnx."""
+    from shapely.geometry import shape
+    with open(path) as f:
+        results = json.load(f) # a handful of results, not worth streaming
+    for result in results:
+        if result.get('geojson', {}).get('type') in ('Polygon', 'MultiPolygon'):
+            return shape(result['geojson'])
+    raise ValueError(f"{path} has no place polygon")
+
+def file_digest(path):
+    """SHA-256 of a file, read in chunks, for recording which inputs a graph was built from."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def graph_from_files(paths, boundary=None, simplify=True):
+    """
+    The drivable road network in `paths` as an osmnx-style MultiDiGraph, like
+    ox.graph_from_place(..., network_type='drive') would build it from the same data.
+    Files without OSM data (e.g. Nominatim responses) are skipped, see osm_files.
+    `boundary` (a shapely polygon, see load_boundary) drops the nodes outside it.
+    """
+    import networkx as nx
+    paths = osm_files(paths)
+    if not paths:
+        raise ValueError("No OSM data among the input files")
+
+    # Pass 1: the drivable ways, as (node ids, edge attributes)
+    ways = {}
+    for path in paths:
+        for way in iter_elements(path, types=('way',)):
+            tags = way.get('tags', {})
+            if is_drivable(tags):
+                # consecutive duplicate nodes make zero-length loops
+                nodes = [node for i, node in enumerate(way['nodes']) if i == 0 or node != way['nodes'][i - 1]]
+                ways[way['id']] = (nodes, {name: tags[name] for name in WAY_TAGS if name in tags})
+
+    # Pass 2: the coordinates of the nodes those ways use, nothing else
+    needed = {node for nodes, _ in ways.values() for node in nodes}
+    coordinates = {}
+    for path in paths:
+        for node in iter_elements(path, types=('node',)):
+            if node['id'] in needed:
+                coordinates[node['id']] = (node['lat'], node['lon'])
+    if boundary is not None and coordinates:
+        import shapely
+        ids = np.fromiter(coordinates, dtype=np.int64, count=len(coordinates))
+        lats, lons = np.array(list(coordinates.values())).T
+        inside = shapely.contains_xy(boundary, lons, lats)
+        coordinates = {int(node): coordinates[int(node)] for node in ids[inside]}
+
+    graph = nx.MultiDiGraph(crs='epsg:4326')
+    graph.add_nodes_from((node, {'y': lat, 'x': lon}) for node, (lat, lon) in sorted(coordinates.items()))
+    for way_id in sorted(ways):
+        nodes, tags = ways[way_id]
+        oneway = tags.get('oneway') in ONEWAY_VALUES or tags.get('junction') == 'roundabout'
+        if oneway and tags.get('oneway') in REVERSED_VALUES:
+            nodes = nodes[::-1]
+        # ways leaving the extract (or the boundary) keep their parts inside it
+        pairs = [(u, v) for u, v in zip(nodes, nodes[1:]) if u in coordinates and v in coordinates]
+        if not pairs:
+            continue
+        u_lat, u_lon = np.array([coordinates[u] for u, _ in pairs]).T
+        v_lat, v_lon = np.array([coordinates[v] for _, v in pairs]).T
+        lengths = (haversine_distances(u_lat, u_lon, v_lat, v_lon) * 1000).tolist()
+        attrs = dict(tags, osmid=way_id, oneway=oneway)
+        graph.add_edges_from((u, v, dict(attrs, reversed=False, length=length)) for (u, v), length in zip(pairs, lengths))
+        if not oneway:
+            graph.add_edges_from((v, u, dict(attrs, reversed=True, length=length)) for (u, v), length in zip(pairs, lengths))
+    graph.remove_nodes_from([node for node, degree in graph.degree() if degree == 0])
+    if not graph.number_of_edges():
+        raise ValueError("No drivable roads in the input files" + (" within the boundary" if boundary is not None else ""))
+
+    if simplify:
+        import osmnx as ox
+        graph = ox.simplify_graph(graph)
+    return graph
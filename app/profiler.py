@@ -0,0 +1,175 @@
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from .allocation_queue import allocation_queue
+
+# Sampling profiler for live allocation requests, switched on and off at runtime by an
+# admin (/admin/profiler) without a redeploy. While it is on, `percent` of the profiled
+# requests are sampled: a background thread looks at their stack every `interval`
+# seconds and counts it. The counts are kept as collapsed stacks ("frame;frame;frame N"
+# lines, one root frame per target), the input format of flamegraph.pl and speedscope,
+# downloadable from /admin/profiler/profile and written to PROFILER_DIR when switched off.
+#
+# Profiled are the employee trip request and the admin allocate endpoints, and the
+# allocation queue job, which is where the employee's allocation runs with
+# ALLOCATION_WORKERS. Switching on swaps wrappers in for those functions and starts the
+# sampler; switching off puts the originals back and stops it, so when off the request
+# path is exactly what it is without the profiler.
+#
+# The sampler reads sys._current_frames(), i.e. what each OS thread is running right now,
+# so under eventlet a request is only sampled while it has the CPU (waiting for a socket
+# doesn't show up; SQLite calls and routing do). It is a plain OS thread: the app doesn't
+# monkey-patch threading, so it keeps sampling while a request hogs the hub.
+
+PROFILED_ENDPOINTS = ('employee.request_trip', 'admin.allocate_cab')
+JOB_TARGET = 'allocation_job'
+
+def frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+class RequestProfiler:
+    def __init__(self):
+        self.app = None
+        self.directory = 'profiles'
+        self.rate = 0.0 # fraction of the requests sampled, 0 is off
+        self.interval = 0.005
+        self.last_file = None
+        self._lock = threading.Lock() # switching on and off
+        self._samples_lock = threading.Lock()
+        self._active = {} # id(root frame) -> (root frame, target) of the requests being sampled
+        self._stacks = {} # target -> Counter of collapsed stacks
+        self._requests = Counter() # target -> requests sampled
+        self._originals = {}
+        self._stop = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('PROFILER_DIR', self.directory)
+        self.interval = app.config.get('PROFILER_INTERVAL', self.interval)
+        self.disable(write=False)
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def enable(self, percent, interval=None):
+        """Sample `percent` % of the profiled requests every `interval` seconds. Starting
+        from off, the samples of the previous run are dropped."""
+        with self._lock:
+            self.rate = percent / 100
+            if interval:
+                self.interval = interval
+            if self._thread is not None:
+                return
+            self._stacks = {}
+            self._requests = Counter()
+            self.last_file = None
+            self._install()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, args=(self._stop,), name='request-profiler', daemon=True)
+            self._thread.start()
+
+    def disable(self, write=True):
+        """Switch off; the samples stay downloadable and are written to a file."""
+        with self._lock:
+            self.rate = 0.0
+            if self._thread is None:
+                return None
+            self._uninstall()
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._active = {}
+            if write and self._stacks:
+                self.last_file = self._write()
+            return self.last_file
+
+    def _install(self):
+        for endpoint in PROFILED_ENDPOINTS:
+            view = self.app.view_functions[endpoint]
+            self._originals[endpoint] = view
+            self.app.view_functions[endpoint] = self._wrap(endpoint, view)
+        # an instance attribute shadowing AllocationQueue.run_job, deleted again in _uninstall
+        allocation_queue.run_job = self._wrap(JOB_TARGET, allocation_queue.run_job)
+
+    def _uninstall(self):
+        for endpoint, view in self._originals.items():
+            self.app.view_functions[endpoint] = view
+        self._originals = {}
+        if 'run_job' in vars(allocation_queue):
+            del allocation_queue.run_job
+
+    def _wrap(self, target, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            if random.random() >= self.rate:
+                return func(*args, **kwargs)
+            root = sys._getframe()
+            self._active[id(root)] = (root, target)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._active.pop(id(root), None)
+                with self._samples_lock:
+                    self._requests[target] += 1
+        return profiled
+
+    def _sample(self, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            if not self._active:
+                continue
+            active = dict(self._active)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                # Walk down from the running frame to the wrapper of a sampled request;
+                # a thread (or greenlet) that runs anything else has no such frame
+                stack = []
+                while frame is not None:
+                    entry = active.get(id(frame))
+                    if entry is not None and entry[0] is frame:
+                        stack.append(entry[1])
+                        with self._samples_lock:
+                            self._stacks.setdefault(entry[1], Counter())[';'.join(reversed(stack))] += 1
+                        break
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+
+    def status(self):
+        with self._samples_lock:
+            samples = {target: sum(stacks.values()) for target, stacks in self._stacks.items()}
+            requests = dict(self._requests)
+        return {
+            'enabled': self.enabled,
+            'percent': self.rate * 100,
+            'interval_ms': self.interval * 1000,
+            'targets': {
+                target: {'requests': requests.get(target, 0), 'samples': samples.get(target, 0)}
+                for target in PROFILED_ENDPOINTS + (JOB_TARGET,)
+            },
+            'file': self.last_file
+        }
+
+    def collapsed(self, target=None):
+        """The aggregated profile as collapsed stacks, of one target or of all of them."""
+        lines = []
+        with self._samples_lock:
+            for name, stacks in self._stacks.items():
+                if target is None or name == target:
+                    lines.extend(f"{stack} {count}" for stack, count in stacks.most_common())
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def _write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+        return path
+
+request_profiler = RequestProfiler()
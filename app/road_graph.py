@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Compiled road network: the osmnx/networkx MultiDiGraph flattened into plain NumPy arrays.
+# Nodes are renumbered 0..V-1 and the outgoing roads of node u are
+#   indices[indptr[u]:indptr[u + 1]]      (target nodes)
+#   length[indptr[u]:indptr[u + 1]]       (road length in meters)
+#   travel_time[indptr[u]:indptr[u + 1]]  (free-flow seconds, optional)
+# i.e. a CSR (compressed sparse row) adjacency. Each array is stored as its own .npy file
+# so it can be opened with np.load(mmap_mode='r'): every worker process maps the same
+# file pages instead of unpickling a private dict-of-dicts copy of the graph.
+# Space Complexity: O(V + E) numbers, no per-node/per-edge Python objects.
+#
+# Routing minimizes one edge array, the graph's `weight`: 'length' (shortest) or
+# 'travel_time' (fastest), chosen when the graph is built (generate_graph.py --weight)
+# since the landmark index is only valid for the weight it was computed with. Route
+# costs are meters or seconds accordingly; `length` stays meters for ETAs and simulation.
+#
+# Format version 2 adds manifest.json: the format version, the weight, array dtypes and
+# shapes, build metadata and a SHA-256 content hash over all arrays, which identifies the
+# graph a process runs on. Arrays are stored compact (float32 edge costs, int32 CSR).
+# A directory without a manifest is a version 1 graph and loads as one by length.
+#
+# Format version 3 names the array files after the content hash (lat.<hash>.npy) and lists
+# them in the manifest, so that regenerating the graph next to running workers is safe:
+# a build never writes to a file a worker has mapped (truncating it would SIGBUS them),
+# each file is written under a temporary name and renamed into place, and the manifest,
+# renamed last, switches readers to the new build in one step. The previous build's files
+# are kept for workers still loading it; older ones are removed, which doesn't disturb a
+# process that still maps them (on Windows the removal fails and is retried next save).
+
+FORMAT_VERSION = 3
+MANIFEST_NAME = 'manifest.json'
+ARRAY_NAMES = ('node_ids', 'lat', 'lon', 'indptr', 'indices', 'length')
+WEIGHTS = ('length', 'travel_time')
+ARRAY_DTYPES = {
+    'node_ids': np.int64,
+    'lat': np.float64, # float32 would be off by up to a meter
+    'lon': np.float64,
+    'indices': np.int32,
+    'length': np.float32,
+    'travel_time': np.float32,
+    'landmarks': np.int32,
+    'landmark_from': np.float32,
+    'landmark_to': np.float32
+} # indptr: int32 if the edge count allows
+
+# Optional routing index (ALT = A*, Landmarks, Triangle inequality), built offline by
+# build_landmarks(). For a handful of landmark nodes L we store d(L, v) and d(v, L) for
+# every node v; the triangle inequality then gives a cheap lower bound on d(v, t) that
+# steers A* towards the target, so a query settles a small corridor of the graph
+# instead of a whole disc around the source.
+INDEX_ARRAY_NAMES = ('landmarks', 'landmark_from', 'landmark_to')
+UNREACHABLE = np.float32(1e9) # landmark distance stored for node pairs with no route
+
+# scipy.sparse and sklearn are imported where they are used, not with this module: they
+# take about a second to import, which every worker would otherwise pay at boot before
+# serving a single page (see utils.warm_up_road_network).
+
+class RoadGraph:
+    def __init__(self, node_ids, lat, lon, indptr, indices, length, travel_time=None, weight='length'):
+        if weight not in WEIGHTS or (weight == 'travel_time' and travel_time is None):
+            raise ValueError(f"Can't route by {weight!r} on this graph")
+        self.node_ids = node_ids # original OSM node ids, for debugging / joining back to OSM
+        self.lat = lat
+        self.lon = lon
+        self.indptr = indptr
+        self.indices = indices
+        self.length = length
+        self.travel_time = travel_time
+        self.weight_name = weight
+        self.weight = length if weight == 'length' else travel_time # what routing minimizes
+        self._spatial_index = None
+        self.landmarks = None # landmark node indices, shape (K,)
+        self.landmark_from = None # d(landmark, node), shape (V, K)
+        self.landmark_to = None # d(node, landmark), shape (V, K)
+        self._landmark_error = None
+        self.signature = None # see file_signature(), set when loaded from disk
+        self.content_hash = None # from the manifest, set when saved or loaded
+        self.metadata = {} # how the graph was built, kept in the manifest
+
+    @property
+    def has_landmarks(self):
+        return self.landmarks is not None
+
+    @property
+    def landmark_error(self):
+        """
+        Most a landmark bound can be off by from storing the distances as float32: each is
+        rounded by up to half an ulp, an absolute error that grows with the distance, and a
+        bound is the difference of two of them. Computed on first use (a pass over the index).
+        """
+        if self._landmark_error is None:
+            largest = 0.0
+            for distances in (np.asarray(self.landmark_from), np.asarray(self.landmark_to)):
+                reachable = distances[distances < UNREACHABLE]
+                if reachable.size:
+                    largest = max(largest, float(reachable.max()))
+            self._landmark_error = largest * float(np.finfo(np.float32).eps)
+        return self._landmark_error
+
+    @property
+    def has_spatial_index(self):
+        return self._spatial_index is not None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def neighbors(self, node):
+        """Return (target_nodes, weights) of the roads leaving `node` as Python lists."""
+        lo, hi = int(self.indptr[node]), int(self.indptr[node + 1])
+        return self.indices[lo:hi].tolist(), self.weight[lo:hi].tolist()
+
+    def edge_between(self, u, v):
+        """CSR position of the road u -> v (at most one, parallel roads were collapsed), or None."""
+        lo, hi = int(self.indptr[u]), int(self.indptr[u + 1])
+        matches = np.flatnonzero(np.asarray(self.indices[lo:hi]) == v)
+        return lo + int(matches[0]) if len(matches) else None
+
+    def edge_sources(self):
+        """Source node of every CSR edge (the CSR layout only stores targets)."""
+        return np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(np.asarray(self.indptr)))
+
+    def build_spatial_index(self):
+        # A BallTree over node coordinates with the haversine metric, built once per process
+        # (load_road_network does it right after loading) and reused by every snap() call.
+        if self._spatial_index is None:
+            from sklearn.neighbors import BallTree
+            coords = np.radians(np.column_stack((self.lat, self.lon)))
+            self._spatial_index = BallTree(coords, metric='haversine')
+        return self._spatial_index
+
+    def snap(self, lats, lons):
+        """
+        Snap coordinates to their nearest graph nodes in one vectorized query.
+        Accepts scalars or sequences and returns an int64 array of node indices.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        if lats.size == 0:
+            return np.empty(0, dtype=np.int64)
+        query = np.radians(np.column_stack((lats, lons)))
+        _, nearest = self.build_spatial_index().query(query, k=1)
+        return nearest[:, 0].astype(np.int64)
+
+    def to_csr_matrix(self):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((np.asarray(self.weight), np.asarray(self.indices), np.asarray(self.indptr)),
+                          shape=(self.num_nodes, self.num_nodes))
+
+    def build_landmarks(self, num_landmarks=16):
+        """
+        Offline preprocessing for ALT routing. Landmarks are picked by farthest-point
+        selection (each new landmark is the node farthest from the ones already chosen),
+        which spreads them around the edge of the map where their bounds are tightest.
+        Costs 2 * num_landmarks full Dijkstra runs (in scipy, i.e. C).
+        """
+        from scipy.sparse.csgraph import dijkstra
+        matrix = self.to_csr_matrix()
+        num_landmarks = min(num_landmarks, self.num_nodes)
+
+        landmarks = []
+        closest = np.full(self.num_nodes, np.inf)
+        candidate = 0
+        from_rows = []
+        for _ in range(num_landmarks):
+            landmarks.append(candidate)
+            row = dijkstra(matrix, indices=candidate)
+            from_rows.append(row)
+            closest = np.minimum(closest, np.where(np.isfinite(row), row, np.inf))
+            # farthest reachable node from every landmark chosen so far
+            reachable = np.where(np.isfinite(closest), closest, -1.0)
+            candidate = int(np.argmax(reachable))
+            if reachable[candidate] <= 0:
+                break
+
+        to_rows = dijkstra(matrix.T.tocsr(), indices=landmarks)
+
+        # Unreachable pairs become a large finite number: the bounds stay valid (only
+        # unreachable node pairs can get a huge bound) and inf - inf never yields NaN.
+        self.landmarks = np.array(landmarks, dtype=np.int32)
+        self.landmark_from = np.nan_to_num(np.array(from_rows).T, posinf=UNREACHABLE).astype(np.float32)
+        self.landmark_to = np.nan_to_num(np.atleast_2d(to_rows).T, posinf=UNREACHABLE).astype(np.float32)
+        self._landmark_error = None
+        return self
+
+    @classmethod
+    def from_networkx(cls, graph, weight='length'):
+        """
+        Compile an osmnx MultiDiGraph (nodes with 'x'/'y', edges with 'length' and, if
+        every edge has one, 'travel_time'). Parallel roads between the same pair of nodes
+        collapse to the one with the lowest `weight`, the only one routing can ever use.
+        """
+        osm_ids = list(graph.nodes)
+        position = {node: i for i, node in enumerate(osm_ids)}
+        timed = all('travel_time' in attrs for _, _, attrs in graph.edges(data=True))
+
+        best = {}
+        for u, v, attrs in graph.edges(data=True):
+            key = (position[u], position[v])
+            costs = (float(attrs.get('length', 1.0)), float(attrs['travel_time']) if timed else None)
+            if key not in best or costs[WEIGHTS.index(weight)] < best[key][WEIGHTS.index(weight)]:
+                best[key] = costs
+
+        edges = sorted(best.items())
+        sources = np.fromiter((u for (u, _), _ in edges), dtype=np.int64, count=len(edges))
+        indptr = np.zeros(len(osm_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(osm_ids)), out=indptr[1:])
+
+        return cls(
+            node_ids=np.array(osm_ids, dtype=np.int64),
+            lat=np.array([graph.nodes[n]['y'] for n in osm_ids], dtype=np.float64),
+            lon=np.array([graph.nodes[n]['x'] for n in osm_ids], dtype=np.float64),
+            indptr=indptr,
+            indices=np.fromiter((v for (_, v), _ in edges), dtype=np.int32, count=len(edges)),
+            length=np.fromiter((length for _, (length, _) in edges), dtype=np.float64, count=len(edges)),
+            travel_time=np.fromiter((time for _, (_, time) in edges), dtype=np.float64, count=len(edges)) if timed else None,
+            weight=weight
+        )
+
+    def contract_chains(self):
+        """
+        Contract degree-2 chains: a node that only passes traffic through (one road in and
+        one out, or both directions of a two-way road to the same two neighbours) is
+        removed and its two roads become one, with lengths and travel times added up.
+        Costs between the remaining nodes are unchanged, and every search settles fewer
+        nodes. The price is geometry: a contracted road is a straight line between its
+        ends for ETA tracking and the simulator, and positions snap to the remaining nodes.
+        Returns a new graph without landmarks (build them afterwards).
+        """
+        indptr = np.asarray(self.indptr, dtype=np.int64)
+        heads = np.asarray(self.indices, dtype=np.int64)
+        tails = self.edge_sources()
+        out_degree = np.diff(indptr)
+        in_order = np.argsort(heads, kind='stable')
+        in_indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=self.num_nodes), out=in_indptr[1:])
+        in_degree = np.diff(in_indptr)
+
+        keep = np.ones(self.num_nodes, dtype=bool)
+        for node in np.flatnonzero(((out_degree == 1) & (in_degree == 1)) | ((out_degree == 2) & (in_degree == 2))).tolist():
+            outs = set(heads[indptr[node]:indptr[node + 1]].tolist())
+            ins = set(tails[in_order[in_indptr[node]:in_indptr[node + 1]]].tolist())
+            if node in outs or node in ins:
+                continue # a loop road
+            if (out_degree[node] == 1 and outs != ins) or (out_degree[node] == 2 and outs == ins and len(outs) == 2):
+                keep[node] = False
+
+        costs = [np.asarray(self.length, dtype=np.float64)]
+        if self.travel_time is not None:
+            costs.append(np.asarray(self.travel_time, dtype=np.float64))
+        weight_row = WEIGHTS.index(self.weight_name)
+
+        # Walk from every edge leaving a kept node along the chain to the next kept node
+        best = {}
+        passed = np.zeros(self.num_nodes, dtype=bool)
+        def walk(edges):
+            for edge in edges:
+                source, previous, node = tails[edge], tails[edge], heads[edge]
+                total = [float(cost[edge]) for cost in costs]
+                while not keep[node]:
+                    passed[node] = True
+                    lo, hi = indptr[node], indptr[node + 1]
+                    step = lo if heads[lo] != previous or hi - lo == 1 else lo + 1
+                    total = [t + float(cost[step]) for t, cost in zip(total, costs)]
+                    previous, node = node, heads[step]
+                if node != source:
+                    key = (int(source), int(node))
+                    if key not in best or total[weight_row] < best[key][weight_row]:
+                        best[key] = total
+
+        walk(np.flatnonzero(keep[tails]).tolist())
+        # A ring of pass-through nodes only (e.g. a roundabout that is a whole component)
+        # has no kept node to start from; keep one node of it
+        for node in np.flatnonzero(~keep).tolist():
+            if not passed[node]:
+                keep[node] = True
+                walk(range(indptr[node], indptr[node + 1]))
+
+        renumber = np.cumsum(keep) - 1
+        edges = sorted(((int(renumber[u]), int(renumber[v])), total) for (u, v), total in best.items())
+        sources = np.fromiter((u for (u, _), _ in edges), dtype=np.int64, count=len(edges))
+        new_indptr = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=int(keep.sum())), out=new_indptr[1:])
+
+        contracted = RoadGraph(
+            node_ids=np.asarray(self.node_ids)[keep],
+            lat=np.asarray(self.lat)[keep],
+            lon=np.asarray(self.lon)[keep],
+            indptr=new_indptr,
+            indices=np.fromiter((v for (_, v), _ in edges), dtype=np.int32, count=len(edges)),
+            length=np.array([total[0] for _, total in edges], dtype=np.float64),
+            travel_time=np.array([total[1] for _, total in edges], dtype=np.float64) if self.travel_time is not None else None,
+            weight=self.weight_name
+        )
+        contracted.metadata = dict(self.metadata, contracted=True)
+        return contracted
+
+    def arrays(self):
+        """{file name: array} of everything that gets saved, in the compact on-disk dtypes."""
+        names = ARRAY_NAMES + (('travel_time',) if self.travel_time is not None else ())
+        names += INDEX_ARRAY_NAMES if self.has_landmarks else ()
+        indptr_dtype = np.int32 if self.num_edges < np.iinfo(np.int32).max else np.int64
+        return {
+            name: np.ascontiguousarray(getattr(self, name), dtype=ARRAY_DTYPES.get(name, indptr_dtype))
+            for name in names
+        }
+
+    @staticmethod
+    def hash_arrays(arrays, weight):
+        """SHA-256 over the routing weight and the names, dtypes, shapes and bytes of the arrays."""
+        digest = hashlib.sha256(f"weight:{weight};".encode())
+        for name in sorted(arrays):
+            array = np.ascontiguousarray(arrays[name])
+            digest.update(f"{name}:{array.dtype.str}:{array.shape};".encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        arrays = self.arrays()
+        self.content_hash = self.hash_arrays(arrays, self.weight_name)
+        files = {name: f"{name}.{self.content_hash[:12]}.npy" for name in arrays}
+        for name, array in arrays.items():
+            # rename over a same-content build's file rather than write into it: it may be mapped
+            with open(os.path.join(path, files[name] + '.tmp'), 'wb') as f:
+                np.save(f, array)
+            os.replace(os.path.join(path, files[name] + '.tmp'), os.path.join(path, files[name]))
+
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'weight': self.weight_name,
+            'content_hash': self.content_hash,
+            'num_nodes': self.num_nodes,
+            'num_edges': self.num_edges,
+            'arrays': {
+                name: {'file': files[name], 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                for name, array in arrays.items()
+            },
+            'metadata': self.metadata
+        }
+        try:
+            previous = set(self.array_files(path, self.read_manifest(path)).values())
+        except (FileNotFoundError, ValueError):
+            previous = set()
+        # written last, so a manifest never describes arrays that aren't complete yet
+        with open(os.path.join(path, MANIFEST_NAME + '.tmp'), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(os.path.join(path, MANIFEST_NAME + '.tmp'), os.path.join(path, MANIFEST_NAME))
+
+        # Arrays of the builds before the previous one
+        current = {os.path.join(path, file) for file in files.values()}
+        for entry in os.scandir(path):
+            if entry.name.endswith('.npy') and entry.path not in current and entry.path not in previous:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def read_manifest(path):
+        """The manifest of a compiled graph, or a version 1 stand-in for one without."""
+        try:
+            with open(os.path.join(path, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            if not os.path.isdir(path):
+                raise
+            arrays = {entry.name[:-len('.npy')]: {} for entry in os.scandir(path) if entry.name.endswith('.npy')}
+            return {'format_version': 1, 'weight': 'length', 'content_hash': None, 'arrays': arrays, 'metadata': {}}
+        if manifest['format_version'] > FORMAT_VERSION:
+            raise ValueError(f"{path} is a version {manifest['format_version']} graph, this code reads up to version {FORMAT_VERSION}")
+        return manifest
+
+    @staticmethod
+    def array_files(path, manifest):
+        """{array name: file path} of the build a manifest describes (versions 1 and 2 use name.npy)."""
+        return {name: os.path.join(path, spec.get('file', f"{name}.npy")) for name, spec in manifest['arrays'].items()}
+
+    @staticmethod
+    def file_signature(path):
+        """
+        (name, mtime, size) of the manifest, which is replaced last by every save, or of each
+        .npy file of a version 1 graph without one; None if the graph is missing.
+        """
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except FileNotFoundError:
+            return None
+        manifest = [entry for entry in entries if entry.name == MANIFEST_NAME]
+        return tuple(
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in manifest or [entry for entry in entries if entry.name.endswith('.npy')]
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        # Raises FileNotFoundError if the graph has not been compiled yet
+        signature = cls.file_signature(path)
+        manifest = cls.read_manifest(path)
+        files = cls.array_files(path, manifest)
+        arrays = {name: np.load(files[name], mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        if 'travel_time' in files:
+            arrays['travel_time'] = np.load(files['travel_time'], mmap_mode=mmap_mode)
+        graph = cls(**arrays, weight=manifest['weight'])
+        graph.signature = signature
+        graph.content_hash = manifest['content_hash']
+        graph.metadata = manifest['metadata']
+
+        # The routing index is optional; without it queries fall back to plain Dijkstra
+        if all(name in files for name in INDEX_ARRAY_NAMES):
+            for name in INDEX_ARRAY_NAMES:
+                setattr(graph, name, np.load(files[name], mmap_mode=mmap_mode))
+        return graph
+
+    @classmethod
+    def verify(cls, path):
+        """True if the arrays on disk still hash to the manifest's content hash."""
+        graph = cls.load(path)
+        return graph.content_hash is not None and cls.hash_arrays(graph.arrays(), graph.weight_name) == graph.content_hash
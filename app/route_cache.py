@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from . import metrics
+
+# Query-level cache for road routing: (source_node, target_node) -> (distance, path).
+# Keys are snapped graph nodes, not raw coordinates, so every cab idling at the same
+# depot and every employee at the same office share entries. Bounded (LRU) and with a
+# TTL, and cleared whenever it is asked about a different graph than before, e.g. after
+# load_road_network picked up a changed graph file.
+
+hits_total = metrics.counter('route_cache_hits_total', 'Route queries answered from the route cache')
+misses_total = metrics.counter('route_cache_misses_total', 'Route queries that had to search the graph')
+entries = metrics.gauge('route_cache_entries', 'Entries currently held by the route cache')
+
+class RouteCache:
+    def __init__(self, maxsize=100000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # (source, target) -> (expires_at, distance, path)
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('ROUTE_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.get('ROUTE_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            entries.set(0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bind(self, graph):
+        # Entries are only valid for the graph they were computed on (caller holds the lock)
+        if graph is not self._graph:
+            self._entries.clear()
+            entries.set(0)
+            self._graph = graph
+
+    def get(self, graph, source, target, need_path=False):
+        """Return (distance, path) or None. With need_path, distance-only entries count as a miss."""
+        key = (source, target)
+        with self._lock:
+            self._bind(graph)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, distance, path = entry
+                if expires_at < time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                elif need_path and path is None and distance != float('inf'):
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+        if entry is None:
+            misses_total.inc()
+            return None
+        hits_total.inc()
+        return distance, path
+
+    def get_distances(self, graph, source, targets):
+        """
+        Cached distances from source to each of targets, as {target: distance}. Counts as
+        one hit when every target was cached (the query needs no search), else one miss.
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            self._bind(graph)
+            for target in targets:
+                entry = self._entries.get((source, target))
+                if entry is not None and entry[0] >= now:
+                    found[target] = entry[1]
+        if len(found) == len(targets):
+            hits_total.inc()
+        else:
+            misses_total.inc()
+        return found
+
+    def put(self, graph, source, target, distance, path=None):
+        if not self.maxsize:
+            return
+        key = (source, target)
+        with self._lock:
+            self._bind(graph)
+            if path is None and key in self._entries:
+                # don't throw away a path we already have for the same distance
+                path = self._entries[key][2]
+            self._entries[key] = (time.monotonic() + self.ttl, distance, path)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            entries.set(len(self._entries))
+
+route_cache = RouteCache()
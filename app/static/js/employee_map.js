@@ -10,7 +10,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
     let myLocationMarker = null;
     let allocatedCabMarker = null;
     let tripLine = null;
-    let myTripId = currentTripId;
+    let myTripId = null;
     let myCabId = null;
     const otherCabMarkers = {};
 
@@ -84,28 +84,107 @@ document.addEventListener('DOMContentLoaded', (event) => {
         map.setView([userLocation.lat, userLocation.lon], 15);
     }
 
-    if (typeof onTripCabs !== 'undefined') {
-        onTripCabs.forEach(cab => {
-            if (cab.id !== myCabId && cab.status == "on_trip") {
-                otherCabMarkers[cab.id] = L.marker([cab.current_lat, cab.current_lon], { icon: icons.onTripOther })
-                    .addTo(map)
-                    .bindPopup(`Cab ID: ${cab.id}<br>Status: On Trip`);
-            }
-        });
+    // My cab: moved out of the other on-trip cabs, drawn in red with a line to my location
+    function showAllocatedCab(cabId, cabLatLng) {
+        myCabId = cabId;
+        if (otherCabMarkers[cabId]) {
+            cabLatLng = cabLatLng || otherCabMarkers[cabId].getLatLng();
+            map.removeLayer(otherCabMarkers[cabId]);
+            delete otherCabMarkers[cabId];
+        }
+        statusMessage.textContent = `Cab ${myCabId} is on the way!`;
+        requestTripBtn.style.display = 'none';
+        finishTripBtn.style.display = 'block';
+        // without a position (e.g. my trip from a state delta) its next location update places it
+        if (cabLatLng) {
+            placeMyCab(cabLatLng);
+        }
     }
 
-   
-    if (typeof allocatedCab !== 'undefined' && allocatedCab) {
-        myCabId = allocatedCab.id;
-        myTripId = allocatedCab.trip_id; // Make sure trip_id is passed from backend
-        allocatedCabMarker = L.marker([allocatedCab.current_lat, allocatedCab.current_lon], { icon: icons.myCab })
-            .addTo(map)
-            .bindPopup(`My Cab<br>ID: ${allocatedCab.id}`);
-        tripLine = L.polyline([myLocationMarker.getLatLng(), allocatedCabMarker.getLatLng()], { color: '#FF0000' }).addTo(map);
-        statusMessage.textContent = `Cab ${myCabId} is on the way!`;
+    function placeMyCab(cabLatLng) {
+        if (allocatedCabMarker) {
+            allocatedCabMarker.setLatLng(cabLatLng);
+        } else {
+            allocatedCabMarker = L.marker(cabLatLng, { icon: icons.myCab })
+                .addTo(map)
+                .bindPopup(`My Cab<br>ID: ${myCabId}`);
+        }
+        if (!myLocationMarker) {
+            return;
+        }
+        if (tripLine) {
+            tripLine.setLatLngs([myLocationMarker.getLatLng(), cabLatLng]);
+        } else {
+            tripLine = L.polyline([myLocationMarker.getLatLng(), cabLatLng], { color: '#FF0000' }).addTo(map);
+        }
+    }
+
+    function resetTripUi() {
+        requestTripBtn.style.display = 'block';
+        requestTripBtn.disabled = false;
+        finishTripBtn.style.display = 'none';
+        finishTripBtn.disabled = false;
+        finishTripBtn.textContent = 'Finish My Trip';
+        // Clean up map
+        if (allocatedCabMarker) map.removeLayer(allocatedCabMarker);
+        if (tripLine) map.removeLayer(tripLine);
+        // Reset state variables
+        myTripId = null;
+        myCabId = null;
+        allocatedCabMarker = null;
+        tripLine = null;
+    }
 
+    function showCancelledTrip(tripId, message) {
+        statusMessage.textContent = `Error: ${message}`;
+        cancelledTripIdInput.value = tripId;
+        reRequestTripBtn.style.display = 'block';
+        reRequestTripBtn.disabled = false;
         requestTripBtn.style.display = 'none';
-        finishTripBtn.style.display = 'block';
+    }
+
+    // My trip as a row {id, status, employee_id, start_lat, start_lon, cab_id}
+    function applyMyTrip(trip) {
+        if (trip.status === 'in_progress') {
+            myTripId = trip.id;
+            showAllocatedCab(trip.cab_id, null);
+        } else if (trip.status === 'requested') {
+            myTripId = trip.id;
+            statusMessage.textContent = `Trip Requested (ID: ${myTripId}). Waiting for allocation.`;
+            requestTripBtn.disabled = true;
+        } else if (trip.status === 'cancelled' && trip.id === myTripId) {
+            showCancelledTrip(trip.id, 'No cab could be allocated to your trip.');
+        } else if (trip.status === 'completed' && trip.id === myTripId) {
+            resetTripUi();
+        }
+    }
+
+    // The page is only a shell: the cabs and my trip come from /employee/state, as a
+    // snapshot the first time and then, on every reconnect, as the changes since the
+    // last version we applied
+    let stateVersion = null;
+
+    async function loadState() {
+        const url = stateVersion === null ? '/employee/state' : `/employee/state?since=${stateVersion}`;
+        try {
+            const response = await fetch(url, { credentials: 'include' });
+            if (!response.ok) {
+                console.error('Could not load the dashboard state:', response.status);
+                return;
+            }
+            const state = await response.json();
+            if (state.snapshot) {
+                Object.keys(otherCabMarkers).forEach(cabId => {
+                    map.removeLayer(otherCabMarkers[cabId]);
+                    delete otherCabMarkers[cabId];
+                });
+            }
+            state.cabs.forEach(([cab_id, lat, lon, status]) => applyCabUpdate(cab_id, lat, lon, status));
+            state.trips.forEach(applyMyTrip);
+            stateVersion = state.version;
+        } catch (error) {
+            console.error('Could not load the dashboard state:', error);
+        }
     }
 
     map.on('click', function(e) {
@@ -246,21 +325,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
             if (response.ok) {
                 statusMessage.textContent = 'Trip completed! You can now request a new trip.';
-        
                 // Reset UI to initial state
-                requestTripBtn.style.display = 'block';
-                requestTripBtn.disabled = false;
-                finishTripBtn.style.display = 'none';
-                finishTripBtn.disabled = false;
-                finishTripBtn.textContent = 'Finish My Trip';
-                // Clean up map
-                if (allocatedCabMarker) map.removeLayer(allocatedCabMarker);
-                if (tripLine) map.removeLayer(tripLine);
-                // Reset state variables
-                myTripId = null;
-                myCabId = null;
-                allocatedCabMarker = null;
-                tripLine = null;
+                resetTripUi();
             } else {
                 const data = await response.json();
                 alert(`Error: ${data.message || 'Could not finish trip.'}`);
@@ -278,47 +344,43 @@ document.addEventListener('DOMContentLoaded', (event) => {
     // WebSocket Event Handlers 
     const socket = io.connect('http://' + document.domain + ':' + location.port);
 
-    socket.on('connect', () => console.log('Connected to WebSocket for employee dashboard.'));
+    socket.on('connect', () => {
+        console.log('Connected to WebSocket for employee dashboard.');
+        socket.emit('join_employee_room', { public_id: userPublicId });
+        loadState();
+    });
 
    
     socket.on('trip_allocated', (data) => {
         if (data.employee_id === userPublicId) {
             console.log('My trip has been allocated!:', data);
-            myCabId = data.cab_id;
             myTripId = data.trip_id;
-            statusMessage.textContent = `Cab ${myCabId} is on the way!`;
-
-            const cabLatLng = [data.cab_lat, data.cab_lon];
-            if (allocatedCabMarker) {
-                allocatedCabMarker.setLatLng(cabLatLng).setIcon(icons.myCab);
-            } else {
-                allocatedCabMarker = L.marker(cabLatLng, { icon: icons.myCab })
-                    .addTo(map)
-                    .bindPopup(`My Cab<br>ID: ${myCabId}`);
-            }
-            
-            if (tripLine) {
-                tripLine.setLatLngs([myLocationMarker.getLatLng(), cabLatLng]);
-            } else {
-                tripLine = L.polyline([myLocationMarker.getLatLng(), cabLatLng], { color: '#FF0000' }).addTo(map);
-            }
+            showAllocatedCab(data.cab_id, [data.cab_lat, data.cab_lon]);
+        }
+    });
 
-            requestTripBtn.style.display = 'none';
-            finishTripBtn.style.display = 'block';
+    // Remaining distance/ETA of my cab to the pickup, pushed when it changes noticeably
+    socket.on('eta_update', (data) => {
+        if (data.trip_id !== myTripId) return;
+        if (data.eta_seconds === 0) {
+            statusMessage.textContent = `Cab ${data.cab_id} has arrived!`;
+        } else {
+            const minutes = Math.max(1, Math.round(data.eta_seconds / 60));
+            const km = (data.remaining_m / 1000).toFixed(1);
+            statusMessage.textContent = `Cab ${data.cab_id} is on the way! About ${minutes} min away (${km} km).`;
         }
     });
 
-    socket.on('location_update', (data) => {
-        const { cab_id, lat, lon, status } = data;
+    // Sent to this employee's room when a queued request could not get a cab
+    socket.on('trip_cancelled', (data) => {
+        showCancelledTrip(data.trip_id, data.message);
+    });
+
+    function applyCabUpdate(cab_id, lat, lon, status) {
         const cabLatLng = [lat, lon];
 
         if (cab_id === myCabId) {
-            if (allocatedCabMarker) {
-                allocatedCabMarker.setLatLng(cabLatLng);
-                if (tripLine) {
-                    tripLine.setLatLngs([myLocationMarker.getLatLng(), cabLatLng]);
-                }
-            }
+            placeMyCab(cabLatLng); // creates the marker if the allocation came without a position
         } 
         else {
             if (status === 'on_trip') {
@@ -338,5 +400,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 }
             }
         }
+    }
+
+    // One frame per tick with the latest [cab_id, lat, lon, status] of the on-trip cabs that changed
+    socket.on('location_batch', (data) => {
+        data.cabs.forEach(([cab_id, lat, lon, status]) => applyCabUpdate(cab_id, lat, lon, status));
     });
 });
\ No newline at end of file
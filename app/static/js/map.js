@@ -102,22 +102,68 @@ document.addEventListener('DOMContentLoaded', (event) => {
         });
     }
 
-    if (typeof allCabs !== 'undefined') {
-        allCabs.forEach(cab => {
-            const icon = cab.status === 'available' ? icons.available : icons.on_trip;
-            cabMarkers[cab.id] = L.marker([cab.current_lat, cab.current_lon], { icon: icon })
-                .addTo(map)
-                .bindPopup(`<b>Cab ID:</b> ${cab.id}<br><b>Status:</b> ${cab.status}`);
-        });
+    function removeTrip(tripId) {
+        const listItem = document.getElementById(`trip-${tripId}`);
+        if (listItem) {
+            listItem.remove();
+        }
+        if (employeeMarkers[tripId]) {
+            map.removeLayer(employeeMarkers[tripId]);
+            delete employeeMarkers[tripId];
+        }
+        if (tripLines[tripId]) {
+            map.removeLayer(tripLines[tripId]);
+            delete tripLines[tripId];
+        }
     }
 
-    if (typeof pendingTrips !== 'undefined') {
-        pendingTrips.forEach(trip => {
+    // A trip row {id, status, employee_id, start_lat, start_lon, cab_id}: requested trips are
+    // listed and marked, in-progress ones get a line to their cab, finished ones go away
+    function applyTrip(trip) {
+        removeTrip(trip.id);
+        if (trip.status === 'requested') {
             addPendingTripToList(trip);
             employeeMarkers[trip.id] = L.marker([trip.start_lat, trip.start_lon], { icon: icons.employee })
                 .addTo(map)
                 .bindPopup(`<b>Trip ID:</b> ${trip.id}<br><b>Employee ID:</b> ${trip.employee_id}`);
+        } else if (trip.status === 'in_progress' && cabMarkers[trip.cab_id]) {
+            tripLines[trip.id] = L.polyline([[trip.start_lat, trip.start_lon], cabMarkers[trip.cab_id].getLatLng()], { color: 'blue' }).addTo(map);
+            tripLines[trip.id].cab_id = trip.cab_id;
+        }
+    }
+
+    function clearState() {
+        Object.keys(cabMarkers).forEach(cabId => {
+            map.removeLayer(cabMarkers[cabId]);
+            delete cabMarkers[cabId];
         });
+        Object.keys(employeeMarkers).forEach(removeTrip);
+        Object.keys(tripLines).forEach(removeTrip);
+        pendingTripsList.innerHTML = '';
+    }
+
+    // The page is only a shell: the state comes from /admin/state, as a snapshot the first
+    // time and then, on every reconnect, as the changes since the last version we applied
+    let stateVersion = null;
+
+    async function loadState() {
+        const url = stateVersion === null ? '/admin/state' : `/admin/state?since=${stateVersion}`;
+        try {
+            const response = await fetch(url, { credentials: 'include' });
+            if (!response.ok) {
+                console.error('Could not load the dashboard state:', response.status);
+                return;
+            }
+            const state = await response.json();
+            if (state.snapshot) {
+                clearState();
+            }
+            state.cabs.forEach(([cab_id, lat, lon, status]) => applyCabUpdate(cab_id, lat, lon, status));
+            state.trips.forEach(applyTrip);
+            stateVersion = state.version;
+        } catch (error) {
+            console.error('Could not load the dashboard state:', error);
+        }
     }
 
     // WebSocket for Real-Time Updates
@@ -126,10 +172,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
     socket.on('connect', () => {
         console.log('Connected to WebSocket server!');
         socket.emit('join_admin_room');
+        loadState();
     });
 
-    socket.on('location_update', (data) => {
-        const { cab_id, lat, lon, status } = data;
+    function applyCabUpdate(cab_id, lat, lon, status) {
         const icon = status === 'available' ? icons.available : icons.on_trip;
         if (cabMarkers[cab_id]) {
             cabMarkers[cab_id].setLatLng([lat, lon]).setIcon(icon);
@@ -147,14 +193,16 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 tripLines[tripId].setLatLngs(newLatLngs);
             }
         }
+    }
+
+    // One frame per tick with the latest [cab_id, lat, lon, status] of every cab that changed
+    socket.on('location_batch', (data) => {
+        data.cabs.forEach(([cab_id, lat, lon, status]) => applyCabUpdate(cab_id, lat, lon, status));
     });
 
     socket.on('new_trip_request', (data) => {
         console.log('New trip request received:', data);
-        addPendingTripToList(data);
-        employeeMarkers[data.trip_id] = L.marker([data.employee_lat, data.employee_lon], { icon: icons.employee })
-            .addTo(map)
-            .bindPopup(`<b>Trip ID:</b> ${data.trip_id}<br><b>Employee ID:</b> ${data.employee_id}`);
+        applyTrip(data);
     });
 
     socket.on('trip_allocated', (data) => {
@@ -184,6 +232,12 @@ document.addEventListener('DOMContentLoaded', (event) => {
         tripLines[trip_id].cab_id = cab_id;
     });
 
+    // A requested trip no cab could be found for: it leaves the pending list
+    socket.on('trip_cancelled', (data) => {
+        console.log('Trip cancelled event received:', data);
+        removeTrip(data.trip_id);
+    });
+
     socket.on('trip_finished', (data) => {
         console.log('Trip finished event received:', data);
         const { trip_id } = data;
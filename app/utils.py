@@ -1,100 +1,496 @@
-import osmnx as ox
-import networkx as nx
-from .extensions import cache
-from .models import Cab
-from math import radians, cos, sin, asin, sqrt
+import threading
+import numpy as np
+from .extensions import db
+from .fleet import fleet
+from .models import Cab, Trip
+from .road_graph import RoadGraph
+from .route_cache import route_cache
+from .instrumentation import phase
+from . import metrics
+from .geo import haversine_distances
+from heapq import heappush, heappop
+import time
 
 # This file addresses the "Cost Estimation - Time and Space"
 # using Dijkstra's, which is efficient for finding the shortest path.
 # Time Complexity: O((E + V) log V) where V is vertices (intersections) and E is edges (roads).
 # Space Complexity: O(V + E) to store the graph in memory.
 
-GRAPH_FILE_PATH = "jodhpur.graphml"
+# Compiled by generate_graph.py (see road_graph.py for the format)
+GRAPH_FILE_PATH = "jodhpur.graph"
 
-# This uses the "Caching" to avoid reloading the large graph file from disk on every request.
-@cache.memoize(timeout=3600) # Cache for 1 hour
+SEARCH_RADIUS_KM = 5.0
+
+# How many times an allocation moves on to the next-best cab when the chosen one was
+# taken by a concurrent allocation (another worker, process or admin) in the meantime
+MAX_ALLOCATION_ATTEMPTS = 5
+
+allocation_conflicts_total = metrics.counter(
+    'allocation_conflicts_total', 'Cabs found already taken when claiming them for a trip'
+)
+
+# How often (seconds) load_road_network checks whether the graph files changed on disk
+GRAPH_RELOAD_CHECK_INTERVAL = 5.0
+
+_road_network = None
+_last_graph_check = 0.0
+_load_lock = threading.Lock() # the warm-up task and a request may both want the graph first
+_warmup = {'status': 'pending', 'seconds': None} # see warm_up_road_network
+
+# The compiled graph is memory-mapped once per process. The OS page cache shares the
+# pages between all workers, so there is nothing to pickle or copy per request.
 def load_road_network():
+    with _load_lock:
+        return _load_road_network()
+
+def _load_road_network():
+    global _road_network, _last_graph_check
+
+    now = time.monotonic()
+    if _road_network is not None and _road_network.signature is not None \
+            and now - _last_graph_check > GRAPH_RELOAD_CHECK_INTERVAL:
+        _last_graph_check = now
+        signature = RoadGraph.file_signature(GRAPH_FILE_PATH)
+        # A regenerated graph is picked up once its manifest is in place (see RoadGraph.save;
+        # the route cache resets itself for the new graph object); a graph that vanished
+        # from disk keeps being served.
+        if signature is not None and signature != _road_network.signature:
+            print(f"Graph file {GRAPH_FILE_PATH} changed, reloading it.")
+            _road_network = None
+
+    if _road_network is None:
+        try:
+            _road_network = RoadGraph.load(GRAPH_FILE_PATH)
+            _road_network.build_spatial_index()
+            _last_graph_check = now
+        except FileNotFoundError:
+            # This is a fallback and should not happen if generate_graph.py is run first.
+            print(f"Graph file not found at {GRAPH_FILE_PATH}. Please run generate_graph.py first.")
+            return None
+    return _road_network
+
+def warm_up_road_network():
+    """
+    Load the road graph, build its spatial index and import the solvers, so that the first
+    trip request doesn't pay for it. create_app() starts this as a background task, which
+    under eventlet runs once the server is listening; requests that need the graph before
+    it is done simply load it themselves.
+    """
+    started = time.perf_counter()
+    _warmup['status'] = 'loading'
     try:
-        graph = ox.load_graphml(GRAPH_FILE_PATH)
-        return graph
-    except FileNotFoundError:
-        # This is a fallback and should not happen if generate_graph.py is run first.
-        print(f"Graph file not found at {GRAPH_FILE_PATH}. Please run generate_graph.py first.")
-        return None
+        graph = load_road_network()
+        from scipy.optimize import linear_sum_assignment # batch allocation
+    except Exception:
+        _warmup['status'] = 'failed'
+        raise
+    _warmup['status'] = 'ready' if graph is not None else 'missing'
+    _warmup['seconds'] = round(time.perf_counter() - started, 3)
+
+def routing_status():
+    """
+    {'ready': bool, 'warmup': 'pending' | 'loading' | 'ready' | 'missing' | 'failed', 'seconds': ...,
+    'graph': content hash, 'weight': routing weight}. Ready means the graph is in memory with
+    its spatial index, however it got there.
+    """
+    graph = _road_network
+    return {
+        'ready': graph is not None and graph.has_spatial_index,
+        'graph': graph.content_hash if graph is not None else None,
+        'weight': graph.weight_name if graph is not None else None,
+        'warmup': _warmup['status'],
+        'seconds': _warmup['seconds']
+    }
 
 def find_shortest_path_distance(graph, start_coords, end_coords):
     if not graph:
         return float('inf')
 
-    try:
-        # Find the nearest network nodes to the given coordinates
-        # The correct usage is X=longitude, Y=latitude
-        start_node = ox.distance.nearest_nodes(graph, X=start_coords[1], Y=start_coords[0])
-        end_node = ox.distance.nearest_nodes(graph, X=end_coords[1], Y=end_coords[0])
-
-        # Calculate the shortest path length using Dijkstra's algorithm
-        distance_meters = nx.shortest_path_length(graph, source=start_node, target=end_node, weight='length')
-        return distance_meters
-    except (nx.NetworkXNoPath, nx.NodeNotFound):
-        # Handle cases where no path exists or nodes are not found
-        return float('inf')
+    # Find the nearest network nodes to the given (lat, lon) coordinates
+    start_node, end_node = graph.snap([start_coords[0], end_coords[0]], [start_coords[1], end_coords[1]])
+
+    # No path between the nodes means an infinite distance
+    return route_distance(graph, int(start_node), int(end_node))
+
+def _alt_heuristic(graph, targets):
+    # h(v) = min over targets t of the best landmark lower bound on d(v, t):
+    #   d(v, t) >= d(L, t) - d(L, v)   and   d(v, t) >= d(v, L) - d(t, L)
+    # A minimum of consistent bounds is consistent, so A* stays exact. The landmark
+    # distances are float32, whose rounding error is absolute (up to 2^-24 of the
+    # distance), so the largest possible error is taken off every bound to keep it below
+    # the true distance; on a city graph that is a few millimeters.
+    target_nodes = np.fromiter(targets, dtype=np.int64)
+    from_targets = np.asarray(graph.landmark_from[target_nodes], dtype=np.float64) # (T, K)
+    to_targets = np.asarray(graph.landmark_to[target_nodes], dtype=np.float64)
+    error = graph.landmark_error
+
+    def heuristic(v):
+        bounds = np.maximum(from_targets - graph.landmark_from[v], graph.landmark_to[v] - to_targets)
+        return max(0.0, float(bounds.max(axis=1).min()) - error)
 
-def haversine_distance(lat1, lon1, lat2, lon2):
+    return heuristic
+
+def _search(graph, source, targets, stop_at_first, use_landmarks=False):
+    # Dijkstra, or A* with the ALT heuristic when a routing index is available.
+    # Returns ({target: distance}, {node: predecessor}) for the settled part of the graph.
+    remaining = set(targets)
+    found = {}
+    pred = {source: None}
+    if not remaining or not 0 <= source < graph.num_nodes:
+        return found, pred
+
+    heuristic = None
+    if use_landmarks and graph.has_landmarks:
+        heuristic = _alt_heuristic(graph, remaining)
+
+    dist = {source: 0.0}
+    settled = set()
+    heap = [(heuristic(source) if heuristic else 0.0, source)]
+
+    while heap:
+        _, u = heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        d = dist[u]
+
+        if u in remaining:
+            found[u] = d
+            remaining.discard(u)
+            if stop_at_first or not remaining:
+                break
+
+        targets_of_u, lengths = graph.neighbors(u)
+        for v, w in zip(targets_of_u, lengths):
+            nd = d + w
+            if nd < dist.get(v, float('inf')):
+                dist[v] = nd
+                pred[v] = u
+                heappush(heap, (nd + heuristic(v) if heuristic else nd, v))
+
+    return found, pred
+
+def multi_target_dijkstra(graph, source, targets, stop_at_first=False):
     """
-    Calculate the great-circle distance in kilometers between two points 
-    on the earth (specified in decimal degrees).
+    Single-source Dijkstra that returns {node: route cost} for the reachable nodes in
+    `targets`. Instead of exploring the whole graph it stops as soon as every target is
+    settled, or as soon as the first (i.e. nearest) one is settled when stop_at_first=True.
+    The nearest-target search is goal-directed with the landmark index when there is one;
+    settling every target needs the full disc anyway, so that stays plain Dijkstra.
     """
-    # Earth's radius in kilometers
-    R = 6371.0
-
-    # Convert decimal degrees to radians
-    rlat1, rlon1, rlat2, rlon2 = map(radians, [lat1, lon1, lat2, lon2])
-
-    # Haversine formula
-    dlon = rlon2 - rlon1
-    dlat = rlat2 - rlat1
-    a = sin(dlat / 2)**2 + cos(rlat1) * cos(rlat2) * sin(dlon / 2)**2
-    c = 2 * asin(sqrt(a))
-    
-    distance = R * c
+    found, _ = _search(graph, source, targets, stop_at_first, use_landmarks=stop_at_first)
+    return found
+
+def _path_to(pred, target):
+    path = [target]
+    while pred[path[-1]] is not None:
+        path.append(pred[path[-1]])
+    return path[::-1]
+
+# Query API on top of the routing index (ALT), with plain Dijkstra as the fallback.
+# Every answer goes through the route cache, keyed by (source, target) node pair.
+# "Distances" are route costs in the graph's weight: meters, or seconds on a graph built
+# with --weight travel_time, in which case allocation ranks cabs by travel time.
+
+def route_distance(graph, source, target):
+    """Point-to-point road distance (see above) between two node indices (inf if unreachable)."""
+    cached = route_cache.get(graph, source, target)
+    if cached is not None:
+        return cached[0]
+
+    found, pred = _search(graph, source, [target], stop_at_first=True, use_landmarks=True)
+    distance = found.get(target, float('inf'))
+    # the path comes for free with the search, keep it for shortest_path()
+    route_cache.put(graph, source, target, distance, _path_to(pred, target) if target in found else None)
     return distance
 
+def route_distances(graph, source, targets):
+    """One-to-many road distances: {target: distance} for the reachable targets."""
+    targets = list(targets)
+    cached = route_cache.get_distances(graph, source, targets)
+    missing = [target for target in targets if target not in cached]
+
+    found = multi_target_dijkstra(graph, source, missing) if missing else {}
+    for target in missing:
+        route_cache.put(graph, source, target, found.get(target, float('inf')))
+
+    found.update(cached)
+    return {target: distance for target, distance in found.items() if distance != float('inf')}
+
+def nearest_by_route(graph, source, targets):
+    """(target, distance) of the target nearest to source by road, or (None, inf)."""
+    targets = list(targets)
+    cached = route_cache.get_distances(graph, source, targets)
+    if targets and len(cached) == len(targets):
+        target = min(targets, key=cached.get)
+        if cached[target] == float('inf'):
+            return None, float('inf')
+        return target, cached[target]
+
+    found = multi_target_dijkstra(graph, source, targets, stop_at_first=True)
+    for target, distance in found.items():
+        route_cache.put(graph, source, target, distance)
+        return target, distance
+    return None, float('inf')
+
+def shortest_path(graph, source, target):
+    """Return the list of node indices from source to target, or None if unreachable."""
+    cached = route_cache.get(graph, source, target, need_path=True)
+    if cached is not None:
+        return cached[1]
+
+    found, pred = _search(graph, source, [target], stop_at_first=True, use_landmarks=True)
+    if target not in found:
+        route_cache.put(graph, source, target, float('inf'))
+        return None
+    path = _path_to(pred, target)
+    route_cache.put(graph, source, target, found[target], path)
+    return path
+
+def filter_within_radius(origin_lats, origin_lons, lats, lons, radius_km=SEARCH_RADIUS_KM, chunk_size=256):
+    """
+    Batch radius filter: for every origin, the positions (into lats/lons) of the points
+    within radius_km, sorted by straight-line distance. Returns a list with one
+    (indices, distances_km) pair of arrays per origin.
+    Origins are processed `chunk_size` rows at a time so the distance matrix stays small.
+    """
+    origin_lats = np.atleast_1d(np.asarray(origin_lats, dtype=np.float64))
+    origin_lons = np.atleast_1d(np.asarray(origin_lons, dtype=np.float64))
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    results = []
+    for start in range(0, len(origin_lats), chunk_size):
+        rows = slice(start, start + chunk_size)
+        distances = haversine_distances(origin_lats[rows, None], origin_lons[rows, None], lats, lons)
+        for row in distances:
+            inside = np.flatnonzero(row <= radius_km)
+            order = inside[np.argsort(row[inside], kind='stable')]
+            results.append((order, row[order]))
+    return results
+
 def allocate_cab_to_trip(trip):
-    all_available_cabs = Cab.query.filter_by(status='available').all()
-    if not all_available_cabs:
+    # Candidates come from the in-memory fleet store, not from a full table scan
+    fleet.ensure_loaded()
+    if not fleet.count('available'):
         return None, "No available cabs found anywhere"
-    
+
     trip_start_coords = (trip.start_lat, trip.start_lon)
-    nearby_cabs = []
-    SEARCH_RADIUS_KM = 5.0
 
-    for cab in all_available_cabs:
-        distance_as_crow_flies = haversine_distance(
-            trip_start_coords[0], trip_start_coords[1],
-            cab.current_lat, cab.current_lon
-        )
-        if distance_as_crow_flies <= SEARCH_RADIUS_KM:
-            nearby_cabs.append(cab)
+    # Grid lookup, then the exact straight-line filter over just those cabs
+    with phase('candidates'):
+        cab_ids, cab_lats, cab_lons = fleet.candidates_near(trip_start_coords[0], trip_start_coords[1], SEARCH_RADIUS_KM)
+    with phase('filter'):
+        (nearby, _), = filter_within_radius(trip_start_coords[0], trip_start_coords[1], cab_lats, cab_lons)
 
-    if not nearby_cabs:
+    if not len(nearby):
         return None, f"No available cabs found within a {SEARCH_RADIUS_KM} km radius"
 
     graph = load_road_network()
     if not graph:
         return None, "Road network not available"
-    
-    best_cab = None
-    min_distance = float('inf')
-
-    for cab in nearby_cabs: 
-        cab_coords = (cab.current_lat, cab.current_lon)
-        distance = find_shortest_path_distance(graph, trip_start_coords, cab_coords)
-        
-        if distance < min_distance:
-            min_distance = distance
-            best_cab = cab
-
-    if not best_cab:
+
+    # One bounded search from the trip start instead of one full search per nearby cab.
+    # The first cab node it settles is the nearest one by road, so the search stops there.
+    with phase('snap'):
+        start_node = int(graph.snap(trip_start_coords[0], trip_start_coords[1])[0])
+        cab_nodes = graph.snap(cab_lats[nearby], cab_lons[nearby])
+    cabs_by_node = {}
+    for cab_id, node in zip(cab_ids[nearby].tolist(), cab_nodes.tolist()):
+        cabs_by_node.setdefault(node, []).append(cab_id)
+
+    with phase('routing'):
+        nearest_node, _ = nearest_by_route(graph, start_node, cabs_by_node.keys())
+
+    if nearest_node is None:
         return None, "Could not find a suitable cab with a viable route"
 
-    return best_cab, "Cab allocated successfully"
\ No newline at end of file
+    with phase('load'):
+        best_cab = db.session.get(Cab, cabs_by_node[nearest_node][0])
+    if best_cab is None:
+        # The cab was deleted behind the store's back; forget it and try again
+        fleet.discard(cabs_by_node[nearest_node][0])
+        return allocate_cab_to_trip(trip)
+
+    return best_cab, "Cab allocated successfully"
+
+
+# Claiming. The fleet store (and any ORM object read earlier) can be stale when several
+# workers or processes allocate at once, so cabs are only taken with a conditional UPDATE
+# that checks the status in the same statement: of two concurrent claims on one cab, the
+# second one updates no row and moves on to another cab. Trips change state the same way,
+# so a trip allocated by an admin while it was queued is not allocated (or cancelled)
+# twice. Each function is one statement for any number of rows, and RETURNING tells which
+# rows were actually changed. None of them commit; the claims land in the caller's
+# transaction.
+
+_cab_table = Cab.__table__
+_trip_table = Trip.__table__
+
+def claim_cabs(pickups):
+    """Take the cabs of {cab_id: (pickup_lat, pickup_lon)} that are still available. Returns the ids taken."""
+    if not pickups:
+        return set()
+    ids = list(pickups)
+    return set(db.session.execute(
+        db.update(_cab_table)
+        .where(_cab_table.c.id.in_(ids), _cab_table.c.status == 'available')
+        .values(
+            status='on_trip',
+            destination_latitude=db.case({cab_id: lat for cab_id, (lat, _) in pickups.items()}, value=_cab_table.c.id),
+            destination_longitude=db.case({cab_id: lon for cab_id, (_, lon) in pickups.items()}, value=_cab_table.c.id)
+        )
+        .returning(_cab_table.c.id)
+    ).scalars())
+
+def release_cabs(cab_ids):
+    """Undo claim_cabs of this transaction."""
+    if cab_ids:
+        db.session.execute(
+            db.update(_cab_table)
+            .where(_cab_table.c.id.in_(list(cab_ids)))
+            .values(status='available', destination_latitude=None, destination_longitude=None)
+        )
+
+def claim_trips(cabs_by_trip):
+    """Move the trips of {trip_id: cab_id} that are still 'requested' to 'in_progress'. Returns the ids moved."""
+    if not cabs_by_trip:
+        return set()
+    return set(db.session.execute(
+        db.update(_trip_table)
+        .where(_trip_table.c.id.in_(list(cabs_by_trip)), _trip_table.c.status == 'requested')
+        .values(status='in_progress', cab_id=db.case(cabs_by_trip, value=_trip_table.c.id))
+        .returning(_trip_table.c.id)
+    ).scalars())
+
+def cancel_trips(trip_ids):
+    """Cancel the trips that are still 'requested'. Returns the ids cancelled."""
+    if not trip_ids:
+        return set()
+    return set(db.session.execute(
+        db.update(_trip_table)
+        .where(_trip_table.c.id.in_(list(trip_ids)), _trip_table.c.status == 'requested')
+        .values(status='cancelled')
+        .returning(_trip_table.c.id)
+    ).scalars())
+
+def forget_taken_cabs(cab_ids):
+    # The fleet store missed allocations made elsewhere. Re-read every cab that is not
+    # available (the status column is indexed), so the next search skips all of them and
+    # not only the ones we collided with.
+    allocation_conflicts_total.inc(len(cab_ids))
+    statuses = dict(db.session.execute(
+        db.select(_cab_table.c.id, _cab_table.c.status)
+        .where(db.or_(_cab_table.c.status != 'available', _cab_table.c.id.in_(list(cab_ids))))
+    ).all())
+    for cab_id, status in statuses.items():
+        fleet.set_status(cab_id, status)
+    for cab_id in cab_ids:
+        if cab_id not in statuses:
+            fleet.discard(cab_id) # deleted behind the store's back
+
+def assign_cab_to_trip(trip):
+    """
+    Allocate the nearest available cab to a 'requested' trip and claim both, retrying
+    with the next-best cab when the chosen one was taken concurrently.
+    Returns (cab, message), cab is None if nothing could be allocated. Does not commit.
+    """
+    for _ in range(MAX_ALLOCATION_ATTEMPTS):
+        cab, message = allocate_cab_to_trip(trip)
+        if not cab:
+            return None, message
+        with phase('claim'):
+            claimed = claim_cabs({cab.id: (trip.start_lat, trip.start_lon)})
+        if claimed:
+            break
+        forget_taken_cabs([cab.id])
+    else:
+        return None, "Nearby cabs kept being taken by other allocations, please try again"
+
+    with phase('claim'):
+        trip_claimed = claim_trips({trip.id: cab.id})
+    if not trip_claimed:
+        release_cabs([cab.id])
+        return None, "Trip is no longer waiting for a cab"
+    return cab, message
+
+def allocate_cabs_to_trips(trips, exclude=()):
+    """
+    Batch version of allocate_cab_to_trip. Instead of giving each trip, in arrival order,
+    the cab nearest to it, all trips are matched at once so that the total road distance
+    is minimal (Hungarian algorithm over a trip x cab cost matrix).
+    Costs one bounded Dijkstra per trip, which stops once all its nearby cabs are settled.
+    `exclude` are cab ids not to match although the fleet store still has them available
+    (e.g. claimed by an earlier round of the same, uncommitted batch).
+    Returns ({trip.id: Cab}, {trip.id: reason}) for assigned and unassigned trips.
+    """
+    if not trips:
+        return {}, {}
+
+    fleet.ensure_loaded()
+    with phase('candidates'):
+        cab_ids, cab_lats, cab_lons = fleet.with_status('available')
+        if exclude:
+            keep = ~np.isin(cab_ids, list(exclude))
+            cab_ids, cab_lats, cab_lons = cab_ids[keep], cab_lats[keep], cab_lons[keep]
+    if not len(cab_ids):
+        return {}, {trip.id: "No available cabs found anywhere" for trip in trips}
+
+    graph = load_road_network()
+    if not graph:
+        return {}, {trip.id: "Road network not available" for trip in trips}
+
+    start_lats = np.array([trip.start_lat for trip in trips], dtype=np.float64)
+    start_lons = np.array([trip.start_lon for trip in trips], dtype=np.float64)
+    with phase('filter'):
+        nearby = filter_within_radius(start_lats, start_lons, cab_lats, cab_lons)
+
+    # Matrix columns are only the cabs that are near at least one of the trips
+    columns = np.unique(np.concatenate([candidates for candidates, _ in nearby]))
+    column_of = {cab: col for col, cab in enumerate(columns.tolist())}
+    with phase('snap'):
+        cab_nodes = graph.snap(cab_lats[columns], cab_lons[columns]).tolist()
+        trip_nodes = graph.snap(start_lats, start_lons).tolist()
+
+    failures = {}
+    cost = np.full((len(trips), len(columns)), np.inf)
+    with phase('routing'):
+        for row, (trip, (candidates, _)) in enumerate(zip(trips, nearby)):
+            if not len(candidates):
+                failures[trip.id] = f"No available cabs found within a {SEARCH_RADIUS_KM} km radius"
+                continue
+            cols = [column_of[cab] for cab in candidates.tolist()]
+            distances = route_distances(graph, trip_nodes[row], {cab_nodes[col] for col in cols})
+            for col in cols:
+                cost[row, col] = distances.get(cab_nodes[col], np.inf)
+
+    assignments = {}
+    feasible = np.isfinite(cost)
+    if feasible.any():
+        # A pair without a route costs more than every real pair put together, so the
+        # solver first maximizes the number of served trips and then minimizes distance.
+        unreachable_cost = cost[feasible].sum() + 1.0
+        from scipy.optimize import linear_sum_assignment # imported by warm_up_road_network
+        with phase('matching'):
+            rows, cols = linear_sum_assignment(np.where(feasible, cost, unreachable_cost))
+        chosen = {
+            trips[row].id: int(cab_ids[columns[col]])
+            for row, col in zip(rows.tolist(), cols.tolist()) if feasible[row, col]
+        }
+        with phase('load'):
+            cabs = {cab.id: cab for cab in Cab.query.filter(Cab.id.in_(chosen.values())).all()}
+        for trip_id, cab_id in chosen.items():
+            if cab_id in cabs:
+                assignments[trip_id] = cabs[cab_id]
+            else:
+                fleet.discard(cab_id) # deleted behind the store's back
+
+    for row, trip in enumerate(trips):
+        if trip.id in assignments or trip.id in failures:
+            continue
+        if feasible[row].any():
+            failures[trip.id] = "All nearby cabs were allocated to other trips"
+        else:
+            failures[trip.id] = "Could not find a suitable cab with a viable route"
+
+    return assignments, failures
@@ -0,0 +1,161 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Benchmark runner: `python -m benchmarks` from the repo root.
+#
+# Benchmarks follow the asv conventions: classes in benchmarks/bench_*.py with optional
+# `params` / `param_names`, `setup(*params)` / `teardown(*params)`, `time_*` methods that
+# are timed and `track_*` methods whose return value is recorded. A setup() raising
+# NotImplementedError skips that parameter combination. A benchmark that raises
+# (e.g. a track_ method asserting a budget) is reported as failed and makes the run exit
+# non-zero. Results are written to benchmarks/results/<commit>.json; commit them (or keep
+# them around) and pass an older file to --compare to see what got slower.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+MIN_SAMPLE_SECONDS = 0.05
+REGRESSION_RATIO = 1.2 # flag benchmarks that got this much slower
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def discover():
+    """Yields (name, class) for every benchmark class, e.g. ('bench_routing.ShortestPathSuite', cls)."""
+    for filename in sorted(os.listdir(BENCHMARK_DIR)):
+        if not (filename.startswith('bench_') and filename.endswith('.py')):
+            continue
+        module = importlib.import_module(f"benchmarks.{filename[:-3]}")
+        for attr, value in vars(module).items():
+            if isinstance(value, type) and value.__module__ == module.__name__ and attr.endswith('Suite'):
+                yield f"{filename[:-3]}.{attr}", value
+
+def time_call(method, params, repeat):
+    """Seconds per call: median (and min) over `repeat` samples of at least MIN_SAMPLE_SECONDS."""
+    method(*params) # warm-up, also catches errors before timing
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            method(*params)
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SAMPLE_SECONDS or number >= 1 << 20:
+            break
+        number *= 2
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            method(*params)
+        samples.append((time.perf_counter() - started) / number)
+    return statistics.median(samples), min(samples)
+
+def run(pattern, repeat):
+    results = {}
+    failures = []
+    for suite_name, suite in discover():
+        param_sets = list(itertools.product(*suite.params)) if hasattr(suite, 'params') else [()]
+        methods = sorted(name for name in dir(suite) if name.startswith(('time_', 'track_')))
+        for params in param_sets:
+            wanted = [name for name in methods if pattern in f"{suite_name}.{name}"]
+            if not wanted:
+                continue
+            instance = suite()
+            if hasattr(instance, 'setup'):
+                try:
+                    instance.setup(*params)
+                except NotImplementedError as e:
+                    # asv convention: setup raising NotImplementedError skips the benchmark
+                    print(f"{suite_name}({', '.join(map(str, params))}) skipped: {e}")
+                    continue
+            try:
+                for name in wanted:
+                    key = f"{suite_name}.{name}({', '.join(map(str, params))})"
+                    method = getattr(instance, name)
+                    try:
+                        if name.startswith('time_'):
+                            median, best = time_call(method, params, repeat)
+                            results[key] = {'seconds': median, 'min_seconds': best}
+                            print(f"{key:<80} {format_seconds(median):>10}")
+                        else:
+                            value = method(*params)
+                            results[key] = {'value': value}
+                            print(f"{key:<80} {value:>10}")
+                    except Exception as e:
+                        failures.append((key, e))
+                        print(f"{key:<80} {'FAILED':>10}\n    {e}")
+            finally:
+                if hasattr(instance, 'teardown'):
+                    instance.teardown(*params)
+    return results, failures
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nCompared to {baseline['commit']} ({baseline_path}):")
+    for key, result in results.items():
+        before = baseline['results'].get(key)
+        if not before:
+            continue
+        if 'value' in result:
+            if result['value'] != before.get('value'):
+                print(f"{key:<80} {before.get('value')!s:>10} -> {result['value']!s:>10}")
+            continue
+        ratio = result['seconds'] / before['seconds']
+        flag = ' SLOWER' if ratio >= REGRESSION_RATIO else ' faster' if ratio <= 1 / REGRESSION_RATIO else ''
+        print(f"{key:<80} {format_seconds(before['seconds']):>10} -> {format_seconds(result['seconds']):>10}  x{ratio:.2f}{flag}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Run the benchmark suite.")
+    parser.add_argument('-b', '--bench', default='', help="only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="timing samples per benchmark")
+    parser.add_argument('--compare', default=None, help="results file of an earlier run to compare with")
+    parser.add_argument('--no-save', action='store_true', help="don't write a results file")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    commit = git_commit()
+    results, failures = run(args.bench, args.repeat)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{commit}.json")
+        with open(path, 'w') as results_file:
+            json.dump({
+                'commit': commit,
+                'date': datetime.now(timezone.utc).isoformat(),
+                'python': sys.version.split()[0],
+                'machine': platform.machine(),
+                'results': results
+            }, results_file, indent=2, sort_keys=True)
+        print(f"\nResults saved to {path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if failures:
+        print(f"\n{len(failures)} benchmark(s) failed:")
+        for key, error in failures:
+            print(f"  {key}: {str(error).splitlines()[0]}")
+        sys.exit(1)
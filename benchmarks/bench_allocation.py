@@ -0,0 +1,43 @@
+from itertools import cycle
+from app.extensions import db
+from app.fleet import fleet
+from app.models import Trip
+from app.route_cache import route_cache
+from app.utils import allocate_cab_to_trip, allocate_cabs_to_trips
+from .common import FLEET_SIZES, grid_graph, make_app, random_points
+
+BATCH_SIZE = 16
+
+class AllocationSuite:
+    params = [FLEET_SIZES]
+    param_names = ['cabs']
+
+    def setup(self, cabs):
+        graph = grid_graph()
+        self.app = make_app(graph, cabs)
+        self.context = self.app.app_context()
+        self.context.push()
+        fleet.ensure_loaded()
+
+        # Transient trips: allocation only reads them, nothing is committed
+        lats, lons = random_points(graph, 256, seed=1)
+        self.trips = [
+            Trip(id=i, employee_id=1, start_lat=lat, start_lon=lon, status='requested')
+            for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist()))
+        ]
+        self.next_trip = cycle(self.trips).__next__
+
+    def teardown(self, cabs):
+        db.session.remove()
+        self.context.pop()
+
+    def time_allocate_cab_to_trip(self, cabs):
+        # Cabs move all the time, so measure the search rather than cache hits
+        route_cache.clear()
+        allocate_cab_to_trip(self.next_trip())
+        db.session.expunge_all()
+
+    def time_allocate_cabs_to_trips(self, cabs):
+        route_cache.clear()
+        allocate_cabs_to_trips([self.next_trip() for _ in range(BATCH_SIZE)])
+        db.session.expunge_all()
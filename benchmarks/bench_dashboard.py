@@ -0,0 +1,45 @@
+import numpy as np
+from flask_jwt_extended import create_access_token
+from app.extensions import socketio
+from app.fleet import fleet
+from .common import FLEET_SIZES, add_requested_trips, add_user, grid_graph, make_app, random_points
+
+PENDING_TRIPS = 50
+MOVED_CABS = 100 # cabs that move between a client's two state fetches
+
+class DashboardSuite:
+    params = [FLEET_SIZES]
+    param_names = ['cabs']
+
+    def setup(self, cabs):
+        graph = grid_graph()
+        self.app = make_app(graph, cabs)
+        _, admin_public_id = add_user(self.app, 'admin@example.com', role='admin')
+        employee_id, _ = add_user(self.app, 'employee@example.com')
+        add_requested_trips(self.app, employee_id, PENDING_TRIPS)
+
+        with self.app.app_context():
+            token = create_access_token(identity=admin_public_id)
+            fleet.ensure_loaded()
+        self.client = self.app.test_client()
+        self.client.set_cookie('access_token_cookie', token)
+
+        # A client that fetched the snapshot, then some cabs moved
+        self.version = self.client.get('/admin/state').json['version']
+        handle_location_update = socketio.server.handlers['/']['update_location'].__wrapped__
+        lats, lons = random_points(graph, min(MOVED_CABS, cabs), seed=1)
+        for cab_id, lat, lon in zip(np.arange(1, len(lats) + 1).tolist(), lats.tolist(), lons.tolist()):
+            handle_location_update({'cab_id': cab_id, 'lat': lat, 'lon': lon})
+
+    def time_dashboard_view(self, cabs):
+        response = self.client.get('/admin/dashboard')
+        assert response.status_code == 200
+
+    def time_state_snapshot(self, cabs):
+        response = self.client.get('/admin/state')
+        assert response.status_code == 200
+
+    def time_state_delta(self, cabs):
+        # a reconnecting client: only the cabs that moved since its version
+        response = self.client.get(f'/admin/state?since={self.version}')
+        assert response.status_code == 200 and not response.json['snapshot']
@@ -0,0 +1,260 @@
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+from app import database
+from app.extensions import db
+from app.models import Cab, Trip, User
+from .common import BenchmarkConfig, CENTER_LAT, CENTER_LON, grid_graph, random_points, use_graph
+
+# Location ingest, allocation and dashboard reads hitting the database at the same time,
+# from threads, on a real database file (the other suites use an in-memory one, which
+# has no journal and no locking). The app's own code paths run in a fresh process with
+# its own app: location_buffer.flush() for the ingest, allocation_queue.allocate_trip()
+# for the allocations. For 'sqlite-wal' neither may fail with "database is locked",
+# allocations must complete while location flushes are in flight, and readers must not
+# stall; 'sqlite-rollback' is the old default journal for comparison. 'postgresql' runs
+# against BENCH_POSTGRES_URL and is skipped without it.
+#
+# ConcurrentAllocationSuite has several processes, each with its own app and its own
+# (soon stale) fleet store, allocate trips from the same database at once. No cab may end
+# up on two trips: losers of a race on a cab must move on to another one.
+
+CABS = 2000
+FLUSHES = 20 # location flushes, each an executemany UPDATE of every cab
+FLUSH_PAUSE = 0.1 # seconds between flushes, a sped-up LOCATION_FLUSH_INTERVAL
+ALLOCATIONS = 100 # per allocation thread
+ALLOCATION_THREADS = 2
+READER_THREADS = 2
+READ_P99_BUDGET = 0.25 # seconds, 99th percentile dashboard read allowed with WAL
+RACE_CABS = 300
+RACE_TRIPS = 240 # all within a couple of km, so the processes keep wanting the same cabs
+
+def config_for(backend, directory):
+    config = {key: getattr(BenchmarkConfig, key) for key in dir(BenchmarkConfig) if key.isupper()}
+    if backend == 'postgresql':
+        config['SQLALCHEMY_DATABASE_URI'] = os.environ['BENCH_POSTGRES_URL']
+    else:
+        config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        config['SQLITE_WAL'] = backend == 'sqlite-wal'
+    return config
+
+def _mixed_workload_in_process(config):
+    # Runs in a fresh process (spawn): an app of its own on the benchmark database
+    from app import create_app
+    from app.allocation_queue import allocate_trip
+    from app.location_buffer import location_buffer
+    use_graph(grid_graph())
+    app = create_app(type('MixedConfig', (BenchmarkConfig,), dict(config, MONITORING_DASHBOARD=False)))
+    with app.app_context():
+        cabs = db.session.execute(db.select(Cab.id, Cab.current_lat, Cab.current_lon).order_by(Cab.id)).all()
+        trip_ids = db.session.execute(db.select(Trip.id).where(Trip.status == 'requested').order_by(Trip.id)).scalars().all()
+
+    errors, latencies, flushes, allocations = [], [], [], []
+
+    def ingest():
+        for flush in range(FLUSHES):
+            for cab_id, lat, lon in cabs:
+                location_buffer.add(cab_id, lat + flush * 1e-5, lon)
+            started = time.perf_counter()
+            try:
+                location_buffer.flush()
+            except OperationalError as e:
+                errors.append(('ingest', str(e.orig)))
+                continue
+            flushes.append((started, time.perf_counter()))
+            time.sleep(FLUSH_PAUSE)
+
+    def allocate(trip_ids):
+        for trip_id in trip_ids:
+            started = time.perf_counter()
+            with app.app_context():
+                try:
+                    data, _ = allocate_trip(db.session.get(Trip, trip_id))
+                except OperationalError as e:
+                    db.session.rollback()
+                    errors.append(('allocate', str(e.orig)))
+                    continue
+            allocations.append((started, time.perf_counter(), data is not None))
+
+    def read(stop):
+        while not stop.is_set():
+            started = time.perf_counter()
+            with app.app_context():
+                try:
+                    db.session.execute(db.select(Cab.id, Cab.current_lat, Cab.current_lon).where(Cab.status == 'on_trip')).all()
+                except OperationalError as e:
+                    errors.append(('read', str(e.orig)))
+                    continue
+            latencies.append(time.perf_counter() - started)
+
+    stop = threading.Event()
+    writers = [threading.Thread(target=ingest)]
+    writers += [threading.Thread(target=allocate, args=(trip_ids[i::ALLOCATION_THREADS],)) for i in range(ALLOCATION_THREADS)]
+    readers = [threading.Thread(target=read, args=(stop,)) for _ in range(READER_THREADS)]
+    started = time.perf_counter()
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in readers:
+        thread.join()
+    return {'seconds': elapsed, 'errors': errors, 'latencies': latencies or [0.0], 'flushes': flushes, 'allocations': allocations}
+
+class ConcurrentAccessSuite:
+    params = [['sqlite-rollback', 'sqlite-wal', 'postgresql']]
+    param_names = ['backend']
+    timeout = 300
+
+    def setup(self, backend):
+        if backend == 'postgresql' and not os.environ.get('BENCH_POSTGRES_URL'):
+            raise NotImplementedError("set BENCH_POSTGRES_URL to run against PostgreSQL")
+
+        self.directory = tempfile.mkdtemp()
+        config = config_for(backend, self.directory)
+        self.engine = database.create_engine(config)
+        db.metadata.drop_all(self.engine)
+        db.metadata.create_all(self.engine)
+
+        graph = grid_graph()
+        lats, lons = random_points(graph, CABS)
+        trip_lats, trip_lons = random_points(graph, ALLOCATIONS * ALLOCATION_THREADS, seed=4)
+        with self.engine.begin() as conn:
+            conn.execute(db.insert(User), [{'email': 'bench@example.com', 'password_hash': '-', 'public_id': 'bench'}])
+            conn.execute(db.insert(Cab), [
+                {'driver_name': f'driver{i}', 'license_plate': f'BENCH{i}', 'current_lat': lat, 'current_lon': lon, 'status': 'available'}
+                for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist()))
+            ])
+            conn.execute(db.insert(Trip), [
+                {'employee_id': 1, 'start_lat': lat, 'start_lon': lon, 'status': 'requested'}
+                for lat, lon in zip(trip_lats.tolist(), trip_lons.tolist())
+            ])
+
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            self.outcome = pool.apply(_mixed_workload_in_process, (config,))
+
+    def teardown(self, backend):
+        self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def track_workload_ms(self, backend):
+        return round(self.outcome['seconds'] * 1000)
+
+    def track_locked_errors(self, backend):
+        errors = self.outcome['errors']
+        assert not errors or backend == 'sqlite-rollback', f"{len(errors)} operations failed: {sorted(set(errors))[:5]}"
+        return len(errors)
+
+    def track_flushes_completed(self, backend):
+        completed = len(self.outcome['flushes'])
+        assert completed == FLUSHES or backend == 'sqlite-rollback', f"{completed} of {FLUSHES} location flushes completed"
+        return completed
+
+    def track_allocations_completed(self, backend):
+        completed = sum(allocated for _, _, allocated in self.outcome['allocations'])
+        assert completed == ALLOCATIONS * ALLOCATION_THREADS or backend == 'sqlite-rollback', (
+            f"{completed} of {ALLOCATIONS * ALLOCATION_THREADS} trips allocated"
+        )
+        return completed
+
+    def track_allocations_during_flushes(self, backend):
+        # allocations that were running while a location flush was: ingest and allocation
+        # proceed side by side instead of one waiting for the other to finish
+        flushes = self.outcome['flushes']
+        overlapping = sum(
+            any(start < flush_end and flush_start < end for flush_start, flush_end in flushes)
+            for start, end, allocated in self.outcome['allocations'] if allocated
+        )
+        assert overlapping or backend == 'sqlite-rollback', "no allocation completed while location flushes were in flight"
+        return overlapping
+
+    def track_read_latency_p99_ms(self, backend):
+        latencies = sorted(self.outcome['latencies'])
+        p99 = latencies[int(len(latencies) * 0.99)]
+        assert p99 <= READ_P99_BUDGET or backend == 'sqlite-rollback', f"99th percentile read took {p99:.3f}s"
+        return round(p99 * 1000, 1)
+
+    def track_read_latency_median_ms(self, backend):
+        return round(statistics.median(self.outcome['latencies']) * 1000, 2)
+
+def _allocate_in_process(uri, trip_ids):
+    # Runs in a fresh process (spawn): its own app, fleet store and connection pool
+    from app import create_app
+    from app.allocation_queue import allocate_trip
+    from app.utils import allocation_conflicts_total
+    use_graph(grid_graph())
+    app = create_app(type('RaceConfig', (BenchmarkConfig,), {'SQLALCHEMY_DATABASE_URI': uri}))
+    allocated = 0
+    with app.app_context():
+        started = time.perf_counter()
+        for trip_id in trip_ids:
+            data, _ = allocate_trip(db.session.get(Trip, trip_id))
+            allocated += data is not None
+            db.session.remove()
+    return allocated, allocation_conflicts_total.value, time.perf_counter() - started
+
+class ConcurrentAllocationSuite:
+    params = [[1, 4]]
+    param_names = ['processes']
+    timeout = 300
+
+    def setup(self, processes):
+        self.directory = tempfile.mkdtemp()
+        config = config_for('sqlite-wal', self.directory)
+        self.uri = config['SQLALCHEMY_DATABASE_URI']
+        self.engine = database.create_engine(config)
+        db.metadata.create_all(self.engine)
+
+        graph = grid_graph()
+        cab_lats, cab_lons = random_points(graph, RACE_CABS, seed=2)
+        rng = random_points(graph, RACE_TRIPS, seed=3)
+        # squeeze the pickups towards the centre
+        trip_lats = CENTER_LAT + (rng[0] - CENTER_LAT) * 0.3
+        trip_lons = CENTER_LON + (rng[1] - CENTER_LON) * 0.3
+        with self.engine.begin() as conn:
+            conn.execute(db.insert(User), [{'email': 'bench@example.com', 'password_hash': '-', 'public_id': 'bench'}])
+            conn.execute(db.insert(Cab), [
+                {'driver_name': f'driver{i}', 'license_plate': f'RACE{i}', 'current_lat': lat, 'current_lon': lon, 'status': 'available'}
+                for i, (lat, lon) in enumerate(zip(cab_lats.tolist(), cab_lons.tolist()))
+            ])
+            conn.execute(db.insert(Trip), [
+                {'employee_id': 1, 'start_lat': lat, 'start_lon': lon, 'status': 'requested'}
+                for lat, lon in zip(trip_lats.tolist(), trip_lons.tolist())
+            ])
+
+        trip_ids = list(range(1, RACE_TRIPS + 1))
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            outcomes = pool.starmap(_allocate_in_process, [(self.uri, trip_ids[i::processes]) for i in range(processes)])
+        self.allocated = sum(allocated for allocated, _, _ in outcomes)
+        self.conflicts = sum(conflicts for _, conflicts, _ in outcomes)
+        self.seconds = max(seconds for _, _, seconds in outcomes) # allocation only, not process start-up
+
+    def teardown(self, processes):
+        self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def track_double_allocations(self, processes):
+        with self.engine.connect() as conn:
+            doubles = conn.execute(
+                db.select(Trip.cab_id).where(Trip.status == 'in_progress')
+                .group_by(Trip.cab_id).having(db.func.count() > 1)
+            ).scalars().all()
+            on_trip = conn.execute(db.select(db.func.count()).select_from(Cab).where(Cab.status == 'on_trip')).scalar()
+        assert not doubles, f"cabs allocated to more than one trip: {doubles}"
+        assert on_trip == self.allocated, f"{on_trip} cabs on trips, but {self.allocated} trips allocated"
+        return len(doubles)
+
+    def track_allocated_trips(self, processes):
+        return self.allocated
+
+    def track_allocation_conflicts(self, processes):
+        return self.conflicts
+
+    def track_allocations_per_second(self, processes):
+        return round(self.allocated / self.seconds, 1)
@@ -0,0 +1,22 @@
+from app.geo import haversine_distance, haversine_distances
+from app.utils import filter_within_radius
+from .common import FLEET_SIZES, CENTER_LAT, CENTER_LON, grid_graph, random_points
+
+class HaversineSuite:
+    params = [FLEET_SIZES]
+    param_names = ['cabs']
+
+    def setup(self, cabs):
+        self.lats, self.lons = random_points(grid_graph(), cabs)
+        self.points = list(zip(self.lats.tolist(), self.lons.tolist()))
+
+    def time_haversine_distance(self, cabs):
+        # the scalar function, once per cab
+        for lat, lon in self.points:
+            haversine_distance(CENTER_LAT, CENTER_LON, lat, lon)
+
+    def time_haversine_distances(self, cabs):
+        haversine_distances(CENTER_LAT, CENTER_LON, self.lats, self.lons)
+
+    def time_filter_within_radius(self, cabs):
+        filter_within_radius(CENTER_LAT, CENTER_LON, self.lats, self.lons)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from itertools import cycle
+import numpy as np
+from app.road_graph import RoadGraph
+from app.route_cache import route_cache
+from app.utils import nearest_by_route, route_distance
+from .common import street_grid_graph
+
+# The compiled graph as generate_graph.py can write it: by length or by travel time, raw
+# (every shape node of a street kept, like OSM ways) or with degree-2 chains contracted.
+# Contraction must not change any route cost between the nodes it keeps.
+
+QUERIES = 100
+CAB_NODES = 50
+
+class GraphPreprocessingSuite:
+    params = [['length', 'travel_time'], ['raw', 'contracted']]
+    param_names = ['weight', 'chains']
+
+    def setup(self, weight, chains):
+        self.raw = street_grid_graph(weight=weight)
+        graph = self.raw
+        if chains == 'contracted':
+            graph = graph.contract_chains()
+            graph.build_landmarks(8)
+        self.directory = tempfile.mkdtemp()
+        graph.save(self.directory)
+        self.graph = RoadGraph.load(self.directory)
+        self.graph.build_spatial_index()
+
+        # queries between intersections, which both versions have
+        raw_of = np.asarray(self.graph.node_ids)
+        rng = np.random.default_rng(0)
+        self.pairs = [tuple(pair) for pair in rng.integers(self.graph.num_nodes, size=(QUERIES, 2)).tolist()]
+        self.raw_pairs = [(int(raw_of[s]), int(raw_of[t])) for s, t in self.pairs]
+        self.cabs = rng.integers(self.graph.num_nodes, size=CAB_NODES).tolist()
+        self.next_query = cycle(range(QUERIES)).__next__
+
+    def teardown(self, weight, chains):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def time_load(self, weight, chains):
+        RoadGraph.load(self.directory).build_spatial_index()
+
+    def time_route_distance(self, weight, chains):
+        route_cache.clear()
+        source, target = self.pairs[self.next_query()]
+        route_distance(self.graph, source, target)
+
+    def time_nearest_cab(self, weight, chains):
+        # the allocation query: nearest of a set of cab nodes, by the graph's weight
+        route_cache.clear()
+        source, _ = self.pairs[self.next_query()]
+        nearest_by_route(self.graph, source, self.cabs)
+
+    def track_nodes(self, weight, chains):
+        return self.graph.num_nodes
+
+    def track_artifact_kb(self, weight, chains):
+        return round(sum(entry.stat().st_size for entry in os.scandir(self.directory)) / 1024)
+
+    def track_cost_mismatches(self, weight, chains):
+        mismatches = 0
+        for (source, target), (raw_source, raw_target) in zip(self.pairs, self.raw_pairs):
+            route_cache.clear()
+            cost = route_distance(self.graph, source, target)
+            route_cache.clear()
+            raw_cost = route_distance(self.raw, raw_source, raw_target)
+            mismatches += not np.isclose(cost, raw_cost, rtol=1e-5)
+        assert not mismatches, f"{mismatches} of {QUERIES} route costs differ from the raw graph"
+        return mismatches
+
+class GraphRegenerationSuite:
+    # generate_graph.py rerun while the server runs: workers keep the arrays they mapped,
+    # the reload check sees only complete builds and at most two builds stay on disk
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        street_grid_graph(rows=20, cols=20).save(self.directory)
+        self.mapped = RoadGraph.load(self.directory)
+        self.snapshot = {name: np.array(array) for name, array in self.mapped.arrays().items()}
+        self.builds = [street_grid_graph(rows=20, cols=20, weight='travel_time'), street_grid_graph(rows=25, cols=25)]
+
+    def teardown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def time_save(self):
+        self.builds[0].save(self.directory)
+
+    def track_mapped_arrays_changed(self):
+        for graph in self.builds:
+            graph.save(self.directory)
+        changed = sum(not np.array_equal(array, self.snapshot[name]) for name, array in self.mapped.arrays().items())
+        assert not changed, f"{changed} arrays of the running graph changed under it"
+        reloaded = RoadGraph.load(self.directory)
+        assert reloaded.content_hash == self.builds[-1].content_hash and RoadGraph.verify(self.directory)
+        assert reloaded.signature != self.mapped.signature
+        builds_on_disk = {entry.name.split('.')[1] for entry in os.scandir(self.directory) if entry.name.endswith('.npy')}
+        assert len(builds_on_disk) <= 2, f"{len(builds_on_disk)} builds left on disk"
+        return changed
@@ -0,0 +1,69 @@
+import numpy as np
+from app.extensions import db, socketio
+from app.fleet import fleet
+from app.location_buffer import location_buffer
+from .common import FLEET_SIZES, grid_graph, make_app, random_points
+
+class LocationUpdateSuite:
+    params = [FLEET_SIZES]
+    param_names = ['cabs']
+
+    def setup(self, cabs):
+        graph = grid_graph()
+        self.app = make_app(graph, cabs)
+        with self.app.app_context():
+            fleet.ensure_loaded()
+
+        # The socket handlers as registered by create_app, without the transport around them
+        handlers = socketio.server.handlers['/']
+        self.handle_location_update = handlers['update_location'].__wrapped__
+        self.handle_location_updates = handlers['update_locations'].__wrapped__
+
+        lats, lons = random_points(graph, cabs, seed=1)
+        ids = np.arange(1, cabs + 1).tolist()
+        self.pings = [
+            {'cab_id': cab_id, 'lat': lat, 'lon': lon}
+            for cab_id, lat, lon in zip(ids, lats.tolist(), lons.tolist())
+        ]
+        self.batch = {'cabs': [[cab_id, lat, lon] for cab_id, lat, lon in zip(ids, lats.tolist(), lons.tolist())]}
+
+    def teardown(self, cabs):
+        location_buffer.flush()
+
+    def time_handle_location_update(self, cabs):
+        # one 'update_location' ping from every cab of the fleet
+        for ping in self.pings:
+            self.handle_location_update(ping)
+
+    def time_handle_location_updates(self, cabs):
+        # the same pings as one batched 'update_locations' message
+        self.handle_location_updates(self.batch)
+
+    def track_client_status_ignored(self, cabs):
+        # a ping claiming 'available' must not free a cab the server has on a trip
+        ping = self.pings[0]
+        fleet.set_status(ping['cab_id'], 'on_trip')
+        with self.app.app_context():
+            self.handle_location_update(dict(ping, status='available'))
+            self.handle_location_updates({'cabs': [[ping['cab_id'], ping['lat'], ping['lon'], 'available']]})
+        status = fleet.update(ping['cab_id'], ping['lat'], ping['lon'])
+        fleet.set_status(ping['cab_id'], 'available')
+        assert status == 'on_trip', f"a location ping set the cab's status to {status!r}"
+        return int(status != 'on_trip')
+
+    def track_string_ids_duplicated(self, cabs):
+        # an id and coordinates sent as strings are the same cab, a garbled ping is dropped
+        ping = self.pings[0]
+        size = len(fleet)
+        with self.app.app_context():
+            self.handle_location_update({key: str(value) for key, value in ping.items()})
+            self.handle_location_updates({'cabs': [[str(ping['cab_id']), str(ping['lat']), str(ping['lon'])]]})
+            self.handle_location_update(dict(ping, lat='north'))
+        duplicates = len(fleet) - size
+        assert not duplicates, f"string ids added {duplicates} cab(s) to the fleet store"
+        return duplicates
+
+    def time_write_behind_flush(self, cabs):
+        for ping in self.pings:
+            location_buffer.add(ping['cab_id'], ping['lat'], ping['lon'])
+        location_buffer.flush()
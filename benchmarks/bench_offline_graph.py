@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from xml.etree import ElementTree
+from app.graph_pipeline import compile_graph, preprocess
+from app.osm_reader import graph_from_files, iter_elements, osm_files
+
+# generate_graph.py --offline: the road graph from the Overpass responses in cache/, or the
+# same data as an .osm extract. Reading streams the elements, so it must never hold the
+# whole file, and the build must be reproducible: same content hash from either format and
+# whatever the order of the input files.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_FILES = osm_files(sorted(glob.glob(os.path.join(ROOT, 'cache', '*.json'))))
+LANDMARKS = 8
+TILES = 50 # copies of the cached data in the file streamed for peak memory, a few MB
+APP_MODULES = ('flask', 'flask_sqlalchemy', 'flask_socketio', 'sqlalchemy', 'app.extensions', 'app.utils')
+IMPORTS = """
+import sys
+import app.graph_pipeline, app.osm_reader
+print(','.join(name for name in %r if name in sys.modules))
+"""
+
+def build(paths):
+    return compile_graph(preprocess(graph_from_files(paths)), num_landmarks=LANDMARKS)
+
+def tiled(elements, tiles):
+    """`tiles` copies of the elements under distinct ids, for an input of realistic size."""
+    for tile in range(tiles):
+        offset = tile * 10**10
+        for element in elements:
+            element = dict(element, id=element['id'] + offset)
+            if 'nodes' in element:
+                element['nodes'] = [node + offset for node in element['nodes']]
+            yield element
+
+def write_overpass_json(elements, path):
+    with open(path, 'w') as f:
+        json.dump({'version': 0.6, 'generator': 'benchmarks', 'elements': list(elements)}, f)
+
+def write_osm_xml(elements, path):
+    """An .osm extract with the nodes and ways of an Overpass response."""
+    root = ElementTree.Element('osm', version='0.6')
+    for element in elements:
+        if element['type'] == 'node':
+            ElementTree.SubElement(root, 'node', id=str(element['id']), lat=repr(element['lat']), lon=repr(element['lon']))
+        elif element['type'] == 'way':
+            way = ElementTree.SubElement(root, 'way', id=str(element['id']))
+            for node in element['nodes']:
+                ElementTree.SubElement(way, 'nd', ref=str(node))
+            for key, value in element.get('tags', {}).items():
+                ElementTree.SubElement(way, 'tag', k=key, v=value)
+    ElementTree.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+class OfflineBuildSuite:
+    params = [['overpass-json', 'osm-xml']]
+    param_names = ['input']
+    timeout = 120
+
+    def setup(self, source):
+        try:
+            import osmnx # noqa: F401 (simplification)
+        except ImportError:
+            raise NotImplementedError("osmnx is not installed")
+        if not CACHE_FILES:
+            raise NotImplementedError("no cached Overpass responses in cache/")
+        self.directory = tempfile.mkdtemp()
+        elements = [element for path in CACHE_FILES for element in iter_elements(path)]
+        self.paths = CACHE_FILES
+        write = write_overpass_json
+        if source == 'osm-xml':
+            self.paths = [os.path.join(self.directory, 'extract.osm')]
+            write_osm_xml(elements, self.paths[0])
+            write = write_osm_xml
+        self.large = os.path.join(self.directory, 'large' + os.path.splitext(self.paths[0])[1])
+        write(tiled(elements, TILES), self.large)
+
+    def teardown(self, source):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def time_stream_elements(self, source):
+        for path in self.paths:
+            for _ in iter_elements(path):
+                pass
+
+    def time_build(self, source):
+        build(self.paths)
+
+    def track_stream_peak_kb(self, source):
+        # json.load of the same file would take several times its size
+        size = os.path.getsize(self.large)
+        tracemalloc.start()
+        for _ in iter_elements(self.large):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < size / 4, f"streaming {size / 1024:.0f} KB of input peaked at {peak / 1024:.0f} KB"
+        return round(peak / 1024)
+
+    def track_app_modules_imported(self, source):
+        # the build tool must not need the web app, see app/__init__.py
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORTS % (APP_MODULES,)], cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        imported = output.split(',') if output else []
+        assert not imported, f"the offline build imports {imported}"
+        return len(imported)
+
+    def track_nodes(self, source):
+        return build(self.paths).num_nodes
+
+    def track_hash_mismatches(self, source):
+        # reversed input order, and the other format, must give the very same graph
+        expected = build(CACHE_FILES).content_hash
+        builds = [build(self.paths[::-1]), build(self.paths)]
+        mismatches = sum(graph.content_hash != expected for graph in builds)
+        assert not mismatches, f"{mismatches} rebuild(s) from {source} differ from the cached Overpass responses"
+        return mismatches
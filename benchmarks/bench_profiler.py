@@ -0,0 +1,37 @@
+from flask_jwt_extended import create_access_token
+from app.profiler import PROFILED_ENDPOINTS, request_profiler
+from .common import CENTER_LAT, CENTER_LON, add_user, grid_graph, make_app
+
+# What the allocation request profiler costs a trip request: 'off' must be the plain
+# request path (no wrapper installed), '10%' and '100%' sample that share of requests.
+
+CABS = 1000
+
+class ProfilerSuite:
+    params = [['off', '10%', '100%']]
+    param_names = ['profiler']
+
+    def setup(self, profiler):
+        self.app = make_app(grid_graph(), CABS)
+        self.views = {endpoint: self.app.view_functions[endpoint] for endpoint in PROFILED_ENDPOINTS}
+        _, public_id = add_user(self.app, 'employee@example.com')
+        with self.app.app_context():
+            token = create_access_token(identity=public_id)
+        self.client = self.app.test_client()
+        self.client.set_cookie('access_token_cookie', token)
+        if profiler != 'off':
+            request_profiler.enable(float(profiler.rstrip('%')))
+
+    def teardown(self, profiler):
+        request_profiler.disable(write=False)
+
+    def time_request_trip(self, profiler):
+        # allocated inside the request, then finished so the cab is free for the next round
+        response = self.client.post('/employee/request-trip', json={'lat': CENTER_LAT, 'lon': CENTER_LON})
+        assert response.status_code == 200
+        self.client.post('/employee/trips/finish')
+
+    def track_wrapped_views(self, profiler):
+        wrapped = sum(self.app.view_functions[endpoint] is not view for endpoint, view in self.views.items())
+        assert wrapped == 0 or profiler != 'off', "profiler wrappers installed while it is off"
+        return wrapped
@@ -0,0 +1,94 @@
+from flask_jwt_extended import create_access_token
+from app.extensions import db
+from app.models import Trip
+from app.batch_allocation import allocate_trips_in_batch
+from .common import FLEET_SIZES, add_requested_trips, add_user, count_queries, grid_graph, make_app
+
+# SQL statements per request. These must not grow with the fleet or with the number of
+# pending trips (no N+1 queries); each track_ method fails when it exceeds its budget.
+
+PENDING_TRIPS = 20
+BATCH_SIZE = 16
+
+QUERY_BUDGETS = {
+    'dashboard_view': 0, # page shell only
+    'admin_state': 2, # admin check, open trips joined with their employees (cabs come from the fleet store)
+    'employee_dashboard': 1, # user
+    'employee_state': 2, # user, own trip
+    'request_trip': 8, # user, insert trip, trip, chosen cab, claim cab, claim trip, employee, commit (employee UPDATE)
+    'admin_allocate': 7, # admin check, trip, chosen cab, claim cab, claim trip, employee, commit (employee UPDATE)
+    'batch_allocation': 5, # employees, chosen cabs, claim cabs, claim trips, commit (employee UPDATE)
+}
+
+def _check(name, counter):
+    budget = QUERY_BUDGETS[name]
+    assert counter.count <= budget, (
+        f"{name} ran {counter.count} SQL statements, budget is {budget}:\n" + '\n'.join(counter.statements)
+    )
+    return counter.count
+
+class QueryCountSuite:
+    params = [FLEET_SIZES]
+    param_names = ['cabs']
+
+    def setup(self, cabs):
+        self.app = make_app(grid_graph(), cabs)
+        _, admin_public_id = add_user(self.app, 'admin@example.com', role='admin')
+        self.employee_id, employee_public_id = add_user(self.app, 'employee@example.com')
+        add_requested_trips(self.app, self.employee_id, PENDING_TRIPS)
+
+        with self.app.app_context():
+            admin_token = create_access_token(identity=admin_public_id)
+            employee_token = create_access_token(identity=employee_public_id)
+        self.admin = self.app.test_client()
+        self.admin.set_cookie('access_token_cookie', admin_token)
+        self.employee = self.app.test_client()
+        self.employee.set_cookie('access_token_cookie', employee_token)
+
+        # Warm the fleet store, as on a running server
+        self.admin.get('/admin/dashboard')
+        with self.app.app_context():
+            from app.fleet import fleet
+            fleet.ensure_loaded()
+
+    def track_dashboard_view(self, cabs):
+        with count_queries(self.app) as counter:
+            assert self.admin.get('/admin/dashboard').status_code == 200
+        return _check('dashboard_view', counter)
+
+    def track_admin_state(self, cabs):
+        with count_queries(self.app) as counter:
+            assert self.admin.get('/admin/state').status_code == 200
+        return _check('admin_state', counter)
+
+    def track_employee_dashboard(self, cabs):
+        with count_queries(self.app) as counter:
+            assert self.employee.get('/employee/dashboard').status_code == 200
+        return _check('employee_dashboard', counter)
+
+    def track_employee_state(self, cabs):
+        with count_queries(self.app) as counter:
+            assert self.employee.get('/employee/state').status_code == 200
+        return _check('employee_state', counter)
+
+    def track_request_trip(self, cabs):
+        with count_queries(self.app) as counter:
+            response = self.employee.post('/employee/request-trip', json={'lat': 26.2389, 'lon': 73.0243})
+            assert response.status_code in (200, 404)
+        return _check('request_trip', counter)
+
+    def track_admin_allocate(self, cabs):
+        with self.app.app_context():
+            trip_id = Trip.query.filter_by(status='requested').first().id
+        with count_queries(self.app) as counter:
+            response = self.admin.post(f'/admin/trips/{trip_id}/allocate')
+            assert response.status_code in (200, 404)
+        return _check('admin_allocate', counter)
+
+    def track_batch_allocation(self, cabs):
+        with self.app.app_context():
+            trips = Trip.query.filter_by(status='requested').limit(BATCH_SIZE).all()
+            with count_queries(self.app) as counter:
+                allocate_trips_in_batch(trips)
+            db.session.rollback()
+        return _check('batch_allocation', counter)
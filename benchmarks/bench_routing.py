@@ -0,0 +1,26 @@
+from itertools import cycle
+from app.route_cache import route_cache
+from app.utils import find_shortest_path_distance
+from .common import grid_graph, random_points
+
+class ShortestPathSuite:
+    # Grid side; the graph has side * side intersections
+    params = [[50, 100, 200]]
+    param_names = ['side']
+
+    def setup(self, side):
+        self.graph = grid_graph(side, side)
+        starts = random_points(self.graph, 100, seed=1)
+        ends = random_points(self.graph, 100, seed=2)
+        self.pairs = list(zip(zip(*(c.tolist() for c in starts)), zip(*(c.tolist() for c in ends))))
+        self.next_pair = cycle(self.pairs).__next__
+
+    def time_find_shortest_path_distance(self, side):
+        # a fresh query: snapping plus an ALT search
+        route_cache.clear()
+        start, end = self.next_pair()
+        find_shortest_path_distance(self.graph, start, end)
+
+    def time_find_shortest_path_distance_cached(self, side):
+        start, end = self.pairs[0]
+        find_shortest_path_distance(self.graph, start, end)
@@ -0,0 +1,67 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Cold start of a worker: `import app` and create_app() in a fresh interpreter, the only
+# way to measure them since create_app() runs once per process. Routing dependencies must
+# not be imported on the way; the road graph loads in a background task afterwards.
+
+STARTS = 3
+HEAVY_MODULES = ('osmnx', 'networkx', 'geopandas', 'sklearn') # loaded with the road graph, never at boot
+CREATE_APP_BUDGET = 3.0 # seconds, without the monitoring dashboard
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+from benchmarks.common import BenchmarkConfig
+config = type('StartupConfig', (BenchmarkConfig,), {'MONITORING_DASHBOARD': %r, 'GRAPH_WARMUP': False})
+create_app(config)
+created = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'modules': [name for name in %r if name in sys.modules]
+}))
+"""
+
+class StartupSuite:
+    params = [['no-dashboard', 'dashboard']]
+    param_names = ['monitoring']
+    timeout = 120
+
+    def setup(self, monitoring):
+        code = CHILD % (monitoring == 'dashboard', HEAVY_MODULES)
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        runs = []
+        # in a scratch directory: the monitoring dashboard creates its database in the cwd
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(STARTS):
+                output = subprocess.run(
+                    [sys.executable, '-c', code], cwd=directory, env=env,
+                    capture_output=True, text=True, check=True
+                ).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+        self.runs = runs
+
+    def track_import_ms(self, monitoring):
+        return round(statistics.median(run['import'] for run in self.runs) * 1000)
+
+    def track_create_app_ms(self, monitoring):
+        return round(statistics.median(run['create_app'] for run in self.runs) * 1000)
+
+    def track_startup_ms(self, monitoring):
+        startup = statistics.median(run['import'] + run['create_app'] for run in self.runs)
+        assert startup <= CREATE_APP_BUDGET or monitoring == 'dashboard', f"import + create_app() took {startup:.2f}s"
+        return round(startup * 1000)
+
+    def track_heavy_modules_imported(self, monitoring):
+        imported = sorted({name for run in self.runs for name in run['modules']})
+        assert not imported, f"imported at startup: {imported}"
+        return len(imported)
@@ -0,0 +1,173 @@
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import event
+from app import create_app
+from app.extensions import db
+from app.fleet import fleet
+from app.models import Cab, Trip, User
+from app.road_graph import RoadGraph
+from app.route_cache import route_cache
+from app import utils
+from config import Config
+
+# Shared fixtures. Benchmarks run against a synthetic grid road network instead of the
+# downloaded Jodhpur graph, so they need neither osmnx nor network access and give the
+# same numbers on every machine. The grid is centred on Jodhpur so that coordinates,
+# search radii and grid cells behave like the real thing.
+
+FLEET_SIZES = [10, 100, 1000, 10000]
+
+CENTER_LAT = 26.2389
+CENTER_LON = 73.0243
+GRID_SPACING_DEG = 0.001 # ~110 m blocks
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://' # in-memory
+    # Keep background tasks out of the measurements: nothing is flushed or broadcast
+    # unless a benchmark does it explicitly
+    LOCATION_FLUSH_INTERVAL = 3600.0
+    BROADCAST_TICK = 3600.0
+    GRAPH_WARMUP = False # the benchmarks install their own graph with use_graph()
+    JWT_COOKIE_CSRF_PROTECT = False
+    ALLOCATION_WORKERS = 0 # allocate inside the request, so it is part of what is measured
+
+_graphs = {}
+_app = None
+
+def grid_graph(rows=100, cols=100):
+    """A rows x cols two-way street grid with landmarks and a spatial index, built once per size."""
+    if (rows, cols) in _graphs:
+        return _graphs[(rows, cols)]
+
+    node = np.arange(rows * cols).reshape(rows, cols)
+    lat = CENTER_LAT + (np.repeat(np.arange(rows), cols) - rows / 2) * GRID_SPACING_DEG
+    lon = CENTER_LON + (np.tile(np.arange(cols), rows) - cols / 2) * GRID_SPACING_DEG
+
+    # Horizontal and vertical streets in both directions
+    sources = np.concatenate([node[:, :-1].ravel(), node[:, 1:].ravel(), node[:-1, :].ravel(), node[1:, :].ravel()])
+    targets = np.concatenate([node[:, 1:].ravel(), node[:, :-1].ravel(), node[1:, :].ravel(), node[:-1, :].ravel()])
+    length = utils.haversine_distances(lat[sources], lon[sources], lat[targets], lon[targets]) * 1000
+
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(rows * cols + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=rows * cols), out=indptr[1:])
+
+    graph = RoadGraph(node.ravel(), lat, lon, indptr, targets[order], length[order])
+    graph.build_landmarks(8)
+    graph.build_spatial_index()
+    _graphs[(rows, cols)] = graph
+    return graph
+
+def street_grid_graph(rows=50, cols=50, subdivisions=5, weight='length'):
+    """
+    Like grid_graph, but every street between two intersections has `subdivisions - 1`
+    shape nodes along it, as roads straight from OSM do, and every fifth street is a
+    50 km/h main road (25 km/h otherwise) for travel times. Built once per arguments.
+    """
+    key = ('streets', rows, cols, subdivisions, weight)
+    if key in _graphs:
+        return _graphs[key]
+
+    fine_rows, fine_cols = (rows - 1) * subdivisions + 1, (cols - 1) * subdivisions + 1
+    i, j = np.indices((fine_rows, fine_cols))
+    on_street = (i % subdivisions == 0) | (j % subdivisions == 0)
+    node = np.full((fine_rows, fine_cols), -1)
+    node[on_street] = np.arange(on_street.sum())
+    lat = CENTER_LAT + (i[on_street] - fine_rows / 2) * GRID_SPACING_DEG / subdivisions
+    lon = CENTER_LON + (j[on_street] - fine_cols / 2) * GRID_SPACING_DEG / subdivisions
+
+    horizontal = (i[:, :-1] % subdivisions == 0)
+    vertical = (j[:-1, :] % subdivisions == 0)
+    a = np.concatenate([node[:, :-1][horizontal], node[:-1, :][vertical]])
+    b = np.concatenate([node[:, 1:][horizontal], node[1:, :][vertical]])
+    main = np.concatenate([i[:, :-1][horizontal] % (5 * subdivisions) == 0, j[:-1, :][vertical] % (5 * subdivisions) == 0])
+    sources, targets, main = np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([main, main])
+    length = utils.haversine_distances(lat[sources], lon[sources], lat[targets], lon[targets]) * 1000
+    travel_time = length / (np.where(main, 50.0, 25.0) / 3.6)
+
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(len(lat) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(lat)), out=indptr[1:])
+
+    graph = RoadGraph(np.arange(len(lat)), lat, lon, indptr, targets[order], length[order], travel_time[order], weight)
+    graph.build_landmarks(8)
+    graph.build_spatial_index()
+    _graphs[key] = graph
+    return graph
+
+def use_graph(graph):
+    # load_road_network() serves an already loaded graph without touching the disk as
+    # long as it has no file signature
+    utils._road_network = graph
+
+def random_points(graph, count, seed=0):
+    """(lats, lons) of `count` random nodes of the graph."""
+    nodes = np.random.default_rng(seed).integers(graph.num_nodes, size=count)
+    return np.asarray(graph.lat)[nodes], np.asarray(graph.lon)[nodes]
+
+def make_app(graph, num_cabs, seed=0):
+    """The app on a freshly emptied in-memory database with `num_cabs` available cabs on the grid."""
+    global _app
+    use_graph(graph)
+    # create_app() can only run once per process (the monitoring dashboard binds a
+    # module-level blueprint), so the app is shared and its state reset instead
+    if _app is None:
+        _app = create_app(BenchmarkConfig)
+    app = _app
+    fleet.clear()
+    route_cache.clear()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        lats, lons = random_points(graph, num_cabs, seed)
+        db.session.execute(db.insert(Cab), [
+            {
+                'driver_name': f'driver{i}',
+                'license_plate': f'BENCH{i}',
+                'current_lat': lat,
+                'current_lon': lon,
+                'status': 'available'
+            }
+            for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist()))
+        ])
+        db.session.commit()
+    return app
+
+def add_user(app, email, role='employee'):
+    with app.app_context():
+        user = User(email=email, role=role, latitude=CENTER_LAT, longitude=CENTER_LON)
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        return user.id, user.public_id
+
+def add_requested_trips(app, employee_id, count, seed=1):
+    graph = utils.load_road_network()
+    lats, lons = random_points(graph, count, seed)
+    with app.app_context():
+        db.session.execute(db.insert(Trip), [
+            {'employee_id': employee_id, 'start_lat': lat, 'start_lon': lon, 'status': 'requested'}
+            for lat, lon in zip(lats.tolist(), lons.tolist())
+        ])
+        db.session.commit()
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+@contextmanager
+def count_queries(app):
+    """Counts the SQL statements the app runs inside the block."""
+    counter = QueryCounter()
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
@@ -0,0 +1,18 @@
+import sys
+from app.road_graph import RoadGraph
+from app.utils import GRAPH_FILE_PATH
+
+# Offline preprocessing step: (re)builds the ALT landmark index of the compiled graph.
+# generate_graph.py already does this; run this script after changing the number of
+# landmarks or recompiling the graph by other means.
+# Usage: python build_routing_index.py [num_landmarks]
+num_landmarks = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+
+print(f"Loading the compiled graph from {GRAPH_FILE_PATH}...")
+graph = RoadGraph.load(GRAPH_FILE_PATH, mmap_mode=None)
+
+print(f"Building the routing index with {num_landmarks} landmarks...")
+graph.build_landmarks(num_landmarks)
+graph.save(GRAPH_FILE_PATH)
+
+print(f"Routing index ({len(graph.landmarks)} landmarks, by {graph.weight_name}) saved to {GRAPH_FILE_PATH}, hash {graph.content_hash[:12]}")
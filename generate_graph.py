@@ -1,27 +1,71 @@
+import argparse
+import glob
+import os
 import osmnx as ox
-import networkx as nx
+from app.graph_pipeline import compile_graph, preprocess
+from app.osm_reader import file_digest, graph_from_files, load_boundary
 
 # Define the location and network type
 place_name = "Jodhpur, Rajasthan, India"
 network_type = "drive"
 file_path = "jodhpur.graphml"
+cache_files = "cache/*.json" # osmnx's cached Overpass/Nominatim responses
+compiled_path = "jodhpur.graph" # must match GRAPH_FILE_PATH in app/utils.py
+num_landmarks = 16 # size of the ALT routing index, see build_routing_index.py
 
-print(f"Downloading road network for {place_name}...")
+parser = argparse.ArgumentParser(description="Download the road network and compile it for the app.")
+source_options = parser.add_mutually_exclusive_group()
+source_options.add_argument('--compile-only', action='store_true', help=f"rebuild the compiled graph from an existing {file_path}")
+source_options.add_argument('--offline', nargs='*', metavar='FILE',
+                            help=f"build from local OSM data instead of downloading: Overpass JSON responses (default: {cache_files}) "
+                                 "or an .osm / .osm.pbf extract")
+parser.add_argument('--boundary', metavar='NOMINATIM_JSON',
+                    help="with --offline, keep only the roads inside the place polygon of a cached Nominatim response")
+parser.add_argument('--weight', choices=('length', 'travel_time'), default='length',
+                    help="what allocation and routing minimize: road distance or free-flow travel time")
+parser.add_argument('--contract', action='store_true',
+                    help="contract degree-2 chains: smaller and faster to route on, coarser road geometry")
+args = parser.parse_args()
+if args.boundary and args.offline is None:
+    parser.error("--boundary needs --offline")
 
-# Download the road network graph
-graph = ox.graph_from_place(place_name, network_type=network_type)
-
-# Get the largest strongly connected component
-if not nx.is_strongly_connected(graph):
-    print("Graph is not strongly connected. Extracting the largest component.")
-    largest_scc = max(nx.strongly_connected_components(graph), key=len)
-    graph = graph.subgraph(largest_scc).copy()
+if args.offline is not None:
+    inputs = args.offline or sorted(glob.glob(cache_files))
+    print(f"Building the road network from {len(inputs)} local file(s)...")
+    boundary = load_boundary(args.boundary) if args.boundary else None
+    graph = graph_from_files(inputs, boundary=boundary)
+    # recorded in the manifest, so a rebuild can be checked against the exact inputs
+    source = {
+        'offline': [{'file': os.path.basename(path), 'sha256': file_digest(path)} for path in inputs],
+        'boundary': args.boundary and os.path.basename(args.boundary)
+    }
+elif args.compile_only:
+    print(f"Loading the graph from {file_path}...")
+    graph = ox.load_graphml(file_path)
+    source = file_path
 else:
-    print("Graph is already strongly connected.")
+    print(f"Downloading road network for {place_name}...")
+
+    # Download the road network graph
+    graph = ox.graph_from_place(place_name, network_type=network_type)
+    source = place_name
+
+# Largest strongly connected component, speeds and travel times, unused attributes dropped
+print("Preprocessing the graph...")
+graph = preprocess(graph)
+
+if not args.compile_only and args.offline is None:
+    print("Saving the graph to a file...")
+
+    ox.save_graphml(graph, filepath=file_path)
 
+    print(f"Graph saved successfully to {file_path}")
 
-print("Saving the graph to a file...")
+# Build step: flatten the graph into the NumPy/CSR arrays the app memory-maps at runtime,
+# plus the routing index for fast point-to-point queries (A* with landmarks)
+print(f"Compiling the graph (weight: {args.weight}{', contracted' if args.contract else ''}, {num_landmarks} landmarks)...")
 
-ox.save_graphml(graph, filepath=file_path)
+road_graph = compile_graph(graph, weight=args.weight, contract=args.contract, num_landmarks=num_landmarks, source=source)
+road_graph.save(compiled_path)
 
-print(f"Graph saved successfully to {file_path}")
+print(f"Compiled graph ({road_graph.num_nodes} nodes, {road_graph.num_edges} edges, hash {road_graph.content_hash[:12]}) saved to {compiled_path}")
@@ -0,0 +1,351 @@
+import argparse
+import base64
+import heapq
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import numpy as np
+import requests
+import socketio
+from app.road_graph import RoadGraph
+from app.utils import GRAPH_FILE_PATH
+
+# Trip request load generator. Creates employees through the normal signup/login flow and
+# fires /employee/request-trip at pickup points drawn from the road graph nodes, following
+# a Poisson process (constant rate) or a time-of-day curve with office commute peaks.
+# Requests are open-loop: they are sent on schedule from a thread pool, however slow the
+# server is. Every run is written as a JSONL trace that --replay sends again with the same
+# timing, employees and pickup points.
+#
+# Pair it with the cab simulator so there are cabs to allocate and they actually drive:
+#   python run.py
+#   python simulate_cabs.py --cabs 500
+#   python loadgen.py --employees 200 --rate 5 --duration 120
+#
+# Allocation latency is the time until the outcome is known: the HTTP response when the
+# server allocates inside the request, or the 'trip_allocated' / 'trip_cancelled' socket
+# event when it answers 202, which is the default (ALLOCATION_WORKERS background workers,
+# or BATCH_ALLOCATION_WINDOW when batching).
+
+SERVER_URL = 'http://127.0.0.1:5000'
+EMAIL_PREFIX = 'loadgen'
+PASSWORD = 'loadgen-password'
+
+# Relative demand by hour of day for --model time-of-day: morning and evening commute
+# peaks over a low base load
+COMMUTE_PEAKS = ((9.0, 1.5), (18.5, 2.0)) # (hour, width in hours)
+BASE_DEMAND = 0.1
+
+def time_of_day_factor(hour):
+    factor = BASE_DEMAND
+    for peak, width in COMMUTE_PEAKS:
+        distance = min(abs(hour - peak), 24 - abs(hour - peak))
+        factor += math.exp(-0.5 * (distance / width) ** 2)
+    return factor
+
+def generate_arrivals(args, rng):
+    """Yields request times (seconds since start) until --duration or --requests runs out."""
+    if args.model == 'poisson':
+        rate_at = lambda t: args.rate
+    else:
+        # --rate is the peak rate; --day-seconds of wall time make up one simulated day
+        peak = max(time_of_day_factor(hour / 10) for hour in range(240))
+        hour_at = lambda t: (args.start_hour + t * 24 / args.day_seconds) % 24
+        rate_at = lambda t: args.rate * time_of_day_factor(hour_at(t)) / peak
+
+    # Non-homogeneous Poisson process by thinning a process at the peak rate
+    t = 0.0
+    count = 0
+    while True:
+        t += rng.exponential(1 / args.rate)
+        if args.duration and t > args.duration:
+            return
+        if rng.random() * args.rate <= rate_at(t):
+            yield t
+            count += 1
+            if args.requests and count >= args.requests:
+                return
+
+def percentile_summary(values):
+    if not values:
+        return "n/a"
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return f"p50 {p50:.0f} ms, p90 {p90:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms, max {max(values):.0f} ms"
+
+def jwt_identity(token):
+    # The login cookie's subject is the user's public_id, which names their socket room
+    payload = token.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))['sub']
+
+class Employee:
+    def __init__(self, index, email):
+        self.index = index
+        self.email = email
+        self.http = requests.Session()
+        self.public_id = None
+        self.busy = False # has a request outstanding or a trip in progress
+
+    def post(self, server, path, payload=None):
+        # JWT cookies are CSRF protected, like the browser the token goes in a header
+        headers = {'X-CSRF-TOKEN': self.http.cookies.get('csrf_access_token', '')}
+        return self.http.post(server + path, json=payload or {}, headers=headers, timeout=60)
+
+    def sign_up_and_log_in(self, server):
+        credentials = {'email': self.email, 'password': PASSWORD}
+        response = self.http.post(f"{server}/auth/employee/signup", json=credentials, timeout=60)
+        if response.status_code not in (201, 409): # 409: already created by an earlier run
+            raise RuntimeError(f"signup of {self.email} failed: {response.status_code} {response.text}")
+        response = self.http.post(f"{server}/auth/login", json=credentials, timeout=60)
+        if response.status_code != 200:
+            raise RuntimeError(f"login of {self.email} failed: {response.status_code} {response.text}")
+        self.public_id = jwt_identity(self.http.cookies['access_token_cookie'])
+
+class LoadGenerator:
+    def __init__(self, args, trace_file):
+        self.args = args
+        self.server = args.server.rstrip('/')
+        self.trace_file = trace_file
+        self.employees = []
+        self.pool = ThreadPoolExecutor(args.concurrency)
+        self.lock = threading.Lock()
+
+        # Outcomes of 202 requests arrive as socket events. 'trip_allocated' goes to every
+        # client, so only the trips this run waits on are kept; an outcome of one of our
+        # employees that beats the HTTP response telling us its trip id is held in `early`,
+        # which never needs more room than there are requests in flight.
+        self.pending = set() # trip ids of 202 responses still waiting for their outcome
+        self.outcomes = {} # pending trip_id -> (outcome, received_at)
+        self.early = OrderedDict() # trip_id -> (outcome, received_at), before the response
+        self.public_ids = set()
+        self.outcome_arrived = threading.Condition(self.lock)
+
+        self.rides = [] # heap of (finish_at, employee index) for allocated trips
+        self.results = []
+        self.skipped = 0
+        self.sio = socketio.Client()
+        self.sio.on('trip_allocated', lambda data: self._socket_outcome(data, 'allocated'))
+        self.sio.on('trip_cancelled', lambda data: self._socket_outcome(data, 'cancelled'))
+
+    def record(self, entry):
+        with self.lock:
+            self.trace_file.write(json.dumps(entry) + '\n')
+
+    def _socket_outcome(self, data, outcome):
+        trip_id = data['trip_id']
+        # 'trip_cancelled' is only sent to our employees' rooms
+        ours = outcome == 'cancelled' or data.get('employee_id') in self.public_ids
+        with self.outcome_arrived:
+            if trip_id in self.pending:
+                self.outcomes[trip_id] = (outcome, time.perf_counter())
+                self.outcome_arrived.notify_all()
+            elif ours:
+                self.early[trip_id] = (outcome, time.perf_counter())
+                while len(self.early) > self.args.concurrency:
+                    self.early.popitem(last=False)
+
+    def _wait_for_outcome(self, trip_id, deadline):
+        with self.outcome_arrived:
+            if trip_id in self.early:
+                return self.early.pop(trip_id)
+            self.pending.add(trip_id)
+            try:
+                while trip_id not in self.outcomes:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return 'timeout', None
+                    self.outcome_arrived.wait(remaining)
+                return self.outcomes.pop(trip_id)
+            finally:
+                self.pending.discard(trip_id)
+
+    def set_up(self, count):
+        print(f"Creating and logging in {count} employees...")
+        self.employees = [Employee(i, f"{self.args.email_prefix}-{i}@example.com") for i in range(count)]
+        list(self.pool.map(lambda employee: employee.sign_up_and_log_in(self.server), self.employees))
+        self.public_ids = {employee.public_id for employee in self.employees}
+
+        self.sio.connect(self.server)
+        for employee in self.employees:
+            self.sio.emit('join_employee_room', {'public_id': employee.public_id})
+            if employee.index % 10 == 9:
+                # over the polling transport the server refuses payloads of more than 16 packets
+                self.sio.sleep(0.05)
+
+    def request_trip(self, seq, employee, lat, lon):
+        started = time.perf_counter()
+        trip_id = None
+        try:
+            response = employee.post(self.server, '/employee/request-trip', {'lat': lat, 'lon': lon})
+            body = response.json()
+            trip_id = body.get('trip_id')
+            if response.status_code == 200:
+                outcome, finished = 'allocated', time.perf_counter()
+            elif response.status_code == 404 and body.get('status') == 'cancelled':
+                outcome, finished = 'cancelled', time.perf_counter()
+            elif response.status_code == 202:
+                outcome, finished = self._wait_for_outcome(trip_id, started + self.args.timeout)
+            else:
+                outcome, finished = 'error', time.perf_counter()
+            if response.status_code != 202:
+                with self.lock:
+                    self.early.pop(trip_id, None) # the broadcast 'trip_allocated' of this trip
+        except (requests.RequestException, ValueError):
+            outcome, finished = 'error', time.perf_counter()
+
+        latency_ms = (finished - started) * 1000 if finished else None
+        self.record({'type': 'result', 'seq': seq, 'trip_id': trip_id, 'outcome': outcome, 'latency_ms': latency_ms})
+        with self.lock:
+            self.results.append((outcome, latency_ms))
+            if outcome == 'allocated':
+                # Ride along for a while, then finish the trip so the cab is freed for others
+                heapq.heappush(self.rides, (time.perf_counter() + self.args.ride_seconds, employee.index))
+            else:
+                employee.busy = False
+
+    def finish_rides(self, until):
+        while True:
+            with self.lock:
+                if not self.rides or self.rides[0][0] > until:
+                    return
+                _, index = heapq.heappop(self.rides)
+            employee = self.employees[index]
+            self.pool.submit(self._finish, employee)
+
+    def _finish(self, employee):
+        try:
+            employee.post(self.server, '/employee/trips/finish')
+        except requests.RequestException:
+            pass
+        with self.lock:
+            employee.busy = False
+
+    def run(self, schedule):
+        """schedule: iterable of (t, employee index or None, lat, lon) in time order."""
+        started = time.perf_counter()
+        seq = 0
+        in_flight = []
+        for t, index, lat, lon in schedule:
+            # Finish due rides while waiting for the next request
+            while True:
+                now = time.perf_counter()
+                self.finish_rides(now)
+                if now - started >= t:
+                    break
+                time.sleep(min(t - (now - started), 0.05))
+
+            with self.lock:
+                if index is None:
+                    idle = [employee for employee in self.employees if not employee.busy]
+                    employee = idle[int(self.args.rng.integers(len(idle)))] if idle else None
+                else:
+                    employee = self.employees[index] if index < len(self.employees) else None
+                    if employee is not None and employee.busy:
+                        employee = None
+                if employee is None:
+                    self.skipped += 1
+                    continue
+                employee.busy = True
+
+            seq += 1
+            self.record({'type': 'request', 'seq': seq, 't': round(t, 4), 'employee': employee.index, 'lat': lat, 'lon': lon})
+            in_flight.append(self.pool.submit(self.request_trip, seq, employee, lat, lon))
+
+        # Let outstanding requests complete, then end every ride that is still going
+        wait(in_flight)
+        self.finish_rides(float('inf'))
+        self.pool.shutdown(wait=True)
+        self.sio.disconnect()
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        total = len(self.results)
+        counts = {outcome: 0 for outcome in ('allocated', 'cancelled', 'timeout', 'error')}
+        for outcome, _ in self.results:
+            counts[outcome] += 1
+        print(f"\n{total} trip requests in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.2f}/s), "
+              f"{self.skipped} skipped because no employee was free")
+        for outcome, count in counts.items():
+            print(f"  {outcome:<10} {count:>6}  {count / max(total, 1) * 100:5.1f}%")
+        print(f"allocation latency (allocated): {percentile_summary([ms for o, ms in self.results if o == 'allocated'])}")
+        print(f"allocation latency (answered):  {percentile_summary([ms for o, ms in self.results if o in ('allocated', 'cancelled')])}")
+
+def load_trace(path):
+    """Run settings and (t, employee, lat, lon) requests of a recorded trace."""
+    settings = {}
+    schedule = []
+    with open(path) as trace:
+        for line in trace:
+            entry = json.loads(line)
+            if entry['type'] == 'run':
+                settings = entry
+            elif entry['type'] == 'request':
+                schedule.append((entry['t'], entry['employee'], entry['lat'], entry['lon']))
+    schedule.sort()
+    return settings, schedule
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate employee trip requests against a running server.")
+    parser.add_argument('--server', default=SERVER_URL)
+    parser.add_argument('--employees', type=int, default=50, help="employees to create/log in")
+    parser.add_argument('--email-prefix', default=EMAIL_PREFIX, help="employees are <prefix>-<n>@example.com")
+    parser.add_argument('--model', choices=('poisson', 'time-of-day'), default='poisson')
+    parser.add_argument('--rate', type=float, default=1.0, help="requests per second (peak rate for time-of-day)")
+    parser.add_argument('--day-seconds', type=float, default=600, help="time-of-day: wall seconds per simulated day")
+    parser.add_argument('--start-hour', type=float, default=7.0, help="time-of-day: simulated hour at the start")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to generate requests for (0 = no limit)")
+    parser.add_argument('--requests', type=int, default=0, help="stop after this many requests (0 = no limit)")
+    parser.add_argument('--ride-seconds', type=float, default=60, help="finish an allocated trip after this long")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for the outcome of a 202 request")
+    parser.add_argument('--concurrency', type=int, default=32, help="requests in flight at most")
+    parser.add_argument('--trace', default=None, help="JSONL trace to write (default loadgen-<timestamp>.jsonl)")
+    parser.add_argument('--replay', default=None, help="replay the requests of a recorded trace")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay: time compression factor")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if not args.duration and not args.requests and not args.replay:
+        parser.error("set --duration or --requests")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.rng = np.random.default_rng(args.seed)
+    started_at = datetime.now(timezone.utc)
+    trace_path = args.trace or f"loadgen-{started_at:%Y%m%d-%H%M%S}.jsonl"
+
+    if args.replay:
+        settings, schedule = load_trace(args.replay)
+        schedule = [(t / args.speed, index, lat, lon) for t, index, lat, lon in schedule]
+        num_employees = max(settings.get('employees', 0), max((index + 1 for _, index, _, _ in schedule), default=0))
+        print(f"Replaying {len(schedule)} requests from {args.replay}...")
+    else:
+        print(f"Loading graph from {GRAPH_FILE_PATH}...")
+        graph = RoadGraph.load(GRAPH_FILE_PATH)
+        # Pickups at random intersections of the road network, employees picked when due
+        schedule = (
+            (t, None, float(graph.lat[node]), float(graph.lon[node]))
+            for t, node in ((t, int(args.rng.integers(graph.num_nodes))) for t in generate_arrivals(args, args.rng))
+        )
+        num_employees = args.employees
+
+    with open(trace_path, 'w') as trace_file:
+        generator = LoadGenerator(args, trace_file)
+        generator.set_up(num_employees)
+        generator.record({
+            'type': 'run', 'started_at': started_at.isoformat(), 'server': args.server,
+            'employees': num_employees, 'model': 'replay' if args.replay else args.model,
+            'rate': args.rate, 'seed': args.seed, 'replay_of': args.replay
+        })
+        print(f"Sending trip requests, trace in {trace_path}...")
+        try:
+            elapsed = generator.run(schedule)
+        except KeyboardInterrupt:
+            print("\nLoad generation stopped by user.")
+            elapsed = None
+
+    if elapsed is not None:
+        generator.report(elapsed)
@@ -0,0 +1,38 @@
+"""indexes for status and trip lookups
+
+Revision ID: 5b1f0e7a9d42
+Revises: c996879b45a6
+Create Date: 2026-10-17 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0e7a9d42'
+down_revision = 'c996879b45a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Allocation and the dashboards filter cabs and trips by status, and look trips up
+    # by employee or by cab together with their status
+    with op.batch_alter_table('cab', schema=None) as batch_op:
+        batch_op.create_index('ix_cab_status', ['status'], unique=False)
+
+    with op.batch_alter_table('trip', schema=None) as batch_op:
+        batch_op.create_index('ix_trip_status_cab_id', ['status', 'cab_id'], unique=False)
+        batch_op.create_index('ix_trip_employee_id_status', ['employee_id', 'status'], unique=False)
+        batch_op.create_index('ix_trip_cab_id_status', ['cab_id', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('trip', schema=None) as batch_op:
+        batch_op.drop_index('ix_trip_cab_id_status')
+        batch_op.drop_index('ix_trip_employee_id_status')
+        batch_op.drop_index('ix_trip_status_cab_id')
+
+    with op.batch_alter_table('cab', schema=None) as batch_op:
+        batch_op.drop_index('ix_cab_status')
@@ -1,52 +1,243 @@
+import argparse
+import multiprocessing
+import os
 import time
-import random
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
 import socketio
-import osmnx as ox
 from app import create_app, db
 from app.models import Cab
-import networkx # Added to handle pathfinding errors
+from app.road_graph import RoadGraph
+from app.utils import GRAPH_FILE_PATH, load_road_network, shortest_path
 
-GRAPH_FILE = "jodhpur.graphml"
 NUM_CABS = 3
 SERVER_URL = 'http://127.0.0.1:5000'
+TICK_SECONDS = 1.0
+SPEED_KMH = (20.0, 40.0) # each cab gets a random cruising speed in this range
+EMIT_CHUNK = 1000 # cabs per 'update_locations' message
 
-# Load the graph
-print(f"Loading graph from {GRAPH_FILE}...")
-graph = ox.load_graphml(GRAPH_FILE)
-nodes = list(graph.nodes)
-print("Graph loaded successfully.")
+# Vectorized fleet simulation. Every cab is an (edge, offset) pair: the CSR edge it is
+# driving on and the meters already covered along it. A tick advances all cabs at once by
+# speed * dt along the real edge lengths, crossing as many intersections as that takes.
+# Available cabs turn randomly at intersections, cabs with a destination follow their route.
+# Assumes every node has an outgoing road, which holds for the strongly connected graph
+# generate_graph.py keeps.
+class FleetSimulation:
+    def __init__(self, graph, start_nodes, speeds_mps, rng=None):
+        self.graph = graph
+        self.rng = rng or np.random.default_rng()
+        self.indptr = np.asarray(graph.indptr)
+        self.heads = np.asarray(graph.indices)
+        self.tails = graph.edge_sources()
+        self.lengths = np.asarray(graph.length)
+        self.node_lat = np.asarray(graph.lat)
+        self.node_lon = np.asarray(graph.lon)
 
-def create_sample_cabs(app):
+        self.speed = np.asarray(speeds_mps, dtype=np.float64)
+        self.offset = np.zeros(len(start_nodes))
+        self.edge = self._random_out_edges(np.asarray(start_nodes, dtype=np.int64))
+        self.on_route = np.zeros(len(start_nodes), dtype=bool)
+        self.routes = {} # cab index -> [route edges, position of the next edge]
+
+    def __len__(self):
+        return len(self.edge)
+
+    def _random_out_edges(self, nodes):
+        first = self.indptr[nodes]
+        degree = self.indptr[nodes + 1] - first
+        return first + (self.rng.random(len(nodes)) * degree).astype(np.int64)
+
+    def next_node(self, cab):
+        """The intersection the cab reaches next; routes are planned from there."""
+        return int(self.heads[self.edge[cab]])
+
+    def set_route(self, cab, path):
+        """
+        Follow `path` (node indices) once the current edge is done. The path was planned from
+        next_node(cab) at some earlier tick, so the cab may already be further along it; it
+        joins the path at its current next_node. Returns False if that node is not on the
+        path any more (the cab drove off it meanwhile) and the route has to be planned again.
+        """
+        try:
+            path = path[path.index(self.next_node(cab)):]
+        except ValueError:
+            return False
+        edges = [self.graph.edge_between(u, v) for u, v in zip(path, path[1:])]
+        self.routes[cab] = [edges, 0]
+        self.on_route[cab] = True
+        return True
+
+    def step(self, dt):
+        """Advance every cab by dt seconds. Returns the indices of cabs that reached their destination."""
+        arrived = []
+        self.offset += self.speed * dt
+
+        crossing = np.flatnonzero(self.offset >= self.lengths[self.edge])
+        while crossing.size:
+            self.offset[crossing] -= self.lengths[self.edge[crossing]]
+            next_edges = self._random_out_edges(self.heads[self.edge[crossing]])
+
+            # Only cabs with a route need per-cab work, and there are few of them per tick
+            for k in np.flatnonzero(self.on_route[crossing]).tolist():
+                cab = int(crossing[k])
+                edges, position = self.routes[cab]
+                if position < len(edges):
+                    next_edges[k] = edges[position]
+                    self.routes[cab][1] += 1
+                else:
+                    del self.routes[cab]
+                    self.on_route[cab] = False
+                    arrived.append(cab)
+
+            self.edge[crossing] = next_edges
+            crossing = crossing[self.offset[crossing] >= self.lengths[self.edge[crossing]]]
+
+        return arrived
+
+    def positions(self):
+        """(lats, lons) of every cab, interpolated along its current edge."""
+        lengths = self.lengths[self.edge]
+        fraction = np.divide(self.offset, lengths, out=np.ones_like(self.offset), where=lengths > 0)
+        tails, heads = self.tails[self.edge], self.heads[self.edge]
+        lats = self.node_lat[tails] + (self.node_lat[heads] - self.node_lat[tails]) * fraction
+        lons = self.node_lon[tails] + (self.node_lon[heads] - self.node_lon[tails]) * fraction
+        return lats, lons
+
+# Route planning runs in a process pool so a burst of new destinations never stalls the
+# tick loop: routes are submitted, the fleet keeps moving, and finished routes are picked
+# up on a later tick. Each worker opens the compiled graph itself with np.load(mmap_mode='r'),
+# so all workers read the same pages of the graph files instead of getting a pickled copy.
+_worker_graph = None
+
+def _init_route_worker(graph_path):
+    global _worker_graph
+    _worker_graph = RoadGraph.load(graph_path)
+
+def _plan_route(source, target):
+    return shortest_path(_worker_graph, source, target)
+
+class RoutePlanner:
+    def __init__(self, graph, graph_path, workers):
+        self.graph = graph
+        self.pool = None
+        if workers:
+            # spawn, not fork: the parent may already run the socket client's threads
+            self.pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_route_worker, initargs=(graph_path,)
+            )
+        self._pending = {} # cab index -> (future, target)
+
+    def __contains__(self, cab):
+        return cab in self._pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, cab, source, target):
+        """Plan a route for `cab`; replaces any route still being planned for it."""
+        previous = self._pending.pop(cab, None)
+        if previous:
+            previous[0].cancel()
+        if self.pool is None:
+            future = _completed(shortest_path(self.graph, source, target))
+        else:
+            future = self.pool.submit(_plan_route, source, target)
+        self._pending[cab] = (future, target)
+
+    def completed(self):
+        """[(cab, target, path)] for every route that finished since the last call. Never blocks."""
+        done = [cab for cab, (future, _) in self._pending.items() if future.done()]
+        results = []
+        for cab in done:
+            future, target = self._pending.pop(cab)
+            results.append((cab, target, future.result()))
+        return results
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def random_speeds(rng, count):
+    return rng.uniform(SPEED_KMH[0], SPEED_KMH[1], count) / 3.6 # km/h -> m/s
+
+def create_sample_cabs(app, graph, num_cabs, rng):
     with app.app_context():
-        if Cab.query.count() < NUM_CABS:
+        if Cab.query.count() < num_cabs:
             Cab.query.delete() # Clear old cabs if count is wrong
             print("Creating sample cabs...")
-            cabs = []
-            for i in range(NUM_CABS):
-                random_node = random.choice(nodes)
-                node_data = graph.nodes[random_node]
-                cabs.append(
-                    Cab(
-                        driver_name=f'driver{i}',
-                        license_plate=f'RJ19PA{1000 + i}',
-                        current_lat=node_data['y'],
-                        current_lon=node_data['x'],
-                        status='available',
-                        # Ensure destination is initially null
-                        destination_latitude=None,
-                        destination_longitude=None
-                    )
-                )
-            db.session.bulk_save_objects(cabs)
+            random_nodes = rng.integers(graph.num_nodes, size=num_cabs)
+            db.session.execute(db.insert(Cab), [
+                {
+                    'driver_name': f'driver{i}',
+                    'license_plate': f'RJ19PA{1000 + i}',
+                    'current_lat': float(graph.lat[node]),
+                    'current_lon': float(graph.lon[node]),
+                    'status': 'available',
+                    # Ensure destination is initially null
+                    'destination_latitude': None,
+                    'destination_longitude': None
+                }
+                for i, node in enumerate(random_nodes.tolist())
+            ])
             db.session.commit()
-            print(f"{NUM_CABS} sample cabs created.")
+            print(f"{num_cabs} sample cabs created.")
         else:
             print("Cabs already exist in the database.")
 
+def report(tick, tick_seconds, num_cabs, planning):
+    print(f"tick {tick}: {num_cabs} cabs in {tick_seconds * 1000:.1f} ms "
+          f"({num_cabs / max(tick_seconds, 1e-9):,.0f} cabs/s), {planning} routes being planned")
 
-if __name__ == "__main__":
+def run_headless(graph, args, rng):
+    # Engine only: no DB, no socket server. Idle cabs are sent to random destinations at
+    # --dispatch-rate per tick so routing and route-following get exercised too.
+    sim = FleetSimulation(graph, rng.integers(graph.num_nodes, size=args.cabs), random_speeds(rng, args.cabs), rng)
+    planner = RoutePlanner(graph, GRAPH_FILE_PATH, args.workers)
+    print(f"Simulating {args.cabs} cabs headless, tick {args.tick}s, {args.workers} routing workers...")
+
+    tick = 0
+    try:
+        while not args.ticks or tick < args.ticks:
+            started = time.perf_counter()
+            for cab, target, route in planner.completed():
+                if route and not sim.set_route(cab, route):
+                    planner.submit(cab, sim.next_node(cab), target)
+
+            idle = np.flatnonzero(~sim.on_route)
+            dispatched = idle[rng.random(len(idle)) < args.dispatch_rate]
+            for cab in dispatched.tolist():
+                if cab not in planner:
+                    planner.submit(cab, sim.next_node(cab), int(rng.integers(graph.num_nodes)))
+
+            sim.step(args.tick)
+            sim.positions()
+            elapsed = time.perf_counter() - started
+
+            tick += 1
+            if tick % args.report_every == 0:
+                report(tick, elapsed, len(sim), len(planner))
+            if args.realtime:
+                time.sleep(max(0.0, args.tick - elapsed))
+    finally:
+        planner.shutdown()
+
+def run_live(graph, args, rng):
     app = create_app()
-    create_sample_cabs(app)
+    create_sample_cabs(app, graph, args.cabs, rng)
+
+    with app.app_context():
+        rows = db.session.execute(db.select(Cab.id, Cab.current_lat, Cab.current_lon).order_by(Cab.id)).all()
+    cab_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    index_of = {cab_id: i for i, cab_id in enumerate(cab_ids.tolist())}
+    start_nodes = graph.snap([row[1] for row in rows], [row[2] for row in rows])
+    sim = FleetSimulation(graph, start_nodes, random_speeds(rng, len(rows)), rng)
+    planner = RoutePlanner(graph, GRAPH_FILE_PATH, args.workers)
 
     sio = socketio.Client()
 
@@ -68,84 +259,102 @@ if __name__ == "__main__":
         print(f"Error connecting to server: {e}")
         exit()
 
-    print("Starting cab simulation...")
-    
-    cab_nodes = {}
-    cab_routes = {} # For destination-based movement
+    print(f"Starting cab simulation of {len(sim)} cabs...")
 
+    planned = {} # cab index -> destination its current route was planned for
+    tick = 0
     try:
         with app.app_context():
-            while True:
-                cabs = Cab.query.all()
-                for cab in cabs:
-                    
-                    # Cab has a destination and is on a trip
-                    if cab.destination_latitude is not None and cab.destination_longitude is not None:
-                        # If cab just got a destination, calculate its route
-                        if cab.id not in cab_routes or not cab_routes[cab.id]['route']:
-                            print(f"Cab {cab.id} calculating route to destination...")
-                            start_node = ox.distance.nearest_nodes(graph, cab.current_lon, cab.current_lat)
-                            end_node = ox.distance.nearest_nodes(graph, cab.destination_longitude, cab.destination_latitude)
-                            try:
-                                route = ox.shortest_path(graph, start_node, end_node, weight='length')
-                                if route:
-                                    cab_routes[cab.id] = {'route': route, 'index': 0}
-                                else:
-                                    print(f"No path found for Cab {cab.id} (empty route). It will wait.")
-                                    cab_routes[cab.id] = {'route': [], 'index': 0} # Prevent recalculating
-                                    continue
-                            except networkx.NetworkXNoPath:
-                                print(f"No path found for Cab {cab.id}. It will wait.")
-                                cab_routes[cab.id] = {'route': [], 'index': 0}
-                                continue 
-
-                        # Move cab one step along its calculated route
-                        state = cab_routes.get(cab.id)
-                        # Safely check for route existence and index
-                        if state and state.get('route') and state['index'] < len(state['route']):
-                            next_node = state['route'][state['index']]
-                            cab.current_lat = graph.nodes[next_node]['y']
-                            cab.current_lon = graph.nodes[next_node]['x']
-                            state['index'] += 1
-                        else:
-                            print(f"Cab {cab.id} has arrived at its destination.")
-                            # When trip is over, clear destination and route
-                            cab.destination_latitude = None
-                            cab.destination_longitude = None
-                            cab.status = 'available'
-                            cab_routes[cab.id] = {'route': [], 'index': 0}
-
-                    # Cab is available and moves randomly
-                    else:
-                        if cab.id not in cab_nodes:
-                            cab_nodes[cab.id] = ox.distance.nearest_nodes(graph, cab.current_lon, cab.current_lat)
-
-                        current_node = cab_nodes[cab.id]
-                        neighbors = list(graph.neighbors(current_node))
-
-                        if neighbors:
-                            next_node = random.choice(neighbors)
-                            cab.current_lat = graph.nodes[next_node]['y']
-                            cab.current_lon = graph.nodes[next_node]['x']
-                            cab_nodes[cab.id] = next_node
-                    
-
-                    # This part runs for all cabs, regardless of how they moved
-                    location_data = {
-                        'cab_id': cab.id,
-                        'lat': cab.current_lat,
-                        'lon': cab.current_lon,
-                        'status': cab.status
-                    }
-                    
-                    sio.emit('update_location', location_data)
-                    print(f"Updated location for Cab ID {cab.id}: {location_data['lat']:.4f}, {location_data['lon']:.4f}, Status: {location_data['status']}")
-                
-                db.session.commit()
-                time.sleep(1) # Wait for 1 seconds before the next update
+            while not args.ticks or tick < args.ticks:
+                started = time.perf_counter()
+
+                # Destinations are set by allocation; only those rows are read, not every cab
+                destinations = db.session.execute(
+                    db.select(Cab.id, Cab.destination_latitude, Cab.destination_longitude)
+                    .where(Cab.destination_latitude.isnot(None))
+                ).all()
+                db.session.commit() # end the read transaction so the next tick sees new allocations
+                for cab_id, dest_lat, dest_lon in destinations:
+                    cab = index_of.get(cab_id)
+                    if cab is None or planned.get(cab) == (dest_lat, dest_lon):
+                        continue
+                    planned[cab] = (dest_lat, dest_lon)
+                    print(f"Cab {cab_id} calculating route to destination...")
+                    end_node = int(graph.snap(dest_lat, dest_lon)[0])
+                    planner.submit(cab, sim.next_node(cab), end_node)
+
+                # Routes planned in the pool since the last tick; the cabs kept driving meanwhile
+                for cab, end_node, route in planner.completed():
+                    if route is None:
+                        # No path: a one-node route makes the cab "arrive" right away
+                        route = [sim.next_node(cab)]
+                    if not sim.set_route(cab, route):
+                        planner.submit(cab, sim.next_node(cab), end_node)
+
+                arrived = sim.step(args.tick)
+
+                if arrived:
+                    # At the pickup: clear the destination so the cab isn't routed there again.
+                    # Its status is the server's; finishing or cancelling the trip frees it.
+                    db.session.execute(
+                        db.update(Cab.__table__)
+                        .where(Cab.__table__.c.id == db.bindparam('cab_id'))
+                        .values(destination_latitude=None, destination_longitude=None),
+                        [{'cab_id': int(cab_ids[cab])} for cab in arrived]
+                    )
+                    db.session.commit()
+                    for cab in arrived:
+                        planned.pop(cab, None)
+                        print(f"Cab {cab_ids[cab]} has arrived at its destination.")
+
+                # One batched message per EMIT_CHUNK cabs instead of one per cab. Positions
+                # only: the server owns the statuses (see apply_location_update)
+                lats, lons = sim.positions()
+                rows = [list(row) for row in zip(cab_ids.tolist(), lats.tolist(), lons.tolist())]
+                for start in range(0, len(rows), EMIT_CHUNK):
+                    sio.emit('update_locations', {'cabs': rows[start:start + EMIT_CHUNK]})
+
+                elapsed = time.perf_counter() - started
+                tick += 1
+                if tick % args.report_every == 0:
+                    report(tick, elapsed, len(sim), len(planner))
+                time.sleep(max(0.0, args.tick - elapsed))
 
     except KeyboardInterrupt:
         print("\nSimulation stopped by user.")
     finally:
+        planner.shutdown()
         if sio.connected:
-            sio.disconnect()
\ No newline at end of file
+            sio.disconnect()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move simulated cabs along the road graph.")
+    parser.add_argument('--cabs', type=int, default=NUM_CABS, help="number of cabs to simulate")
+    parser.add_argument('--tick', type=float, default=TICK_SECONDS, help="simulated seconds per tick")
+    parser.add_argument('--ticks', type=int, default=0, help="stop after this many ticks (0 = run forever)")
+    parser.add_argument('--headless', action='store_true', help="run the engine without the DB or a socket server")
+    parser.add_argument('--realtime', action='store_true', help="headless: sleep so ticks happen in real time")
+    parser.add_argument('--dispatch-rate', type=float, default=0.001, help="headless: chance per tick that an idle cab gets a random destination")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="route planning processes (0 = plan inline in the tick loop)")
+    parser.add_argument('--report-every', type=int, default=10, help="print timing every N ticks")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    # Load the compiled graph (run generate_graph.py first)
+    print(f"Loading graph from {GRAPH_FILE_PATH}...")
+    graph = load_road_network()
+    if graph is None:
+        exit()
+    print("Graph loaded successfully.")
+
+    try:
+        if args.headless:
+            run_headless(graph, args, rng)
+        else:
+            run_live(graph, args, rng)
+    except KeyboardInterrupt:
+        print("\nSimulation stopped by user.")